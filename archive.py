@@ -0,0 +1,340 @@
+from __future__ import annotations
+import codecs
+import os
+import tarfile
+import time
+import zipfile
+import dedup
+from contents import ContentStore, BytesStore
+from dedup import BlobStore
+from objects import Directory, File, ReadHandler
+
+# Bulk import into the tree, see Filesystem.import_tree / import_tar,
+# and streaming export of a subtree, see Filesystem.export
+#
+# Entries are created straight under their parent Directory, which is
+# known from the walk (archive folders are cached by path), so no path is
+# resolved twice. Contents are read chunk_size bytes at a time and
+# appended as they arrive, so memory outside the tree stays bounded by
+# one chunk no matter how big a file is
+# A file is imported as text if its contents are valid UTF-8, else binary
+# Symlinks & special files are skipped, so are archive members whose
+# path leaves the destination ("..")
+
+CHUNK_SIZE = 1 << 20
+
+
+# Creates the imported folders & files and counts them
+# Not thread safe; the folders' locks are taken for each link
+# Raises QuotaExceeded when a folder or file would go past a quota
+class Importer:
+    # blobs: BlobStore to deduplicate the files into, their contents are
+    #   hashed as they're read
+    def __init__(self, content_store: type[ContentStore], chunk_size: int = CHUNK_SIZE,
+                 blobs: BlobStore = None):
+        self.content_store = content_store
+        self.chunk_size = chunk_size
+        self.blobs = blobs
+        self.files = 0
+        self.dirs = 0
+        self.bytes = 0
+        self.skipped = 0
+        self._start = time.perf_counter()
+
+    # Import everything under the host directory host_path into dest
+    def tree(self, host_path: str, dest: Directory) -> None:
+        # Each entry: (host directory, folder it's imported into)
+        stack = [(host_path, dest)]
+        while stack:
+            path, dir = stack.pop()
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if (entry.is_symlink()):
+                        self.skipped += 1
+                    elif (entry.is_dir()):
+                        stack.append((entry.path, self.folder(dir, entry.name)))
+                    elif (entry.is_file()):
+                        with open(entry.path, "rb") as f:
+                            self.file(dir, entry.name, f)
+                    else:
+                        self.skipped += 1
+
+    # Import every member of a tar stream (plain or compressed) into dest
+    # Read front to back, so fileobj doesn't need to be seekable
+    def tar(self, fileobj, dest: Directory) -> None:
+        # member folder path -> Directory
+        folders = {"": dest}
+        with tarfile.open(fileobj=fileobj, mode="r|*") as archive:
+            for member in archive:
+                names = _member_names(member.name)
+                if (names is None):
+                    self.skipped += 1
+                elif (member.isdir()):
+                    self._archive_folder(folders, names)
+                elif (member.isfile()):
+                    parent = self._archive_folder(folders, names[:-1])
+                    self.file(parent, names[-1], archive.extractfile(member))
+                else:
+                    self.skipped += 1
+
+    # Folder at names under the archive's destination, created if missing
+    def _archive_folder(self, folders: dict, names: list[str]) -> Directory:
+        key = "/".join(names)
+        dir = folders.get(key)
+        if (dir is None):
+            dir = self.folder(self._archive_folder(folders, names[:-1]), names[-1])
+            folders[key] = dir
+        return dir
+
+    # The subfolder name of parent, created if missing
+    def folder(self, parent: Directory, name: str) -> Directory:
+        with parent.lock:
+            dir = parent.get_subfolder(name)
+            if (dir is None):
+                dir = parent.new_subfolder(name)
+                if (dir is None):
+                    raise QuotaExceeded(name)
+                self.dirs += 1
+        return dir
+
+    # Create file name under parent with the contents read from stream,
+    # replacing a file with the same name (kept if the new one is past a quota)
+    # The file is only linked once complete, so readers never see it partial
+    def file(self, parent: Directory, name: str, stream) -> File:
+        if (self.blobs is None):
+            store = self._read_store(stream)
+            buffer = None
+        else:
+            hasher = dedup.new_hasher()
+            store = self._read_store(stream, hasher)
+            buffer = self.blobs.buffer(store, dedup.key(store.is_binary, hasher))
+        with parent.lock:
+            file = parent.new_file(name, store, buffer)
+        if (file is None):
+            raise QuotaExceeded(name)
+        self.files += 1
+        return file
+
+    # Fill a new store from stream, chunk by chunk
+    # hasher: fed the raw bytes (a text store's contents as UTF-8)
+    def _read_store(self, stream, hasher=None) -> ContentStore:
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        store = self.content_store()
+        while True:
+            chunk = stream.read(self.chunk_size)
+            if (not chunk):
+                break
+            self.bytes += len(chunk)
+            if (hasher is not None):
+                hasher.update(chunk)
+            if (store.is_binary):
+                store.concat(chunk)
+                continue
+            try:
+                store.concat(decoder.decode(chunk))
+            except UnicodeDecodeError:
+                store = _to_binary(store, decoder, chunk)
+        if (not store.is_binary):
+            try:
+                store.concat(decoder.decode(b"", final=True))
+            except UnicodeDecodeError:
+                store = _to_binary(store, decoder, b"")
+        return store
+
+    # files, dirs, bytes, skipped & throughput since the import started
+    def stats(self) -> dict:
+        seconds = time.perf_counter() - self._start
+        return {
+            "files": self.files,
+            "dirs": self.dirs,
+            "bytes": self.bytes,
+            "skipped": self.skipped,
+            "seconds": seconds,
+            "files_per_sec": self.files / seconds if seconds > 0 else 0.0,
+            "mb_per_sec": self.bytes / 1e6 / seconds if seconds > 0 else 0.0,
+        }
+
+
+# Turn a text store that turned out not to be UTF-8 into a binary one:
+# what was decoded so far, the bytes the decoder holds back, then chunk
+def _to_binary(store: ContentStore, decoder: codecs.IncrementalDecoder, chunk: bytes) -> BytesStore:
+    pending = decoder.getstate()[0]
+    return BytesStore(store.get().encode("utf-8") + pending + chunk)
+
+
+# Path components of an archive member, None if it would leave the
+# destination or has no name
+def _member_names(path: str) -> list[str] | None:
+    names = [name for name in path.split("/") if name not in ("", ".")]
+    if (not names or ".." in names):
+        return None
+    return names
+
+
+# Archive formats Filesystem.export writes
+EXPORT_FORMATS = ("tar", "zip")
+
+
+# A file being exported stayed locked by a writer past the lock timeout
+class LockTimeout(Exception):
+    pass
+
+
+# An imported folder or file would go past a quota (see Directory.set_quota)
+class QuotaExceeded(Exception):
+    pass
+
+
+# Streams a subtree into a tar or zip archive and counts what it wrote
+# Folders are walked lazily and every file is read through a read
+# handler chunk_size at a time, straight into the archive writer: memory
+# stays bounded by a chunk (plus the walk's stack), whatever the tree size
+# Each file is read under its lock so it's archived as of one moment; the
+# tree as a whole isn't frozen (export a snapshot for that)
+class Exporter:
+    # lock_timeout: max seconds to wait for a file's writer, None waits forever
+    def __init__(self, chunk_size: int = CHUNK_SIZE, lock_timeout: float = None):
+        self.chunk_size = chunk_size
+        self.lock_timeout = lock_timeout
+        self.files = 0
+        self.dirs = 0
+        self.bytes = 0
+        self._start = time.perf_counter()
+        self._mtime = time.time()
+
+    # Write dir & everything under it to fileobj as a tar (.tar.gz if compress)
+    # Written front to back, so fileobj doesn't need to be seekable
+    def tar(self, dir: Directory, fileobj, compress: bool = False) -> None:
+        with tarfile.open(fileobj=fileobj, mode="w|gz" if compress else "w|",
+                          format=tarfile.PAX_FORMAT) as archive:
+            for name, node in _entries(dir):
+                info = tarfile.TarInfo(name)
+                info.mtime = self._mtime
+                if (isinstance(node, Directory)):
+                    info.type = tarfile.DIRTYPE
+                    info.mode = 0o755
+                    archive.addfile(info)
+                    self.dirs += 1
+                else:
+                    info.mode = 0o644
+                    with self._reader(node) as reader:
+                        info.size = reader.size()
+                        archive.addfile(info, reader)
+                    self.files += 1
+                    self.bytes += info.size
+                # TarFile keeps every member it wrote, drop them as we go
+                archive.members.clear()
+
+    # Write dir & everything under it to fileobj as a zip (deflated if compress)
+    # The zip format ends with a directory of every entry, so unlike tar
+    # this keeps a small record per entry until the end
+    def zip(self, dir: Directory, fileobj, compress: bool = False) -> None:
+        compression = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+        with zipfile.ZipFile(fileobj, "w", compression) as archive:
+            date_time = time.localtime(self._mtime)[:6]
+            for name, node in _entries(dir):
+                if (isinstance(node, Directory)):
+                    info = zipfile.ZipInfo(name + "/", date_time)
+                    info.external_attr = (0o40755 << 16) | 0x10
+                    archive.writestr(info, b"")
+                    self.dirs += 1
+                    continue
+                info = zipfile.ZipInfo(name, date_time)
+                info.external_attr = 0o644 << 16
+                info.compress_type = compression
+                with self._reader(node) as reader:
+                    info.file_size = reader.size()
+                    with archive.open(info, "w") as dest:
+                        while True:
+                            data = reader.read(self.chunk_size)
+                            if (not data):
+                                break
+                            dest.write(data)
+                self.files += 1
+                self.bytes += info.file_size
+
+    # Open file for reading; raises LockTimeout if it stays locked
+    def _reader(self, file: File) -> _ContentReader:
+        rh = ReadHandler(file)
+        if (not rh.open(timeout=self.lock_timeout)):
+            raise LockTimeout(file.get_path())
+        return _ContentReader(rh, self.chunk_size)
+
+    # files, dirs, bytes & throughput since the export started
+    def stats(self) -> dict:
+        seconds = time.perf_counter() - self._start
+        return {
+            "files": self.files,
+            "dirs": self.dirs,
+            "bytes": self.bytes,
+            "seconds": seconds,
+            "files_per_sec": self.files / seconds if seconds > 0 else 0.0,
+            "mb_per_sec": self.bytes / 1e6 / seconds if seconds > 0 else 0.0,
+        }
+
+
+# Archive name & node of dir (unless it's the root) and everything under it,
+# parents before their children; names are relative to dir's parent
+def _entries(dir: Directory):
+    if (dir.is_root):
+        base = 0
+    else:
+        base = len(dir.path) - len(dir.name)
+        yield dir.name, dir
+    for path, node in dir.walk():
+        yield path[base:].lstrip("/"), node
+
+
+# File-like reader of an open read handler's contents as bytes
+# (UTF-8 for text files); closes the handler on exit
+# read(n) returns exactly n bytes until EoF, as tarfile expects
+class _ContentReader:
+    def __init__(self, rh: ReadHandler, chunk_size: int):
+        self._rh = rh
+        self._chunk_size = chunk_size
+        self._binary = rh.file.is_binary
+        # Encoded text not returned yet
+        self._pending = b""
+
+    def __enter__(self) -> _ContentReader:
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        self._rh.close()
+        return False
+
+    # Size in bytes; a text file larger than a chunk is encoded twice
+    # (once here to count) rather than held encoded in memory
+    def size(self) -> int:
+        rh = self._rh
+        if (self._binary):
+            return len(rh.file.store)
+        if (len(rh.file.store) <= self._chunk_size):
+            self._pending = rh.read_to_end().encode("utf-8")
+            return len(self._pending)
+        size = 0
+        while True:
+            text = rh.read_next(self._chunk_size)
+            if (not text):
+                break
+            size += len(text.encode("utf-8"))
+        rh.move_cursor_abs(0)
+        return size
+
+    def read(self, n: int = -1) -> bytes:
+        rh = self._rh
+        if (self._binary):
+            # Zero-copy slice of the contents
+            return rh.read_view(None if n is None or n < 0 else n)
+        if (n is None or n < 0):
+            data = self._pending + rh.read_to_end().encode("utf-8")
+            self._pending = b""
+            return data
+        while (len(self._pending) < n):
+            text = rh.read_next(max(n, self._chunk_size))
+            if (not text):
+                break
+            self._pending += text.encode("utf-8")
+        data = self._pending[:n]
+        self._pending = self._pending[n:]
+        return data
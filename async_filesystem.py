@@ -0,0 +1,249 @@
+from __future__ import annotations
+import asyncio
+import functools
+import re
+import threading
+import time
+import weakref
+from concurrent.futures import Executor
+from filesystem import Filesystem, Snapshot
+from objects import Directory, File, FileHandler
+from errors import ErrorCode, last_error, clear_error, set_error
+
+# How often a waiting open re-checks whether its task was cancelled (seconds)
+_POLL_INTERVAL = 0.05
+
+
+# asyncio front-end for a Filesystem
+# Mirrors the Filesystem API with coroutines so callers never block the loop:
+#   - namespace operations run on an executor thread (Filesystem is thread safe)
+#   - handler opens are awaited; tasks waiting on the same file are served
+#     in the order they asked, instead of failing while the file is busy
+#   - recursive find walks the tree on the loop in chunks, yielding in between
+# File locks are held on behalf of the current task, so a task with an open
+# write handler can still read_file the same file
+class AsyncFilesystem:
+    # fs: Filesystem to wrap, a new one by default
+    # executor: where blocking calls run, the loop's default executor by default
+    # chunk_size: nodes find visits before yielding to the loop
+    def __init__(self, fs: Filesystem = None, executor: Executor = None, chunk_size: int = 512):
+        self.fs = fs if fs is not None else Filesystem()
+        self.executor = executor
+        self.chunk_size = chunk_size
+        # File -> asyncio.Lock that queues this wrapper's waiters for the file
+        self._queues = weakref.WeakKeyDictionary()
+
+    # Run a blocking Filesystem call on the executor
+    # A failure's error (see errors.py) is passed back to the calling task
+    async def _run(self, func: function, *args):
+        loop = asyncio.get_running_loop()
+        result, error = await loop.run_in_executor(self.executor, functools.partial(_call, func, *args))
+        if (error is not None):
+            set_error(error)
+        return result
+
+    async def changedir(self, path: str) -> bool:
+        return await self._run(self.fs.changedir, path)
+
+    async def mkdir(self, path: str, option="") -> Directory:
+        return await self._run(self.fs.mkdir, path, option)
+
+    async def mkfile(self, path: str, option="", binary: bool = False) -> File:
+        return await self._run(self.fs.mkfile, path, option, binary)
+
+    # Only touch the current dir, cheap enough to run on the loop
+    async def list_folders(self) -> list[str]:
+        return self.fs.list_folders()
+
+    async def list_files(self) -> list[str]:
+        return self.fs.list_files()
+
+    async def get_current_path(self) -> str:
+        return self.fs.get_current_path()
+
+    async def remove_dir(self, path: str) -> bool:
+        return await self._run(self.fs.remove_dir, path)
+
+    async def remove_file(self, path: str) -> bool:
+        return await self._run(self.fs.remove_file, path)
+
+    async def move_file(self, source_file_path: str, dest_path: str, option="") -> bool:
+        return await self._run(self.fs.move_file, source_file_path, dest_path, option)
+
+    async def copy_file(self, source_file_path: str, dest_path: str, option="") -> bool:
+        return await self._run(self.fs.copy_file, source_file_path, dest_path, option)
+
+    async def move_dir(self, source_dir_path: str, dest_path: str, option="") -> bool:
+        return await self._run(self.fs.move_dir, source_dir_path, dest_path, option)
+
+    async def copy_dir(self, source_dir_path: str, dest_path: str, option="") -> bool:
+        return await self._run(self.fs.copy_dir, source_dir_path, dest_path, option)
+
+    # Same as Filesystem.batch(ops), applied on one executor thread
+    async def batch(self, ops: list[tuple], atomic: bool = False) -> list:
+        return await self._run(self.fs.batch, ops, atomic)
+
+    async def snapshot(self, name: str = None) -> Snapshot:
+        return await self._run(self.fs.snapshot, name)
+
+    async def restore(self, snapshot: Snapshot | str) -> bool:
+        return await self._run(self.fs.restore, snapshot)
+
+    # Get an open R/W handler for a file, waiting until it can be opened
+    # Tasks waiting on the same file get it in the order they asked
+    # timeout: max seconds to wait, None waits forever
+    # Returns None if invalid path, file doesn't exist, or the wait timed out
+    # Close the handler with handler.close() when done
+    async def open_handler(self, file_path: str, is_write: bool, timeout: float = None) -> FileHandler:
+        handler = await self._run(self.fs.getFileHandlerFromPath, file_path, is_write)
+        if (handler is None):
+            return None
+        try:
+            opened = await asyncio.wait_for(self._open(handler), timeout)
+        except asyncio.TimeoutError:
+            opened = False
+        if (not opened):
+            return self.fs._fail(ErrorCode.FILE_BUSY)
+        return handler
+
+    # Open handler for the current task, queueing behind earlier waiters
+    async def _open(self, handler: FileHandler) -> bool:
+        owner = asyncio.current_task()
+        queue = self._queues.get(handler.file)
+        if (queue is None):
+            queue = self._queues[handler.file] = asyncio.Lock()
+        # Fast path, unless that would jump ahead of tasks already waiting
+        # Opening may decompress the file (see compression.py), so even the
+        # attempt that doesn't wait runs on the executor
+        if (not queue.locked() and await self._open_off_loop(handler, owner)):
+            return True
+        # asyncio.Lock wakes waiters in FIFO order; only the head of the
+        # queue waits on the file lock, from one executor thread
+        async with queue:
+            cancelled = threading.Event()
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(
+                self.executor, _wait_open, handler, owner, cancelled)
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                cancelled.set()
+                # It may still have opened before noticing the cancel
+                future.add_done_callback(
+                    lambda f: handler.close() if not f.cancelled() and f.result() else None)
+                raise
+
+    # Try opening handler without waiting, on an executor thread
+    # A task cancelled meanwhile closes the handler if it did open
+    async def _open_off_loop(self, handler: FileHandler, owner) -> bool:
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(
+            self.executor, functools.partial(handler.open, blocking=False, owner=owner))
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            future.add_done_callback(
+                lambda f: handler.close() if not f.cancelled() and f.result() else None)
+            raise
+
+    # Read the contents of the file
+    # Reading flattens the whole file, so it runs on the executor too
+    async def read_file(self, file_path: str) -> str:
+        fh = await self.open_handler(file_path, False, self.fs.lock_timeout)
+        if (fh is None):
+            return ""
+        try:
+            contents = await self._run(fh.read)
+        finally:
+            fh.close()
+        return contents
+
+    # Write to file, same options as Filesystem.write_file
+    async def write_file(self, file_path: str, contents: str, option="") -> bool:
+        fh = await self.open_handler(file_path, True, self.fs.lock_timeout)
+        if (fh is None):
+            return False
+        if (not fh.accepts(contents)):
+            await self._run(fh.close)
+            return self.fs._fail(ErrorCode.WRONG_CONTENTS_TYPE, False)
+        # With a journal the edit waits for disk, and with dedup closing
+        # hashes the file: keep both off the loop
+        try:
+            if (option == "-a"):
+                written = await self._run(fh.concat, (b"\n" if fh.file.is_binary else "\n") + contents)
+            elif (option == "-c"):
+                written = await self._run(fh.concat, contents)
+            else:
+                written = await self._run(fh.write, contents)
+        finally:
+            await self._run(fh.close)
+        if (not written):
+            return self.fs._fail(ErrorCode.QUOTA_EXCEEDED, False)
+        return True
+
+    # Same as Filesystem.find_with_regex
+    # With "-r" the name index is tried first (off the loop), otherwise the
+    # tree is walked in chunks, see find_iter
+    async def find_with_regex(self, regex: str, path: str, option="") -> tuple[list, list]:
+        starting_dir = await self._run(self.fs.get_directory, path)
+        if (starting_dir is None):
+            return self.fs._fail(ErrorCode.INVALID_PATH)
+        pattern = re.compile(regex)
+        matches = None
+        if (option == "-r"):
+            matches = await self._run(self.fs._find_indexed, pattern, starting_dir)
+        if (matches is None):
+            matches = [match async for match in self._find_under(pattern, starting_dir, option)]
+            if (option == "-r"):
+                matches.sort(key=lambda match: match[0])
+        file_output = []
+        folder_output = []
+        for match_path, node in matches:
+            if isinstance(node, File):
+                file_output.append(match_path)
+            else:
+                folder_output.append(match_path)
+        return (file_output, folder_output)
+
+    # Async version of Filesystem.find_iter
+    # Yields tuple(path, node) for each match, and yields to the loop
+    # every chunk_size nodes visited so a big walk never stalls it
+    async def find_iter(self, regex: str, path: str, option=""):
+        starting_dir = await self._run(self.fs.get_directory, path)
+        if (starting_dir is None):
+            self.fs._fail(ErrorCode.INVALID_PATH)
+            return
+        async for match in self._find_under(re.compile(regex), starting_dir, option):
+            yield match
+
+    async def _find_under(self, pattern: re.Pattern, starting_dir: Directory, option=""):
+        # Without -r only look at the direct children
+        prune = None if option == "-r" else (lambda path, dir: True)
+        visited = 0
+        for match_path, node in starting_dir.walk(prune=prune):
+            if pattern.match(node.name) is not None:
+                yield match_path, node
+            visited += 1
+            if (visited % self.chunk_size == 0):
+                await asyncio.sleep(0)
+
+
+# Runs on an executor thread: func(*args) and the error it failed with
+# Returns tuple(result, FsError or None)
+def _call(func: function, *args) -> tuple:
+    clear_error()
+    return func(*args), last_error()
+
+
+# Runs on an executor thread: block until handler opens or cancelled is set
+# Waits in short slices so a cancelled task doesn't leave a thread behind
+def _wait_open(handler: FileHandler, owner, cancelled: threading.Event) -> bool:
+    while (not cancelled.is_set()):
+        start = time.monotonic()
+        if (handler.open(timeout=_POLL_INTERVAL, owner=owner)):
+            return True
+        # Failing without waiting means it would never succeed
+        # (e.g. the task already holds the write handler)
+        if (time.monotonic() - start < _POLL_INTERVAL):
+            return False
+    return False
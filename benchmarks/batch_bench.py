@@ -0,0 +1,66 @@
+import argparse
+import gc
+import tempfile
+import time
+from filesystem import Filesystem
+
+# Throughput of Filesystem.batch vs the same calls one by one
+# Run from the repo root:  python -m benchmarks.batch_bench
+#
+# A loader creating and writing files under a few deep folders
+
+
+def make_ops(files: int, folders: int) -> list[tuple]:
+    ops = [("mkdir", "/data/set%d/deep/er" % d, "-p") for d in range(folders)]
+    for i in range(files):
+        path = "/data/set%d/deep/er/f%d" % (i % folders, i)
+        ops.append(("mkfile", path))
+        ops.append(("write_file", path, "contents " + str(i)))
+    return ops
+
+
+# Returns ops/sec
+def run(fs: Filesystem, ops: list[tuple], batched: bool) -> float:
+    gc.collect()
+    start = time.perf_counter()
+    if (batched):
+        fs.batch(ops)
+    else:
+        for op, *args in ops:
+            getattr(fs, op)(*args)
+    if (fs.journal is not None):
+        fs.journal.flush()
+    return len(ops) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=50000)
+    parser.add_argument("--folders", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=3, help="best of")
+    args = parser.parse_args()
+
+    ops = make_ops(args.files, args.folders)
+    configs = [
+        ("in-memory", None),
+        ("journal sync, fsync", dict(sync=True, fsync=True)),
+    ]
+    print("%-22s %14s %14s %9s" % ("config", "one by one", "batched", "speedup"))
+    for name, options in configs:
+        rates = []
+        for batched in (False, True):
+            best = 0
+            for _ in range(args.repeat):
+                with tempfile.TemporaryDirectory() as directory:
+                    if (options is None):
+                        fs = Filesystem()
+                    else:
+                        fs = Filesystem.recover(directory, checkpoint_every=None, **options)
+                    best = max(best, run(fs, ops, batched))
+                    fs.close()
+            rates.append(best)
+        print("%-22s %14.0f %14.0f %8.2fx" % (name, rates[0], rates[1], rates[1] / rates[0]))
+
+
+if __name__ == "__main__":
+    main()
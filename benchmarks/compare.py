@@ -0,0 +1,60 @@
+from __future__ import annotations
+import argparse
+import json
+import sys
+
+# Compare two JSON results saved by run.py --output
+# Run from the repo root:  python -m benchmarks.compare old.json new.json
+# Exits 1 if any scenario got slower than the threshold allows
+
+
+# Returns a row per scenario in both results:
+#   dict(name, baseline, current (ops/sec), ratio (current / baseline), status)
+# status: "ok", "faster", "REGRESSION" (ratio < 1 - threshold),
+#   or "params differ" (not comparable, e.g. run at another --scale)
+def compare(baseline: dict, current: dict, threshold: float = 0.10) -> list[dict]:
+    rows = []
+    for name, result in current["results"].items():
+        old = baseline["results"].get(name)
+        if (old is None):
+            continue
+        ratio = result["ops_per_sec"] / old["ops_per_sec"] if old["ops_per_sec"] else 0.0
+        if (old["params"] != result["params"]):
+            status = "params differ"
+        elif (ratio < 1 - threshold):
+            status = "REGRESSION"
+        elif (ratio > 1 + threshold):
+            status = "faster"
+        else:
+            status = "ok"
+        rows.append({"name": name, "baseline": old["ops_per_sec"],
+                     "current": result["ops_per_sec"], "ratio": ratio, "status": status})
+    return rows
+
+
+def print_comparison(rows: list[dict]) -> None:
+    print("%-18s %14s %14s %8s  %s" % ("scenario", "baseline/s", "current/s", "ratio", "status"))
+    for row in rows:
+        print("%-18s %14.0f %14.0f %7.2fx  %s" % (
+            row["name"], row["baseline"], row["current"], row["ratio"], row["status"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark results")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="max allowed slowdown (0.10 = 10%%)")
+    args = parser.parse_args()
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    rows = compare(baseline, current, args.threshold)
+    print_comparison(rows)
+    if (any(row["status"] == "REGRESSION" for row in rows)):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+from __future__ import annotations
+import argparse
+import random
+import time
+from filesystem import Filesystem
+
+# Cold contents compression: resident vs logical size, and read cost of
+# hot (plain), cached (decompressed copy in the LRU) and cold files
+# Run from the repo root:  python -m benchmarks.compression_bench
+#
+# Files are log-like text of --size chars; every one is written once,
+# then all but the hot set go cold
+
+
+def make_text(rng: random.Random, size: int) -> str:
+    words = ["GET", "POST", "/api/v1/items", "/login", "200", "404", "500", "ms", "user"]
+    lines = []
+    length = 0
+    while (length < size):
+        line = "%d %s\n" % (rng.randrange(10 ** 9), " ".join(rng.choice(words) for _ in range(6)))
+        lines.append(line)
+        length += len(line)
+    return "".join(lines)[:size]
+
+
+# Microseconds per read_file of each path, best of repeat
+def read_us(fs: Filesystem, paths: list[str], repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for path in paths:
+            fs.read_file(path)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(paths) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold contents compression")
+    parser.add_argument("--files", type=int, default=5000)
+    parser.add_argument("--size", type=int, default=16384, help="file size (chars)")
+    parser.add_argument("--hot", type=int, default=100, help="files kept hot")
+    args = parser.parse_args()
+    rng = random.Random(0)
+
+    print("%-6s %12s %12s %8s %10s %10s %10s" % (
+        "codec", "logical MB", "resident MB", "ratio", "hot us", "cached us", "cold us"))
+    for codec in ("zlib", "lzma"):
+        fs = Filesystem()
+        # Cache room for the hot set only
+        fs.enable_compression(codec, after_ops=args.hot * 2, cache_bytes=args.hot * args.size)
+        paths = ["/f" + str(i) for i in range(args.files)]
+        for path in paths:
+            fs.mkfile(path)
+            fs.write_file(path, make_text(rng, args.size))
+        fs.compress()
+        usage = fs.content_usage()
+        hot = paths[:args.hot]
+        cold = paths[args.hot:args.hot * 3]
+        # plain: never compressed (no policy)
+        plain = Filesystem()
+        for path in hot:
+            plain.mkfile(path)
+            plain.write_file(path, fs.read_file(path))
+        hot_us = read_us(plain, hot, 3)
+        cached_us = read_us(fs, hot, 3)
+        # each read decompresses: the cold set doesn't fit the cache
+        cold_us = read_us(fs, cold, 1)
+        print("%-6s %12.1f %12.1f %8.2f %10.1f %10.1f %10.1f" % (
+            codec, usage["logical_bytes"] / 1e6, usage["resident_bytes"] / 1e6,
+            usage["logical_bytes"] / max(usage["resident_bytes"], 1), hot_us, cached_us, cold_us))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+from __future__ import annotations
+import argparse
+import gc
+import time
+import tracemalloc
+from filesystem import Filesystem
+
+# Deduplication: memory held by file contents & write throughput,
+# with and without Filesystem(dedup=True)
+# Run from the repo root:  python -m benchmarks.dedup_bench
+#
+# Every project gets the same few template files plus one file of its
+# own, written independently (mkfile + write_file, no copies)
+
+
+def build(fs: Filesystem, projects: int, size: int) -> None:
+    templates = [("LICENSE", "license text\n"), ("setup.cfg", "[metadata]\n"),
+                 ("README", "readme\n"), ("Makefile", "all:\n")]
+    templates = [(name, (text * (size // len(text) + 1))[:size]) for name, text in templates]
+    for i in range(projects):
+        prefix = "/p" + str(i) + "/"
+        fs.mkdir(prefix[:-1])
+        for name, text in templates:
+            fs.mkfile(prefix + name)
+            fs.write_file(prefix + name, text)
+        fs.mkfile(prefix + "main.py")
+        fs.write_file(prefix + "main.py", ("print(%d)\n" % i) * (size // 10))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deduplication memory & throughput")
+    parser.add_argument("--projects", type=int, default=5000)
+    parser.add_argument("--size", type=int, default=4096, help="file size (chars)")
+    args = parser.parse_args()
+    files = args.projects * 5
+    print("%-8s %12s %12s %10s %10s" % ("dedup", "files/sec", "MB held", "ratio", "MB saved"))
+    for dedup in (False, True):
+        fs = Filesystem(dedup=dedup)
+        start = time.perf_counter()
+        build(fs, args.projects, args.size)
+        seconds = time.perf_counter() - start
+
+        fs = Filesystem(dedup=dedup)
+        gc.collect()
+        tracemalloc.start()
+        try:
+            build(fs, args.projects, args.size)
+            gc.collect()
+            held = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        stats = fs.dedup_stats() if dedup else {"dedup_ratio": 1.0, "saved_bytes": 0}
+        print("%-8s %12.0f %12.1f %10.2f %10.1f" % (
+            dedup, files / seconds, held / 1e6, stats["dedup_ratio"], stats["saved_bytes"] / 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+from __future__ import annotations
+import argparse
+import time
+from filesystem import Filesystem
+from objects import File
+
+# Usage totals: fs.du (maintained per folder) vs summing a walk of the
+# subtree, and what keeping them up to date costs writes at a given depth
+# Run from the repo root:  python -m benchmarks.du_bench
+#
+# The tree is --tenants folders of --files files each (--size chars)
+
+
+def build(fs: Filesystem, tenants: int, files: int, size: int) -> None:
+    text = "x" * size
+    for t in range(tenants):
+        for i in range(files):
+            path = "/tenant%d/d%d/f%d" % (t, i % 10, i)
+            fs.mkfile(path, "-p")
+            fs.write_file(path, text)
+
+
+# What du answers, by walking
+def walk_du(fs: Filesystem, path: str) -> dict:
+    bytes = files = dirs = 0
+    for _, node in fs.get_directory(path).walk():
+        if (isinstance(node, File)):
+            bytes += len(node.store)
+            files += 1
+        else:
+            dirs += 1
+    return {"bytes": bytes, "files": files, "dirs": dirs}
+
+
+# Microseconds per call of func, best of repeat
+def time_us(func, calls: int, repeat: int = 3) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(calls):
+            func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="du vs walking, write cost per depth")
+    parser.add_argument("--tenants", type=int, default=20)
+    parser.add_argument("--files", type=int, default=1000, help="files per tenant")
+    parser.add_argument("--size", type=int, default=1024, help="file size (chars)")
+    parser.add_argument("--writes", type=int, default=20000)
+    args = parser.parse_args()
+
+    fs = Filesystem()
+    build(fs, args.tenants, args.files, args.size)
+    assert fs.du("/tenant0") == walk_du(fs, "/tenant0")
+    print("%-10s %12s %12s" % ("du of", "du us", "walk us"))
+    for path in ("/tenant0", "/"):
+        calls = 10 if path == "/" else 100
+        print("%-10s %12.1f %12.1f" % (
+            path, time_us(lambda: fs.du(path), 1000), time_us(lambda: walk_du(fs, path), calls)))
+
+    # Each write_file -c walks up to the root to update the totals
+    print("\n%-6s %14s %14s" % ("depth", "write us", "with quota us"))
+    for depth in (1, 8, 32):
+        fs = Filesystem()
+        path = "".join("/d%d" % i for i in range(depth - 1)) + "/f"
+        fs.mkfile(path, "-p")
+        plain = time_us(lambda: fs.write_file(path, "x", "-c"), args.writes)
+        fs.set_quota("/", max_bytes=1 << 40)
+        capped = time_us(lambda: fs.write_file(path, "x", "-c"), args.writes)
+        print("%-6d %14.2f %14.2f" % (depth, plain, capped))
+
+
+if __name__ == "__main__":
+    main()
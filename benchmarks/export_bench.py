@@ -0,0 +1,61 @@
+from __future__ import annotations
+import argparse
+import os
+import tempfile
+import tracemalloc
+from benchmarks.import_bench import make_host_tree
+from filesystem import Filesystem
+
+# Streaming export throughput & peak memory, tar / tar.gz / zip
+# Run from the repo root:  python -m benchmarks.export_bench
+#
+# The tree is imported from the same host tree as import_bench. Archives
+# are written to a sink that only counts bytes, so the peak memory (a
+# second, traced run) is what export itself holds: for tar it stays around
+# a chunk whatever --files is, zip adds its central directory (per entry)
+
+
+# Write-only file object counting what it's given
+class CountingSink:
+    def __init__(self):
+        self.bytes = 0
+
+    def write(self, data) -> int:
+        self.bytes += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Streaming export throughput")
+    parser.add_argument("--files", type=int, default=20000)
+    parser.add_argument("--size", type=int, default=4096, help="average file size (bytes)")
+    parser.add_argument("--repeat", type=int, default=3, help="best of")
+    args = parser.parse_args()
+
+    fs = Filesystem()
+    with tempfile.TemporaryDirectory() as directory:
+        root = os.path.join(directory, "tree")
+        make_host_tree(root, args.files, args.size)
+        fs.import_tree(root)
+
+    formats = [("tar", "tar", False), ("tar.gz", "tar", True), ("zip", "zip", False)]
+    print("%-8s %8s %10s %12s %10s %12s" % ("format", "files", "archive MB", "files/sec", "MB/sec", "peak KB"))
+    for name, format, compress in formats:
+        best = max((fs.export("/", CountingSink(), format, compress) for _ in range(args.repeat)),
+                   key=lambda stats: stats["files_per_sec"])
+        sink = CountingSink()
+        tracemalloc.start()
+        try:
+            fs.export("/", sink, format, compress)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        print("%-8s %8d %10.1f %12.0f %10.1f %12.0f" % (
+            name, best["files"], sink.bytes / 1e6, best["files_per_sec"], best["mb_per_sec"], peak / 1024))
+
+
+if __name__ == "__main__":
+    main()
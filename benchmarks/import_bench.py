@@ -0,0 +1,88 @@
+from __future__ import annotations
+import argparse
+import os
+import random
+import tarfile
+import tempfile
+import time
+from filesystem import Filesystem
+
+# Bulk import throughput: import_tree / import_tar vs mkfile + write_file
+# per file (reading each host file whole)
+# Run from the repo root:  python -m benchmarks.import_bench
+#
+# The host tree is a few levels of folders with files of random sizes
+# around --size, mostly text with some binary files
+
+
+def make_host_tree(root: str, files: int, size: int, fanout: int = 20) -> None:
+    rng = random.Random(files)
+    for i in range(files):
+        folder = os.path.join(root, "d" + str(i // (fanout * fanout)), "e" + str(i // fanout % fanout))
+        os.makedirs(folder, exist_ok=True)
+        length = rng.randrange(size // 2, size * 3 // 2 + 1)
+        if (i % 10 == 0):
+            data = rng.randbytes(length)
+        else:
+            data = (("line %d of file %d\n" % (i, i)) * (length // 20 + 1))[:length].encode()
+        with open(os.path.join(folder, "f" + str(i)), "wb") as f:
+            f.write(data)
+
+
+# One mkfile -p + write_file per host file
+def import_one_by_one(fs: Filesystem, root: str) -> dict:
+    start = time.perf_counter()
+    files = 0
+    total = 0
+    for folder, _, names in os.walk(root):
+        relative = os.path.relpath(folder, root)
+        prefix = "/" if relative == "." else "/" + relative.replace(os.sep, "/") + "/"
+        for name in names:
+            with open(os.path.join(folder, name), "rb") as f:
+                data = f.read()
+            try:
+                contents, binary = data.decode(), False
+            except UnicodeDecodeError:
+                contents, binary = data, True
+            fs.mkfile(prefix + name, "-p", binary)
+            fs.write_file(prefix + name, contents)
+            files += 1
+            total += len(data)
+    seconds = time.perf_counter() - start
+    return {"files": files, "bytes": total, "files_per_sec": files / seconds,
+            "mb_per_sec": total / 1e6 / seconds}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import throughput")
+    parser.add_argument("--files", type=int, default=20000)
+    parser.add_argument("--size", type=int, default=4096, help="average file size (bytes)")
+    parser.add_argument("--repeat", type=int, default=3, help="best of")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        root = os.path.join(directory, "tree")
+        make_host_tree(root, args.files, args.size)
+        archive = os.path.join(directory, "tree.tar")
+        with tarfile.open(archive, "w") as tar:
+            tar.add(root, arcname=".")
+
+        def import_tar(fs: Filesystem, root: str) -> dict:
+            with open(archive, "rb") as f:
+                return fs.import_tar(f)
+
+        methods = [
+            ("mkfile + write_file", import_one_by_one),
+            ("import_tree", lambda fs, root: fs.import_tree(root)),
+            ("import_tar", import_tar),
+        ]
+        print("%-22s %8s %10s %12s %10s" % ("method", "files", "MB", "files/sec", "MB/sec"))
+        for name, run in methods:
+            best = max((run(Filesystem(), root) for _ in range(args.repeat)),
+                       key=lambda stats: stats["files_per_sec"])
+            print("%-22s %8d %10.1f %12.0f %10.1f" % (
+                name, best["files"], best["bytes"] / 1e6, best["files_per_sec"], best["mb_per_sec"]))
+
+
+if __name__ == "__main__":
+    main()
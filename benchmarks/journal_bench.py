@@ -0,0 +1,79 @@
+import argparse
+import tempfile
+import threading
+import time
+from filesystem import Filesystem
+
+# Throughput of journaled mutations vs the in-memory only Filesystem
+# Run from the repo root:  python -m benchmarks.journal_bench
+#
+# Each thread creates a folder, then files in it and writes to them,
+# so threads don't contend on the same folders
+
+
+# ops run by one thread: mkdir + per file (mkfile, write, append)
+def workload(fs: Filesystem, thread: int, files: int) -> int:
+    root = "/t" + str(thread)
+    fs.mkdir(root)
+    for i in range(files):
+        path = root + "/f" + str(i)
+        fs.mkfile(path)
+        fs.write_file(path, "contents " + str(i))
+        fs.write_file(path, "more", "-a")
+    return 1 + 3 * files
+
+
+# Returns ops/sec
+def run(fs: Filesystem, threads: int, files: int) -> float:
+    counts = [0] * threads
+    barrier = threading.Barrier(threads + 1)
+
+    def target(t):
+        barrier.wait()
+        counts[t] = workload(fs, t, files)
+    workers = [threading.Thread(target=target, args=(t,)) for t in range(threads)]
+    for w in workers:
+        w.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for w in workers:
+        w.join()
+    if (fs.journal is not None):
+        fs.journal.flush()
+    return sum(counts) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=2000, help="files per thread")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4])
+    args = parser.parse_args()
+
+    configs = [
+        ("in-memory", None),
+        ("journal sync, fsync", dict(sync=True, fsync=True)),
+        ("journal sync, fsync, 1ms delay", dict(sync=True, fsync=True, batch_delay=0.001)),
+        ("journal sync, no fsync", dict(sync=True, fsync=False)),
+        ("journal async, batch 256/10ms", dict(sync=False, batch_size=256, batch_delay=0.01)),
+    ]
+    print("%-34s %8s %12s %9s %12s" % ("config", "threads", "ops/sec", "vs mem", "ops/fsync"))
+    for threads in args.threads:
+        baseline = None
+        for name, options in configs:
+            with tempfile.TemporaryDirectory() as directory:
+                if (options is None):
+                    fs = Filesystem()
+                else:
+                    fs = Filesystem.recover(directory, checkpoint_every=None, **options)
+                rate = run(fs, threads, args.files)
+                per_batch = ""
+                if (fs.journal is not None):
+                    per_batch = "%.1f" % (fs.journal.records / max(fs.journal.batches, 1))
+                    fs.close()
+            if (baseline is None):
+                baseline = rate
+            print("%-34s %8d %12.0f %8.2fx %12s" % (name, threads, rate, rate / baseline, per_batch))
+
+
+if __name__ == "__main__":
+    main()
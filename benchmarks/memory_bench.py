@@ -0,0 +1,87 @@
+from __future__ import annotations
+import argparse
+import gc
+import tracemalloc
+from filesystem import Filesystem
+
+# Memory per tree node
+# Run from the repo root:  python -m benchmarks.memory_bench
+#
+# Counts every byte allocated while building the tree (tracemalloc), so
+# it includes the child maps, the name strings & index entries, and each
+# file's contents buffer
+
+
+# Bytes allocated by build(fs), divided by the nodes it reports creating
+def bytes_per_node(build: function, nodes: int) -> float:
+    fs = Filesystem()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        build(fs, nodes)
+        gc.collect()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return (after - before) / nodes
+
+
+# Empty leaf folders, 100 per parent
+def empty_dirs(fs: Filesystem, nodes: int) -> None:
+    for i in range(nodes):
+        if (i % 100 == 0):
+            parent = fs.root.new_subfolder("p" + str(i))
+        parent.new_subfolder("d" + str(i))
+
+
+# Empty files, 100 per folder
+def empty_files(fs: Filesystem, nodes: int) -> None:
+    for i in range(nodes):
+        if (i % 100 == 0):
+            parent = fs.root.new_subfolder("p" + str(i))
+        parent.new_file("f" + str(i))
+
+
+# Files that were read once (their handler bookkeeping stays allocated)
+def read_files(fs: Filesystem, nodes: int) -> None:
+    empty_files(fs, nodes)
+    for parent in fs.root.subfolders.values():
+        for file in parent.files.values():
+            fs._read_with(fs._handler_in(parent, file.name, False))
+
+
+# A project-like tree built through paths, where the same few names repeat
+# in every folder: /proj<i>/src/main.py, /proj<i>/src/util.py, ...
+def repeated_names(fs: Filesystem, nodes: int) -> None:
+    names = ["README", "setup.py", "main.py", "util.py", "test_main.py"]
+    created = 0
+    i = 0
+    while (created < nodes):
+        fs.mkdir("/proj" + str(i) + "/src", "-p")
+        created += 2
+        for name in names:
+            fs.mkfile("/proj" + str(i) + "/src/" + name)
+            created += 1
+        i += 1
+
+
+CASES = [
+    ("empty dirs", empty_dirs),
+    ("empty files", empty_files),
+    ("files read once", read_files),
+    ("repeated names", repeated_names),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory per tree node")
+    parser.add_argument("--nodes", type=int, default=100000)
+    args = parser.parse_args()
+    print("%-18s %14s" % ("tree", "bytes/node"))
+    for name, build in CASES:
+        print("%-18s %14.0f" % (name, bytes_per_node(build, args.nodes)))
+
+
+if __name__ == "__main__":
+    main()
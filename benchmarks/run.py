@@ -0,0 +1,140 @@
+from __future__ import annotations
+import argparse
+import contextlib
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from benchmarks.scenarios import SCENARIOS
+from benchmarks.compare import compare, print_comparison
+
+# Run the microbenchmark scenarios (see scenarios.py)
+# Run from the repo root:
+#   python -m benchmarks.run                        run everything, print a table
+#   python -m benchmarks.run --output new.json      also save the results
+#   python -m benchmarks.run --compare old.json     fail (exit 1) on a regression
+#   python -m benchmarks.run --only find_walk read_line --scale 10
+#   python -m benchmarks.run --set find_indexed.nodes=1000000
+#
+# Each scenario is set up fresh for every repeat; only its hot path is
+# timed, with the garbage collector off (like timeit) and its prints muted
+# A scenario's rate is its ops over its best (fastest) repeat
+
+
+# Default params of a scenario, sizes scaled, then overrides applied
+def scenario_params(name: str, scale: float = 1.0, overrides: dict = None) -> dict:
+    _, sizes, shape = SCENARIOS[name]
+    params = {key: max(1, round(value * scale)) for key, value in sizes.items()}
+    params.update(shape)
+    params.update((overrides or {}).get(name, {}))
+    return params
+
+
+# Run one scenario repeat times
+# Returns dict of params, ops, seconds per repeat, best, median, ops_per_sec
+def run_scenario(name: str, params: dict, repeat: int = 3) -> dict:
+    func = SCENARIOS[name][0]
+    seconds = []
+    ops = 0
+    with open(os.devnull, "w") as devnull:
+        for _ in range(repeat):
+            with contextlib.redirect_stdout(devnull):
+                timed = func(**params)
+            gc.collect()
+            gc_was_enabled = gc.isenabled()
+            gc.disable()
+            try:
+                with contextlib.redirect_stdout(devnull):
+                    start = time.perf_counter()
+                    ops = timed()
+                    seconds.append(time.perf_counter() - start)
+            finally:
+                if (gc_was_enabled):
+                    gc.enable()
+            del timed
+    best = min(seconds)
+    return {
+        "params": params,
+        "ops": ops,
+        "seconds": seconds,
+        "best": best,
+        "median": statistics.median(seconds),
+        "ops_per_sec": ops / best if best > 0 else 0.0,
+    }
+
+
+# Where/what the results were measured on
+def environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+# "scenario.param=value" -> overrides[scenario][param] = value (int/float/str)
+def parse_overrides(settings: list[str]) -> dict:
+    overrides = {}
+    for setting in settings:
+        key, _, value = setting.partition("=")
+        name, _, param = key.partition(".")
+        if (name not in SCENARIOS or
+                (param not in SCENARIOS[name][1] and param not in SCENARIOS[name][2])):
+            raise ValueError("Unknown scenario param " + key)
+        for kind in (int, float):
+            try:
+                value = kind(value)
+                break
+            except ValueError:
+                pass
+        overrides.setdefault(name, {})[param] = value
+    return overrides
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Filesystem microbenchmarks")
+    parser.add_argument("--only", nargs="+", choices=sorted(SCENARIOS), help="scenarios to run")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply every size")
+    parser.add_argument("--set", nargs="+", default=[], metavar="SCENARIO.PARAM=VALUE",
+                        help="override a scenario param")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="save the results as JSON")
+    parser.add_argument("--compare", metavar="BASELINE", help="JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="max allowed slowdown vs the baseline (0.10 = 10%%)")
+    args = parser.parse_args()
+
+    overrides = parse_overrides(args.set)
+    results = {}
+    print("%-18s %10s %12s %14s" % ("scenario", "ops", "best s", "ops/sec"))
+    for name in (args.only or SCENARIOS):
+        params = scenario_params(name, args.scale, overrides)
+        result = run_scenario(name, params, args.repeat)
+        results[name] = result
+        print("%-18s %10d %12.4f %14.0f" % (name, result["ops"], result["best"], result["ops_per_sec"]))
+    report = {"environment": environment(), "scale": args.scale, "results": results}
+    if (args.output):
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if (args.compare):
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        rows = compare(baseline, report, args.threshold)
+        print()
+        print_comparison(rows)
+        if (any(row["status"] == "REGRESSION" for row in rows)):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
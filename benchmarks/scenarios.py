@@ -0,0 +1,226 @@
+from __future__ import annotations
+import inspect
+import random
+from filesystem import Filesystem
+
+# Microbenchmark scenarios for the Filesystem hot paths, see run.py
+#
+# A scenario is a function taking its parameters as keyword args; it
+# builds whatever it needs, then returns a callable that runs the timed
+# part and returns how many ops it ran
+# Sizes are given to @scenario and multiplied by run.py --scale,
+# shape params (fanout, depth, ...) are plain defaults that aren't scaled
+# Everything random is seeded, so the same parameters do the same work
+
+# name -> tuple(function, dict of default sizes, dict of default shape params)
+SCENARIOS = {}
+
+
+def scenario(**sizes):
+    def register(func: function) -> function:
+        shape = {name: param.default
+                 for name, param in inspect.signature(func).parameters.items()
+                 if param.default is not inspect.Parameter.empty}
+        SCENARIOS[func.__name__] = (func, sizes, shape)
+        return func
+    return register
+
+
+# mkdir -p of deep chains, every folder along each path is new
+@scenario(paths=200)
+def mkdir_p_deep(paths: int, depth: int = 50) -> function:
+    fs = Filesystem()
+    chain = "/".join("d" + str(i) for i in range(depth))
+
+    def run():
+        for i in range(paths):
+            fs.mkdir("/deep" + str(i) + "/" + chain, "-p")
+        return paths
+    return run
+
+
+# mkdir -p of many siblings, parents created on first use
+@scenario(dirs=20000)
+def mkdir_p_wide(dirs: int, fanout: int = 100) -> function:
+    fs = Filesystem()
+
+    def run():
+        for i in range(dirs):
+            fs.mkdir("/wide/w" + str(i // fanout) + "/d" + str(i), "-p")
+        return dirs
+    return run
+
+
+# A tree of about nodes folders & files, fanout children per folder
+def _build_tree(nodes: int, fanout: int) -> Filesystem:
+    fs = Filesystem()
+    rng = random.Random(nodes)
+    # Folders with room for more children
+    folders = [fs.root]
+    count = 0
+    while (count < nodes and folders):
+        i = rng.randrange(len(folders))
+        parent = folders[i]
+        if (rng.random() < 0.2):
+            folders.append(parent.new_subfolder("dir" + str(count)))
+        else:
+            parent.new_file("file" + str(count) + ".txt")
+        count += 1
+        if (len(parent.subfolders) + len(parent.files) >= fanout):
+            folders[i] = folders[-1]
+            folders.pop()
+    return fs
+
+
+# find -r answered from the name index (patterns with literal text)
+@scenario(nodes=100000, queries=50)
+def find_indexed(nodes: int, queries: int, fanout: int = 20) -> function:
+    fs = _build_tree(nodes, fanout)
+    rng = random.Random(queries)
+    patterns = ["file" + str(rng.randrange(max(nodes // 10, 1))) + r"\d?\.txt"
+                for _ in range(queries)]
+
+    def run():
+        for pattern in patterns:
+            fs.find_with_regex(pattern, "/", "-r")
+        return queries
+    return run
+
+
+# find -r with no literal text, walks the whole tree
+@scenario(nodes=100000, queries=3)
+def find_walk(nodes: int, queries: int, fanout: int = 20) -> function:
+    fs = _build_tree(nodes, fanout)
+
+    def run():
+        for i in range(queries):
+            fs.find_with_regex("[a-z]+[0-9]*" + str(i) + "$", "/", "-r")
+        return queries
+    return run
+
+
+# read_line through a large file, line by line
+@scenario(lines=100000)
+def read_line(lines: int, width: int = 60) -> function:
+    fs = Filesystem()
+    fs.mkfile("/big")
+    fs.write_file("/big", "\n".join(("line" + str(i)).ljust(width, ".") for i in range(lines)))
+    rh = fs.getFileHandlerFromPath("/big", is_write=False)
+
+    def run():
+        rh.open()
+        count = 0
+        while (rh.read_line()):
+            count += 1
+        rh.close()
+        return count
+    return run
+
+
+# read_line through a large file built by concats & inserts, so the rope
+# has the many joins & partly filled leaves edits leave behind instead of
+# the balanced tree of full leaves a single write builds
+@scenario(lines=100000)
+def read_line_rope(lines: int, width: int = 60, per_concat: int = 100) -> function:
+    fs = Filesystem()
+    fs.mkfile("/big")
+    rng = random.Random(lines)
+    wh = fs.getFileHandlerFromPath("/big", is_write=True)
+    wh.open()
+    for start in range(0, lines, per_concat):
+        wh.concat("".join(("line" + str(i)).ljust(width, ".") + "\n"
+                          for i in range(start, min(start + per_concat, lines))))
+    # A few edits in the middle, at line starts
+    for _ in range(lines // 1000):
+        wh.seek_line(rng.randrange(max(lines - 1, 1)))
+        wh.insert("inserted line\n")
+    wh.close()
+    rh = fs.getFileHandlerFromPath("/big", is_write=False)
+
+    def run():
+        rh.open()
+        count = 0
+        while (rh.read_line()):
+            count += 1
+        rh.close()
+        return count
+    return run
+
+
+# WriteHandler.insert at random positions of a large file
+@scenario(inserts=20000, size=1000000)
+def handler_insert(inserts: int, size: int) -> function:
+    fs = Filesystem()
+    fs.mkfile("/big")
+    fs.write_file("/big", "x" * size)
+    wh = fs.getFileHandlerFromPath("/big", is_write=True)
+    rng = random.Random(inserts)
+
+    def run():
+        wh.open()
+        for _ in range(inserts):
+            wh.move_cursor_abs(rng.randrange(len(wh.file.store)))
+            wh.insert("inserted")
+        wh.close()
+        return inserts
+    return run
+
+
+# WriteHandler.concat of many small lines
+@scenario(concats=100000)
+def handler_concat(concats: int) -> function:
+    fs = Filesystem()
+    fs.mkfile("/log")
+    wh = fs.getFileHandlerFromPath("/log", is_write=True)
+
+    def run():
+        wh.open()
+        for i in range(concats):
+            wh.concat("log line " + str(i) + "\n")
+        wh.close()
+        return concats
+    return run
+
+
+# cpfile -b over an existing file, each copy backs up the previous one
+@scenario(copies=20000)
+def cpfile_backup(copies: int, files: int = 10) -> function:
+    fs = Filesystem()
+    for i in range(files):
+        fs.mkfile("/src/f" + str(i), "-p")
+        fs.write_file("/src/f" + str(i), "contents " + str(i))
+    fs.mkdir("/dst")
+
+    def run():
+        for i in range(copies):
+            fs.copy_file("/src/f" + str(i % files), "/dst/f", "-b")
+        return copies
+    return run
+
+
+# cd between absolute, relative and parent paths in a deep tree
+@scenario(changes=100000)
+def changedir_churn(changes: int, depth: int = 8, fanout: int = 4) -> function:
+    fs = Filesystem()
+    rng = random.Random(changes)
+    paths = []
+    for _ in range(fanout * fanout):
+        path = "/" + "/".join("c" + str(rng.randrange(fanout)) for _ in range(depth))
+        fs.mkdir(path, "-p")
+        paths.append(path)
+    # Last two folders of each path, to go back down after "../.."
+    tails = ["/".join(path.split("/")[-2:]) for path in paths]
+
+    def run():
+        for i in range(changes):
+            kind = i % 4
+            if (kind == 0):
+                fs.changedir(paths[i % len(paths)])
+            elif (kind == 1):
+                fs.changedir("../..")
+            elif (kind == 2):
+                fs.changedir(tails[(i - 2) % len(paths)])
+            else:
+                fs.changedir("/")
+        return changes
+    return run
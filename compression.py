@@ -0,0 +1,357 @@
+from __future__ import annotations
+import collections
+import lzma
+import threading
+import time
+import weakref
+import zlib
+from contents import ContentStore, ContentBuffer, BytesStore
+from objects import Directory, File, _file_lock_init
+
+# Transparent compression of cold file contents, see Filesystem.enable_compression
+#
+# Files are tracked from the first time a handler opens them. A file that
+# isn't opened again for after_ops handler opens (across the filesystem)
+# or after_seconds goes cold: its store is replaced by a CompressedStore
+# holding the contents compressed (zlib or lzma)
+# A CompressedStore decompresses into a regular store when it's used
+# (handlers opening it do so right away). Decompressed copies are kept in
+# a LRU bounded by cache_bytes: the least recently opened ones are dropped
+# again, so hot files stay fast without every cold file becoming resident
+# A decompressed copy that gets written is the file's own again and no
+# longer in the LRU; it's compressed afresh once the file goes cold again
+#
+# Only contents owned by a single file are compressed: copies sharing a
+# buffer (cpfile, snapshots, dedup blobs) are already stored once, and a
+# buffer is only safe to swap while its one file is locked
+# Cold files are compressed by a background thread, woken by handler opens
+# (and every after_seconds), so opening a file never pays for compressing
+# others; or all at once by compress_cold()
+
+# name -> (compress, decompress)
+CODECS = {
+    "zlib": (zlib.compress, zlib.decompress),
+    "lzma": (lzma.compress, lzma.decompress),
+}
+# Guards every CompressedStore's decompressed copy, dirty flag & the LRU
+_lock = threading.Lock()
+
+
+# Sweeper thread of a ColdTier: compress the cold files whenever woken,
+# or every after_seconds (timeout) when that's set
+# Holds the tier weakly, so it ends once the tier is closed or dropped
+def _sweep_loop(ref: weakref.ref, wake: threading.Event, timeout: float) -> None:
+    while True:
+        wake.wait(timeout)
+        wake.clear()
+        tier = ref()
+        if (tier is None or tier._closed):
+            return
+        tier._sweep(time.monotonic())
+        del tier
+
+
+# Contents kept compressed, decompressed into a regular store (the tier's
+# content_store, or a BytesStore for binary contents) when needed
+# Like image.MappedStore, the length is known without decompressing
+class CompressedStore(ContentStore):
+    __slots__ = ("_tier", "_data", "_length", "is_binary", "_store", "_dirty")
+
+    def __init__(self, tier: ColdTier, data: bytes, length: int, binary: bool = False):
+        self._tier = tier
+        self._data = data
+        self._length = length
+        self.is_binary = binary
+        # Decompressed copy, None while only compressed
+        self._store = None
+        # The copy was modified: _data is stale and the LRU mustn't drop it
+        self._dirty = False
+
+    # The decompressed store, decompressing it on first use
+    def _loaded(self) -> ContentStore:
+        store = self._store
+        if (store is None):
+            store = self._tier._decompress(self)
+        return store
+
+    # The decompressed store, for modifying
+    def _edited(self) -> ContentStore:
+        store = self._loaded()
+        with _lock:
+            if (not self._dirty):
+                self._dirty = True
+                self._tier._cache_discard(self)
+            # Dropped by the LRU meanwhile
+            if (self._store is None):
+                self._store = store
+            return self._store
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._store is not None
+
+    # Memory held: the compressed bytes, plus the decompressed copy if any
+    def resident_size(self) -> int:
+        store = self._store
+        return len(self._data) + (len(store) if store is not None else 0)
+
+    def __len__(self) -> int:
+        store = self._store
+        if (store is None):
+            return self._length
+        return len(store)
+
+    def get(self, start: int = 0, end: int = None) -> str:
+        return self._loaded().get(start, end)
+
+    def view(self, start: int = 0, end: int = None) -> memoryview:
+        return self._loaded().view(start, end)
+
+    # Overwriting never needs the old contents
+    def set(self, text: str) -> None:
+        with _lock:
+            if (not self._dirty):
+                self._dirty = True
+                self._tier._cache_discard(self)
+            self._store = self._tier._new_store(self.is_binary)
+            store = self._store
+        store.set(text)
+
+    def concat(self, text: str) -> None:
+        self._edited().concat(text)
+
+    def insert(self, i: int, text: str) -> None:
+        self._edited().insert(i, text)
+
+    # Shares the compressed bytes (immutable) until modified
+    def copy(self) -> ContentStore:
+        with _lock:
+            store = self._store if self._dirty else None
+        if (store is not None):
+            return store.copy()
+        return CompressedStore(self._tier, self._data, self._length, self.is_binary)
+
+    def newline_count(self) -> int:
+        return self._loaded().newline_count()
+
+    def newlines_before(self, i: int) -> int:
+        return self._loaded().newlines_before(i)
+
+    def nth_newline(self, k: int) -> int:
+        return self._loaded().nth_newline(k)
+
+    def find_newline(self, start: int) -> int:
+        return self._loaded().find_newline(start)
+
+    def line_count(self) -> int:
+        return self._loaded().line_count()
+
+    def line_start(self, n: int) -> int:
+        return self._loaded().line_start(n)
+
+
+# Compression policy & LRU of decompressed contents for one Filesystem
+# Thread safe
+class ColdTier:
+    # codec: "zlib" or "lzma"
+    # after_ops: a file not opened during this many handler opens is cold
+    # after_seconds: a file not opened for this long is cold
+    #   (None: never by that measure; both None: only compress() compresses)
+    # cache_bytes: max size of the decompressed copies kept for hot files
+    # min_size: smaller contents aren't worth compressing
+    def __init__(self, content_store: type[ContentStore], codec: str = "zlib",
+                 after_ops: int = None, after_seconds: float = None,
+                 cache_bytes: int = 64 << 20, min_size: int = 256):
+        if (codec not in CODECS):
+            raise ValueError("Unknown codec: " + str(codec))
+        self.content_store = content_store
+        self.codec = codec
+        self._compress, self._decompress_data = CODECS[codec]
+        self.after_ops = after_ops
+        self.after_seconds = after_seconds
+        self.cache_bytes = cache_bytes
+        self.min_size = min_size
+        # Handler opens so far, the clock after_ops counts in
+        self.ops = 0
+        # weakref(file) -> tuple(ops, time) of its last open, oldest first
+        self._tracked = collections.OrderedDict()
+        self._tracked_lock = threading.Lock()
+        # CompressedStore -> decompressed size, least recently opened first
+        # (guarded by _lock)
+        self._cache = collections.OrderedDict()
+        self._cached_bytes = 0
+        self.compressions = 0
+        self.decompressions = 0
+        self.hits = 0
+        # Wakes the sweeper thread, started by the first open (see _sweep_loop)
+        self._wake = threading.Event()
+        self._sweeper = None
+        self._closed = False
+
+    # A handler opened file: decompress it if it's compressed, mark it hot
+    # and wake the sweeper to compress the files that went cold
+    def on_open(self, file: File) -> None:
+        store = file.buffer.store
+        if (isinstance(store, CompressedStore)):
+            with _lock:
+                if (store in self._cache):
+                    self._cache.move_to_end(store)
+                    self.hits += 1
+            store._loaded()
+        now = time.monotonic()
+        with self._tracked_lock:
+            self.ops += 1
+            ref = weakref.ref(file)
+            self._tracked[ref] = (self.ops, now)
+            self._tracked.move_to_end(ref)
+            if (self._sweeper is None and not self._closed and
+                    (self.after_ops is not None or self.after_seconds is not None)):
+                self._sweeper = threading.Thread(
+                    target=_sweep_loop, args=(weakref.ref(self), self._wake, self.after_seconds),
+                    daemon=True)
+                self._sweeper.start()
+                # A tier dropped without close() still stops its thread
+                weakref.finalize(self, self._wake.set)
+        self._wake.set()
+
+    # Stop the sweeper thread; compressed contents stay as they are
+    def close(self) -> None:
+        self._closed = True
+        self._wake.set()
+        sweeper = self._sweeper
+        if (sweeper is not None and sweeper is not threading.current_thread()):
+            sweeper.join()
+
+    # Compress the tracked files that are cold now, at most limit of them
+    # Returns the number compressed
+    def _sweep(self, now: float, limit: int = None) -> int:
+        if (self.after_ops is None and self.after_seconds is None):
+            return 0
+        compressed = 0
+        while (limit is None or compressed < limit):
+            with self._tracked_lock:
+                if (not self._tracked):
+                    break
+                ref, (ops, opened) = next(iter(self._tracked.items()))
+                cold = ((self.after_ops is not None and self.ops - ops >= self.after_ops) or
+                        (self.after_seconds is not None and now - opened >= self.after_seconds))
+                if (not cold):
+                    break
+                del self._tracked[ref]
+            file = ref()
+            if (file is not None and self.compress(file)):
+                compressed += 1
+        return compressed
+
+    # Compress every tracked file that is cold now
+    def compress_cold(self) -> int:
+        return self._sweep(time.monotonic())
+
+    # Compress every file under dir now, see compress
+    def compress_tree(self, dir: Directory) -> int:
+        compressed = 0
+        for _, node in dir.walk():
+            if (isinstance(node, File) and self.compress(node)):
+                compressed += 1
+        return compressed
+
+    # Compress file's contents (or drop their decompressed copy if they
+    # already are and it's unmodified)
+    # Skipped (returns False) if the file is open, shares its contents, or
+    # they're too small or don't compress
+    def compress(self, file: File) -> bool:
+        buffer = file.buffer
+        if (buffer.is_shared):
+            return False
+        store = buffer.store
+        if (isinstance(store, CompressedStore) and store._store is None):
+            return False
+        if (len(store) < self.min_size):
+            return False
+        if (file._lock is None):
+            # Never opened: hold off handlers instead of allocating its lock
+            with _file_lock_init:
+                if (file._lock is None):
+                    return self._compress_locked(file, buffer)
+        lock = file.lock
+        if (not lock.acquire_write(blocking=False)):
+            return False
+        try:
+            return self._compress_locked(file, buffer)
+        finally:
+            lock.release_write()
+
+    # compress, with no other thread's handler open on file
+    def _compress_locked(self, file: File, buffer: ContentBuffer) -> bool:
+        # Shared meanwhile, or open in this thread
+        if (buffer.is_shared or file.buffer is not buffer or
+                file.write_handler is not None or file.read_handlers):
+            return False
+        store = buffer.store
+        if (isinstance(store, CompressedStore)):
+            with _lock:
+                if (not store._dirty):
+                    self._cache_discard(store)
+                    store._store = None
+                    return True
+                plain = store._store
+        else:
+            plain = store
+        data = plain.get()
+        raw = data if plain.is_binary else data.encode("utf-8", "surrogatepass")
+        packed = self._compress(raw)
+        if (len(packed) >= len(raw)):
+            return False
+        buffer.store = CompressedStore(self, packed, len(plain), plain.is_binary)
+        with _lock:
+            self.compressions += 1
+        return True
+
+    # Decompress store, keep the copy in the LRU & return it
+    def _decompress(self, store: CompressedStore) -> ContentStore:
+        raw = self._decompress_data(store._data)
+        plain = self._new_store(store.is_binary,
+                                raw if store.is_binary else raw.decode("utf-8", "surrogatepass"))
+        with _lock:
+            # Another thread decompressed it meanwhile
+            if (store._store is not None):
+                return store._store
+            store._store = plain
+            self.decompressions += 1
+            self._cache[store] = len(plain)
+            self._cached_bytes += len(plain)
+            self._evict()
+        return plain
+
+    def _new_store(self, binary: bool, contents=None) -> ContentStore:
+        if (binary):
+            return BytesStore() if contents is None else BytesStore(contents)
+        return self.content_store() if contents is None else self.content_store(contents)
+
+    # Drop the least recently opened decompressed copies over cache_bytes
+    # (holding _lock)
+    def _evict(self) -> None:
+        while (self._cached_bytes > self.cache_bytes and self._cache):
+            store, size = self._cache.popitem(last=False)
+            self._cached_bytes -= size
+            store._store = None
+
+    # store's copy is no longer the LRU's to drop (holding _lock)
+    def _cache_discard(self, store: CompressedStore) -> None:
+        size = self._cache.pop(store, None)
+        if (size is not None):
+            self._cached_bytes -= size
+
+    # Counters, and the LRU's size
+    def stats(self) -> dict:
+        with _lock:
+            return {
+                "codec": self.codec,
+                "compressions": self.compressions,
+                "decompressions": self.decompressions,
+                "cache_hits": self.hits,
+                "cached": len(self._cache),
+                "cached_bytes": self._cached_bytes,
+                "cache_limit": self.cache_bytes,
+                "tracked": len(self._tracked),
+            }
@@ -0,0 +1,595 @@
+from __future__ import annotations
+import threading
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+
+# Pluggable storage engines for File contents
+#
+# Every engine exposes the same small API so handlers never touch the raw str:
+#   len(store), get(start, end), set(text), concat(text), insert(i, text), copy()
+# plus newline lookups used for line based reads/seeks:
+#   find_newline(start), line_count(), line_start(n)
+# and resident_size(), the memory its contents take up
+#
+# StringStore keeps a plain str (every insert copies the whole file)
+# RopeStore keeps a balanced tree of text chunks so insert/concat/slice are O(log n)
+# BytesStore keeps binary contents in a bytearray; the same API takes and
+# returns bytes instead of str, plus view() for zero-copy reads
+
+
+# Stores use __slots__: there is one per file (see File)
+# A store missing one of the abstract methods can't be created
+class ContentStore(ABC):
+    __slots__ = ()
+    # Binary stores hold bytes, text stores hold str
+    is_binary = False
+
+    @abstractmethod
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    # Return contents[start:end], same clamping rules as python slicing
+    @abstractmethod
+    def get(self, start: int = 0, end: int = None) -> str:
+        raise NotImplementedError
+
+    # Overwrite all contents
+    @abstractmethod
+    def set(self, text: str) -> None:
+        raise NotImplementedError
+
+    # Append to the end
+    @abstractmethod
+    def concat(self, text: str) -> None:
+        raise NotImplementedError
+
+    # Insert text so that it starts at index i
+    @abstractmethod
+    def insert(self, i: int, text: str) -> None:
+        raise NotImplementedError
+
+    # Return an independent store with the same contents
+    @abstractmethod
+    def copy(self) -> ContentStore:
+        raise NotImplementedError
+
+    # Number of "\n" chars in the contents
+    @abstractmethod
+    def newline_count(self) -> int:
+        raise NotImplementedError
+
+    # Number of "\n" chars strictly before index i
+    @abstractmethod
+    def newlines_before(self, i: int) -> int:
+        raise NotImplementedError
+
+    # Index of the k-th "\n" (0 based), k must be < newline_count()
+    @abstractmethod
+    def nth_newline(self, k: int) -> int:
+        raise NotImplementedError
+
+    # Index of the first "\n" at or after start, -1 if none
+    def find_newline(self, start: int) -> int:
+        k = self.newlines_before(start)
+        if k >= self.newline_count():
+            return -1
+        return self.nth_newline(k)
+
+    # Number of lines, a trailing line without "\n" still counts
+    # e.g. "a\nb" -> 2, "a\n" -> 1, "" -> 0
+    def line_count(self) -> int:
+        n = self.newline_count()
+        length = len(self)
+        if length and self.get(length - 1, length) != "\n":
+            n += 1
+        return n
+
+    # Index where line n (0 based) starts
+    def line_start(self, n: int) -> int:
+        if n == 0:
+            return 0
+        return self.nth_newline(n - 1) + 1
+
+    # Zero-copy read-only memoryview of contents[start:end], binary stores only
+    def view(self, start: int = 0, end: int = None) -> memoryview:
+        raise NotImplementedError
+
+    # Size of the contents held in memory, in chars/bytes like len()
+    # Less than len() for stores that aren't fully loaded or are compressed
+    def resident_size(self) -> int:
+        return len(self)
+
+    # Normalize (start, end) the same way str slicing would
+    def _clamp(self, start: int, end: int) -> tuple[int, int]:
+        length = len(self)
+        if end is None or end > length:
+            end = length
+        if start < 0:
+            start = 0
+        if start > end:
+            start = end
+        return start, end
+
+
+# Sorted offsets of every "\n" in a text
+# Built lazily on first use, then kept up to date by each edit
+# so a write never has to rescan the whole file
+class LineIndex:
+    __slots__ = ("_offsets",)
+
+    def __init__(self):
+        self._offsets = None
+
+    # Return the offsets, building them from text if needed
+    def offsets(self, text: str) -> list[int]:
+        if self._offsets is None:
+            self._offsets = _newline_positions(text, 0)
+        return self._offsets
+
+    def on_set(self) -> None:
+        self._offsets = None
+
+    # text was appended at old_len
+    def on_concat(self, old_len: int, text: str) -> None:
+        if self._offsets is not None:
+            self._offsets.extend(_newline_positions(text, old_len))
+
+    # text was inserted at i; shift every later newline by len(text)
+    def on_insert(self, i: int, text: str) -> None:
+        if self._offsets is None:
+            return
+        k = bisect_left(self._offsets, i)
+        shift = len(text)
+        tail = [o + shift for o in self._offsets[k:]]
+        self._offsets[k:] = _newline_positions(text, i) + tail
+
+    def copy(self) -> LineIndex:
+        index = LineIndex()
+        if self._offsets is not None:
+            index._offsets = list(self._offsets)
+        return index
+
+
+# Offsets of every "\n" in text (str or bytes), shifted by base
+def _newline_positions(text: str, base: int) -> list[int]:
+    if isinstance(text, memoryview):
+        text = text.tobytes()
+    newline = "\n" if isinstance(text, str) else b"\n"
+    positions = []
+    i = text.find(newline)
+    while i != -1:
+        positions.append(base + i)
+        i = text.find(newline, i + 1)
+    return positions
+
+
+class StringStore(ContentStore):
+    __slots__ = ("_text", "_lines")
+
+    def __init__(self, text: str = ""):
+        self._text = text
+        self._lines = LineIndex()
+
+    def __len__(self) -> int:
+        return len(self._text)
+
+    def get(self, start: int = 0, end: int = None) -> str:
+        if start == 0 and end is None:
+            return self._text
+        return self._text[start:end]
+
+    def set(self, text: str) -> None:
+        self._text = text
+        self._lines.on_set()
+
+    def concat(self, text: str) -> None:
+        self._lines.on_concat(len(self._text), text)
+        self._text += text
+
+    def insert(self, i: int, text: str) -> None:
+        c = self._text
+        self._text = c[0:i] + text + c[i:]
+        self._lines.on_insert(i, text)
+
+    def copy(self) -> StringStore:
+        # str is immutable so sharing it is safe
+        s = StringStore(self._text)
+        s._lines = self._lines.copy()
+        return s
+
+    def newline_count(self) -> int:
+        return len(self._lines.offsets(self._text))
+
+    def newlines_before(self, i: int) -> int:
+        return bisect_left(self._lines.offsets(self._text), i)
+
+    def nth_newline(self, k: int) -> int:
+        return self._lines.offsets(self._text)[k]
+
+    # Scanning forward is cheaper than building the index for sequential reads
+    def find_newline(self, start: int) -> int:
+        return self._text.find("\n", start)
+
+
+# Binary contents in a bytearray
+# get() returns bytes copies, view() returns memoryviews into the bytearray
+# A bytearray can't be resized while a view of it is alive, so an edit made
+# while views are out swaps in a new bytearray instead: views keep seeing
+# the contents as they were when they were taken
+class BytesStore(ContentStore):
+    __slots__ = ("_data", "_lines")
+    is_binary = True
+
+    def __init__(self, data: bytes = b""):
+        self._data = bytearray(data)
+        self._lines = LineIndex()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, start: int = 0, end: int = None) -> bytes:
+        return bytes(self._data[start:end])
+
+    def view(self, start: int = 0, end: int = None) -> memoryview:
+        return memoryview(self._data).toreadonly()[start:end]
+
+    # Always a new bytearray, views of the old one stay valid
+    def set(self, data: bytes) -> None:
+        self._data = bytearray(data)
+        self._lines.on_set()
+
+    def concat(self, data: bytes) -> None:
+        self._lines.on_concat(len(self._data), data)
+        try:
+            self._data += data
+        except BufferError:
+            self._data = self._data + data
+
+    def insert(self, i: int, data: bytes) -> None:
+        try:
+            self._data[i:i] = data
+        except BufferError:
+            self._data = self._data[:i] + data + self._data[i:]
+        self._lines.on_insert(i, data)
+
+    def copy(self) -> BytesStore:
+        b = BytesStore(self._data)
+        b._lines = self._lines.copy()
+        return b
+
+    def newline_count(self) -> int:
+        return len(self._lines.offsets(self._data))
+
+    def newlines_before(self, i: int) -> int:
+        return bisect_left(self._lines.offsets(self._data), i)
+
+    def nth_newline(self, k: int) -> int:
+        return self._lines.offsets(self._data)[k]
+
+    def find_newline(self, start: int) -> int:
+        return self._data.find(b"\n", start)
+
+    def line_count(self) -> int:
+        n = self.newline_count()
+        if self._data and self._data[-1] != 10:
+            n += 1
+        return n
+
+
+# A content store shared by one or more files
+# Copying a file (cpfile, -b backups, cpdir) only bumps refs; the first
+# write through a file that still shares its buffer gives that file a
+# private copy of the store (see File.writable_store)
+# With deduplication, a buffer can also be the blob of its contents'
+# hash, which files with the same contents then share (see dedup.py)
+class ContentBuffer:
+    __slots__ = ("store", "refs", "blob")
+    # refs += 1 isn't atomic across threads
+    _refs_lock = threading.Lock()
+
+    def __init__(self, store: ContentStore):
+        self.store = store
+        self.refs = 1
+        # tuple(BlobStore, key) while this buffer is a blob, else None
+        self.blob = None
+
+    # Add a reference and return self
+    def share(self) -> ContentBuffer:
+        with ContentBuffer._refs_lock:
+            self.refs += 1
+        return self
+
+    # Drop a reference; a blob losing its last one is reclaimed
+    def release(self) -> None:
+        with ContentBuffer._refs_lock:
+            self.refs -= 1
+            unused = (self.refs == 0)
+        if (unused and self.blob is not None):
+            blobs, key = self.blob
+            blobs.discard(key, self)
+
+    @property
+    def is_shared(self) -> bool:
+        return self.refs > 1
+
+
+# ******* Rope *******
+# Max chars held by a single leaf. Small files are a single leaf
+# so the rope costs about the same as a plain str for them
+LEAF_MAX = 2048
+
+
+# Rope nodes are immutable once built, so two ropes can safely share subtrees
+# Each node lazily caches its newline count; an edit only rebuilds the nodes
+# along its path, so the line index of untouched subtrees is reused as is
+class _Leaf:
+    __slots__ = ("text", "length", "_newlines", "_offsets")
+    height = 0
+
+    def __init__(self, text: str):
+        self.text = text
+        self.length = len(text)
+        self._newlines = -1
+        # Offsets of the "\n" chars in text, built on first nth_newline
+        self._offsets = None
+
+    @property
+    def newlines(self) -> int:
+        if self._newlines < 0:
+            self._newlines = self.text.count("\n")
+        return self._newlines
+
+    # Offset of the k-th "\n" in text (0 based)
+    def nth_newline(self, k: int) -> int:
+        if self._offsets is None:
+            text = self.text
+            offsets = []
+            pos = text.find("\n")
+            while pos >= 0:
+                offsets.append(pos)
+                pos = text.find("\n", pos + 1)
+            self._offsets = offsets
+        return self._offsets[k]
+
+
+class _Node:
+    __slots__ = ("left", "right", "length", "height", "_newlines")
+
+    def __init__(self, left, right):
+        self.left = left
+        self.right = right
+        self.length = left.length + right.length
+        self.height = max(left.height, right.height) + 1
+        self._newlines = -1
+
+    @property
+    def newlines(self) -> int:
+        if self._newlines < 0:
+            self._newlines = self.left.newlines + self.right.newlines
+        return self._newlines
+
+
+# Build a balanced tree out of a str by chunking it into leaves
+# and recursively halving the leaf list
+def _build(text: str):
+    if not text:
+        return None
+    leaves = [_Leaf(text[i:i + LEAF_MAX])
+              for i in range(0, len(text), LEAF_MAX)]
+    return _build_range(leaves, 0, len(leaves))
+
+
+def _build_range(leaves: list, lo: int, hi: int):
+    if hi - lo == 1:
+        return leaves[lo]
+    mid = (lo + hi) // 2
+    return _Node(_build_range(leaves, lo, mid), _build_range(leaves, mid, hi))
+
+
+# Combine two subtrees whose heights differ by at most 2 (AVL rotation)
+def _balance(left, right):
+    if left.height > right.height + 1:
+        if left.left.height >= left.right.height:
+            return _Node(left.left, _Node(left.right, right))
+        lr = left.right
+        return _Node(_Node(left.left, lr.left), _Node(lr.right, right))
+    if right.height > left.height + 1:
+        if right.right.height >= right.left.height:
+            return _Node(_Node(left, right.left), right.right)
+        rl = right.left
+        return _Node(_Node(left, rl.left), _Node(rl.right, right.right))
+    return _Node(left, right)
+
+
+# Concatenate two ropes, O(height difference)
+# Descends the spine of the taller tree and rebalances on the way back up
+def _join(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    # Merge small neighbours so many tiny inserts don't create tiny leaves
+    if a.height == 0 and b.height == 0 and a.length + b.length <= LEAF_MAX:
+        return _Leaf(a.text + b.text)
+    if a.height > b.height + 1:
+        return _balance(a.left, _join(a.right, b))
+    if b.height > a.height + 1:
+        return _balance(_join(a, b.left), b.right)
+    return _Node(a, b)
+
+
+# Split a rope into (first i chars, rest), O(log n)
+def _split(node, i: int):
+    if node is None:
+        return None, None
+    if i <= 0:
+        return None, node
+    if i >= node.length:
+        return node, None
+    if node.height == 0:
+        return _Leaf(node.text[:i]), _Leaf(node.text[i:])
+    left_len = node.left.length
+    if i == left_len:
+        return node.left, node.right
+    if i < left_len:
+        l, r = _split(node.left, i)
+        return l, _join(r, node.right)
+    l, r = _split(node.right, i - left_len)
+    return _join(node.left, l), r
+
+
+class RopeStore(ContentStore):
+    __slots__ = ("_root", "_finger")
+
+    # The leaves are the only copy of the contents: get() builds the flat
+    # str it returns and doesn't keep it
+    def __init__(self, text: str = ""):
+        self._root = _build(text)
+        # tuple(leaf, its offset) find_newline last stopped in, so reading
+        # line by line slices & searches it without descending again
+        # (cleared by every mutation)
+        self._finger = None
+
+    def __len__(self) -> int:
+        if self._root is None:
+            return 0
+        return self._root.length
+
+    def get(self, start: int = 0, end: int = None) -> str:
+        start, end = self._clamp(start, end)
+        return self._slice(start, end)
+
+    def set(self, text: str) -> None:
+        self._root = _build(text)
+        self._finger = None
+
+    def concat(self, text: str) -> None:
+        if not text:
+            return
+        self._root = _join(self._root, _build(text))
+        self._finger = None
+
+    def insert(self, i: int, text: str) -> None:
+        if not text:
+            return
+        left, right = _split(self._root, i)
+        self._root = _join(_join(left, _build(text)), right)
+        self._finger = None
+
+    def copy(self) -> RopeStore:
+        # Nodes are immutable, sharing the tree is O(1)
+        r = RopeStore()
+        r._root = self._root
+        return r
+
+    def newline_count(self) -> int:
+        if self._root is None:
+            return 0
+        return self._root.newlines
+
+    def newlines_before(self, i: int) -> int:
+        node = self._root
+        if node is None:
+            return 0
+        count = 0
+        while node.height:
+            if i < node.left.length:
+                node = node.left
+            else:
+                count += node.left.newlines
+                i -= node.left.length
+                node = node.right
+        return count + node.text.count("\n", 0, i)
+
+    def nth_newline(self, k: int) -> int:
+        node = self._root
+        offset = 0
+        while node.height:
+            left_newlines = node.left.newlines
+            if k < left_newlines:
+                node = node.left
+            else:
+                k -= left_newlines
+                offset += node.left.length
+                node = node.right
+        return offset + node.nth_newline(k)
+
+    # Searches the leaf holding start, then the first following subtree
+    # with a newline: O(log n + line length)
+    def find_newline(self, start: int) -> int:
+        start = max(start, 0)
+        finger = self._finger
+        if finger is not None:
+            leaf, offset = finger
+            if offset <= start < offset + leaf.length:
+                pos = leaf.text.find("\n", start - offset)
+                if pos >= 0:
+                    return offset + pos
+        node = self._root
+        if node is None or start >= node.length:
+            return -1
+        offset = 0
+        # Subtrees right of the path down, nearest last
+        following = []
+        while node.height:
+            if start - offset < node.left.length:
+                following.append((node.right, offset + node.left.length))
+                node = node.left
+            else:
+                offset += node.left.length
+                node = node.right
+        pos = node.text.find("\n", start - offset)
+        if pos >= 0:
+            self._finger = (node, offset)
+            return offset + pos
+        while following:
+            node, offset = following.pop()
+            if not node.newlines:
+                continue
+            # Down to its leftmost leaf with a newline
+            while node.height:
+                if node.left.newlines:
+                    node = node.left
+                else:
+                    offset += node.left.length
+                    node = node.right
+            self._finger = (node, offset)
+            return offset + node.text.find("\n")
+        return -1
+
+    # Collect the leaf pieces covering [start, end): down to the leaf
+    # holding start, then the leaves after it in order
+    def _slice(self, start: int, end: int) -> str:
+        finger = self._finger
+        if finger is not None:
+            leaf, offset = finger
+            if offset <= start and end <= offset + leaf.length:
+                return leaf.text[start - offset:end - offset]
+        node = self._root
+        if node is None or start >= end:
+            return ""
+        offset = 0
+        # Subtrees right of the path down, nearest last
+        following = []
+        while node.height:
+            if start - offset < node.left.length:
+                following.append((node.right, offset + node.left.length))
+                node = node.left
+            else:
+                offset += node.left.length
+                node = node.right
+        piece = node.text[start - offset:end - offset]
+        if offset + node.length >= end:
+            return piece
+        pieces = [piece]
+        while following:
+            node, offset = following.pop()
+            if offset >= end:
+                break
+            if node.height == 0:
+                pieces.append(node.text[:end - offset])
+            else:
+                # push right first so left is visited first
+                following.append((node.right, offset + node.left.length))
+                following.append((node.left, offset))
+        return "".join(pieces)
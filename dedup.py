@@ -0,0 +1,162 @@
+from __future__ import annotations
+import hashlib
+import threading
+from contents import ContentBuffer, ContentStore, BytesStore, StringStore
+from objects import Directory, File
+
+# Content-addressed deduplication of file contents, see Filesystem(dedup=True)
+#
+# Copies already share one refcounted ContentBuffer until written (see
+# File.writable_store). The blob store extends that to files whose
+# contents are equal but were written independently: a file is hashed
+# when it's created, when a write handler on it closes and when it's
+# imported (as it's read), then switched to the buffer already holding
+# those contents (the blob of their hash) if there is one, else its
+# buffer becomes it
+# Writing to a file sharing a blob gives it a private copy as usual
+# A blob is dropped from the store when its last reference is released:
+# its files were removed, rewritten or garbage collected
+#
+# Keys: tuple(is binary, BLAKE2b digest of the contents as UTF-8/raw bytes)
+
+DIGEST_SIZE = 20
+# Chars hashed at a time for text contents
+HASH_CHUNK = 1 << 16
+
+
+# A hasher for content keys, fed bytes as they come (see key)
+def new_hasher():
+    return hashlib.blake2b(digest_size=DIGEST_SIZE)
+
+
+def key(is_binary: bool, hasher) -> tuple:
+    return (is_binary, hasher.digest())
+
+
+# Every new file starts empty
+_EMPTY_DIGEST = new_hasher().digest()
+
+
+# Key of the contents of store
+def content_key(store: ContentStore) -> tuple:
+    if (len(store) == 0):
+        return (store.is_binary, _EMPTY_DIGEST)
+    hasher = new_hasher()
+    if (store.is_binary):
+        hasher.update(store.view())
+    else:
+        for start in range(0, len(store), HASH_CHUNK):
+            hasher.update(store.get(start, start + HASH_CHUNK).encode("utf-8", "surrogatepass"))
+    return key(store.is_binary, hasher)
+
+
+# Blobs by key, for one Filesystem (and its snapshots, which share its buffers)
+# Thread safe
+class BlobStore:
+    def __init__(self):
+        # key -> ContentBuffer
+        self._blobs = {}
+        self._lock = threading.Lock()
+        # Files switched to an existing blob
+        self.hits = 0
+        # Blobs dropped after losing their last reference
+        self.reclaimed = 0
+
+    def __len__(self) -> int:
+        return len(self._blobs)
+
+    # Buffer for a new file with the contents of store: a reference to the
+    # blob already holding them, else a new blob of store
+    # store_key: key of the contents if already known (e.g. hashed while read)
+    def buffer(self, store: ContentStore, store_key: tuple = None) -> ContentBuffer:
+        if (store_key is None):
+            store_key = content_key(store)
+        with self._lock:
+            blob = self._blobs.get(store_key)
+            # A blob at 0 refs is on its way out, replace it
+            if (blob is not None and blob.refs > 0):
+                self.hits += 1
+                return blob.share()
+            blob = ContentBuffer(store)
+            blob.blob = (self, store_key)
+            self._blobs[store_key] = blob
+            return blob
+
+    # Make file share the blob of its contents, or its buffer that blob
+    # The caller keeps the file from being written meanwhile (holds its
+    # write lock, or the file isn't linked yet)
+    def intern(self, file: File) -> None:
+        buffer = file.buffer
+        if (buffer.blob is not None):
+            return
+        file_key = content_key(buffer.store)
+        with self._lock:
+            blob = self._blobs.get(file_key)
+            # A blob at 0 refs is on its way out, replace it
+            if (blob is None or blob.refs == 0):
+                self._blobs[file_key] = buffer
+                buffer.blob = (self, file_key)
+                return
+            blob.share()
+            self.hits += 1
+        file.buffer = blob
+        buffer.release()
+
+    # Drop blob from the store (see ContentBuffer.release / File.writable_store)
+    def discard(self, blob_key: tuple, blob: ContentBuffer) -> None:
+        with self._lock:
+            if (self._blobs.get(blob_key) is blob):
+                del self._blobs[blob_key]
+                if (blob.refs == 0):
+                    self.reclaimed += 1
+            blob.blob = None
+
+    # Release the contents of every file in dir, a folder just removed from
+    # the tree, so the blobs only they used are reclaimed right away
+    # rather than whenever the garbage collector frees the unlinked subtree
+    # (folders & files link each other). Skips files with open handlers,
+    # and folders copy-on-write clones (snapshots, copy_dir) still read from
+    def reclaim(self, dir: Directory) -> None:
+        if (dir.is_lazy or dir._clones):
+            return
+        for _, node in dir.walk(prune=lambda path, child: child.is_lazy or child._clones):
+            if (isinstance(node, File)):
+                _drop_contents(node)
+
+    # Dedup statistics over the blobs alive now
+    #   blobs: distinct contents, refs: files (incl. snapshots') sharing them
+    #   stored_bytes: size of the blobs, each counted once
+    #   logical_bytes: size as seen through every reference
+    #   saved_bytes: logical - stored, dedup_ratio: logical / stored
+    #   hits: files switched to an existing blob, reclaimed: blobs freed
+    # Sizes are in chars for text files, like content_usage
+    def stats(self) -> dict:
+        with self._lock:
+            blobs = list(self._blobs.values())
+            hits = self.hits
+            reclaimed = self.reclaimed
+        refs = stored = logical = 0
+        for blob in blobs:
+            size = len(blob.store)
+            refs += blob.refs
+            stored += size
+            logical += size * blob.refs
+        return {
+            "blobs": len(blobs),
+            "refs": refs,
+            "stored_bytes": stored,
+            "logical_bytes": logical,
+            "saved_bytes": logical - stored,
+            "dedup_ratio": logical / stored if stored else 1.0,
+            "hits": hits,
+            "reclaimed": reclaimed,
+        }
+
+
+# Give a removed file empty contents, releasing its buffer
+def _drop_contents(file: File) -> None:
+    if (file.write_handler is not None or file.read_handlers):
+        return
+    buffer = file.buffer
+    file.buffer = ContentBuffer(BytesStore() if buffer.store.is_binary else StringStore())
+    buffer.release()
@@ -0,0 +1,82 @@
+from __future__ import annotations
+import contextvars
+import enum
+
+# Typed errors of failed Filesystem & handler operations
+#
+# A failing operation returns its failure value (None/False, "" for
+# read_file) and records why as an FsError, read back with last_error(),
+# like errno. Nothing is printed: rendering messages is left to the caller
+# (the cmdline simulator prints them). Filesystem(raise_errors=True)
+# raises the FsError instead of returning
+# The last error is kept per thread (and per asyncio task), and isn't
+# cleared by operations that succeed; see clear_error()
+
+
+# What went wrong; the value is the message shown to users
+class ErrorCode(enum.Enum):
+    INVALID_PATH = "Invalid path"
+    MISSING_PARENT = "Invalid path; try -p to create missing parent directories"
+    NO_DIR_NAME = "No specified directory name"
+    NO_FILE_NAME = "No specified file name"
+    DIR_EXISTS = "Directory already exists"
+    FILE_EXISTS = "File already exists; please remove or rename"
+    DIR_NOT_FOUND = "Directory doesn't exist"
+    FILE_NOT_FOUND = "File doesn't exist"
+    NO_SOURCE_DIR = "No source directory specified"
+    SOURCE_DIR_NOT_FOUND = "Source directory doesn't exist"
+    SOURCE_FILE_NOT_FOUND = "Source file doesn't exist"
+    DEST_DIR_NOT_FOUND = "Dest Directory doesn't exist"
+    MOVE_INTO_ITSELF = "Cannot move a directory into itself"
+    NAME_CONFLICT = "exists in dest, move aborted"
+    FILE_BUSY = "File is open elsewhere; failed to open file handler"
+    WRONG_CONTENTS_TYPE = "Binary files take bytes, text files take str"
+    CURSOR_OUT_OF_BOUNDS = "Cursor value out of bounds"
+    LINE_OUT_OF_BOUNDS = "Line out of bounds"
+    SNAPSHOT_EXISTS = "Snapshot already exists"
+    SNAPSHOT_NOT_FOUND = "Snapshot doesn't exist"
+    READ_ONLY = "Snapshot is read-only"
+    SAVE_FAILED = "Failed to save image"
+    INVALID_IMAGE = "Invalid image"
+    NO_JOURNAL = "No journal to checkpoint"
+    CHECKPOINT_FAILED = "Failed to save checkpoint"
+    HOST_PATH_NOT_FOUND = "Host directory doesn't exist"
+    INVALID_ARCHIVE = "Invalid archive"
+    IMPORT_FAILED = "Failed to read from the host"
+    EXPORT_FAILED = "Failed to write the archive"
+    NO_DEDUP = "Deduplication isn't enabled"
+    NO_COMPRESSION = "Compression isn't enabled"
+    QUOTA_EXCEEDED = "Quota exceeded"
+
+
+# A failed operation: code, and the name it's about if any
+# str() is the user facing message
+class FsError(Exception):
+    def __init__(self, code: ErrorCode, name: str = None):
+        super().__init__(code.value if name is None else name + " " + code.value)
+        self.code = code
+        self.name = name
+
+
+_last_error = contextvars.ContextVar("last_error", default=None)
+
+
+# The FsError of the last failed operation in this thread/task, or None
+def last_error() -> FsError | None:
+    return _last_error.get()
+
+
+def clear_error() -> None:
+    _last_error.set(None)
+
+
+# Set what last_error() returns
+def set_error(error: FsError | None) -> None:
+    _last_error.set(error)
+
+
+# Record a failure and return result, the operation's failure value
+# e.g. return fail(ErrorCode.INVALID_PATH, False)
+def fail(code: ErrorCode, result=None, name: str = None):
+    _last_error.set(FsError(code, name))
+    return result
@@ -1,15 +1,162 @@
+from __future__ import annotations
 from objects import *
 from path_utils import *
+from contents import *
+from name_index import NameIndex
+from path_cache import PathCache
+from image import save_image, load_image
+from journal import Journal, journal_path, checkpoint_path, list_generations, read_records
+from archive import Importer, Exporter, LockTimeout, QuotaExceeded, CHUNK_SIZE, EXPORT_FORMATS
+from dedup import BlobStore
+from compression import ColdTier
+from errors import ErrorCode, FsError, fail, last_error
+from metrics import Metrics, metered_handler_class, FILESYSTEM_BYTES_IN, FILESYSTEM_BYTES_OUT
+import functools
+import inspect
+import os
 import re
+import sys
+import tarfile
+import threading
+import time
 
 
+# Filesystem methods return None/False when they fail
+def _succeeded(result) -> bool:
+    return result is not None and result is not False
+
+
+# Decorates a Filesystem method that changes the tree
+# With a journal attached, the call is applied and logged as one step, and
+# returns once the record is durable (see journal.py)
+# Only successful calls (not None/False) are logged
+def _journaled(func: function) -> function:
+    op = func.__name__
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        journal = self.journal
+        if (journal is None):
+            return func(self, *args, **kwargs)
+        with journal.lock:
+            result = func(self, *args, **kwargs)
+            if (not _succeeded(result)):
+                return result
+            # Logged positionally, filling in defaults before keyword args
+            if (kwargs):
+                bound = signature.bind(self, *args, **kwargs)
+                bound.apply_defaults()
+                args = bound.args[1:]
+            seq = journal.log(op, args)
+        journal.wait(seq)
+        self._maybe_checkpoint()
+        return result
+    return wrapper
+
+
+# Safe to share between threads:
+#   - each folder has its own lock (Directory.lock) guarding its children,
+#     so creating/removing files in unrelated folders runs in parallel
+#   - operations that relink folders (rmdir, mvdir, cpdir, snapshot, restore)
+#     also serialize on one rename lock, so two concurrent moves can never
+#     form a cycle or race a recursive remove
+#   - file contents are guarded by each file's reader-writer lock, held by
+#     open handlers (see ReadHandler.open/WriteHandler.open)
+# The current directory is shared by every thread using the instance
 class Filesystem:
-    def __init__(self):
-        self.root = Directory("", None, is_root=True)
+    # content_store: engine class used for new files (see contents.py)
+    # raise_errors: failing operations raise FsError instead of returning
+    #   None/False (see errors.py)
+    # dedup: files with the same contents share one copy (see dedup.py)
+    def __init__(self, content_store: type[ContentStore] = RopeStore, raise_errors: bool = False,
+                 dedup: bool = False):
+        # Every file & folder name in the tree, used by recursive find
+        self.name_index = NameIndex()
+        self.root = Directory("", None, is_root=True, index=self.name_index)
         self.current_dir = self.root
+        self.content_store = content_store
+        # Resolved directory paths, see _walk_names
+        self.path_cache = PathCache()
+        # name -> Snapshot
+        self.snapshots = {}
+        self._rename_lock = threading.RLock()
+        # Max seconds read_file/write_file wait for another thread's
+        # handlers to close, None waits forever
+        self.lock_timeout = None
+        # Write-ahead journal, see recover()
+        self.journal = None
+        # Checkpoint automatically after this many journal records
+        self.checkpoint_every = None
+        self._checkpoint_lock = threading.Lock()
+        self._checkpoint_thread = None
+        # Per-operation metrics while enabled, see enable_metrics()
+        self._metrics = None
+        self.raise_errors = raise_errors
+        # Content-addressed blobs while deduplicating, see deduplicate()
+        self.blobs = BlobStore() if dedup else None
+        # Compression policy of cold contents, see enable_compression()
+        self.cold = None
+
+    # Record why an operation failed (see errors.py) and return result,
+    # its failure value; raises the FsError instead if raise_errors
+    def _fail(self, code: ErrorCode, result=None, name: str = None):
+        fail(code, result, name)
+        if (self.raise_errors):
+            raise last_error()
+        return result
+
+    # Start recording per-operation metrics (see metrics.py): calls, errors,
+    # bytes in/out & latency histograms of every public method, and of the
+    # read/write methods of every handler handed out from now on
+    # Each method is shadowed by a recording wrapper on this instance and
+    # handlers are switched to a recording subclass, so while metrics are
+    # off nothing at all is added to any call
+    # Returns the Metrics being recorded to
+    def enable_metrics(self) -> Metrics:
+        if (self._metrics is not None):
+            return self._metrics
+        metrics = Metrics()
+        for name, _ in inspect.getmembers(type(self), inspect.isfunction):
+            if (name.startswith("_") or name in _UNMETERED):
+                continue
+            setattr(self, name, metrics.wrap(
+                name, getattr(self, name), FILESYSTEM_BYTES_IN.get(name),
+                FILESYSTEM_BYTES_OUT.get(name)))
+        get_handler = self.getFileHandlerFromPath
+        metered = {cls: metered_handler_class(metrics, cls) for cls in (ReadHandler, WriteHandler)}
+
+        def getFileHandlerFromPath(file_path: str, is_write: bool) -> FileHandler:
+            handler = get_handler(file_path, is_write)
+            if (handler is not None):
+                handler.__class__ = metered[type(handler)]
+            return handler
+        self.getFileHandlerFromPath = getFileHandlerFromPath
+        self._metrics = metrics
+        return metrics
+
+    # Stop recording metrics and drop the wrappers
+    # Handlers handed out meanwhile keep recording to the old Metrics
+    def disable_metrics(self) -> None:
+        if (self._metrics is None):
+            return
+        for name, _ in inspect.getmembers(type(self), inspect.isfunction):
+            self.__dict__.pop(name, None)
+        self._metrics = None
+
+    # Per-operation metrics recorded since enable_metrics()
+    # Returns dict of operation name -> dict(calls, errors, bytes_in,
+    #   bytes_out, latency_us: dict(mean, min, p50, p90, p99, p999, max))
+    # Handler methods are named "ReadHandler.read_line", etc.
+    # Returns None if metrics aren't enabled
+    def metrics(self) -> dict:
+        if (self._metrics is None):
+            return None
+        return self._metrics.snapshot()
 
     # Change current directory to given absolute/relative path
     # Return T/F on success/failure (fail if invalid path)
+    @_journaled
     def changedir(self, path:str) -> bool:
         dir_list, is_absolute = parse_path(path)
         final_dir = self._walk_dir_path_absolute_or_relative(
@@ -18,8 +165,7 @@ class Filesystem:
             self.current_dir = final_dir
             return True
         else:
-            print("Invalid path")
-            return False
+            return self._fail(ErrorCode.INVALID_PATH, False)
 
     # Create and return the specified directory. Fail if dir already exists
     # Default: Returns None if path is invalid
@@ -27,41 +173,59 @@ class Filesystem:
     #   e.g. /a/b/c -> also creates a->b before creating c if a->b doesn't exist
     # Returns None if no ending name
     #   e.g. /a/b/c/ -> None, due to no name specified (see trailing slash)
+    @_journaled
     def mkdir(self, path: str, option="") -> Directory:
         dir_list, new_dir_name, is_absolute = parse_path_with_ending_name(
             path)
         if (new_dir_name == ""):
-            print("No specified directory name")
-            return None
+            return self._fail(ErrorCode.NO_DIR_NAME)
         final_dir = self._walk_dir_path_absolute_or_relative(
             dir_list, is_absolute, option)
+        return self._mkdir_in(final_dir, new_dir_name)
+
+    # mkdir once the parent dir is resolved
+    def _mkdir_in(self, final_dir: Directory, new_dir_name: str) -> Directory:
         if (final_dir is None):
-            print("Invalid path; try -p to create missing parent directories")
-            return None
-        if (final_dir.get_subfolder(new_dir_name)):
-            print("Directory already exists")
-            return None
-        return final_dir.new_subfolder(new_dir_name)
+            return self._fail(ErrorCode.MISSING_PARENT)
+        with final_dir.lock:
+            if (final_dir.get_subfolder(new_dir_name)):
+                return self._fail(ErrorCode.DIR_EXISTS)
+            dir = final_dir.new_subfolder(new_dir_name)
+        if (dir is None):
+            return self._fail(ErrorCode.QUOTA_EXCEEDED)
+        self.path_cache.on_dir_created()
+        return dir
 
     # Create and return a new empty file
     # **Similar to mkdir**
     # Default Option: Return None if path is invalid
     # Option "-p": Creates missing parent directories
-    def mkfile(self, path: str, option="") -> File:
+    # binary: the file holds bytes instead of text (see BytesStore)
+    @_journaled
+    def mkfile(self, path: str, option="", binary: bool = False) -> File:
         dir_list, new_file_name, is_absolute = parse_path_with_ending_name(
             path)
         if (new_file_name == ""):
-            print("No specified file name")
-            return None
+            return self._fail(ErrorCode.NO_FILE_NAME)
         final_dir = self._walk_dir_path_absolute_or_relative(
             dir_list, is_absolute, option)
+        return self._mkfile_in(final_dir, new_file_name, binary)
+
+    # mkfile once the parent dir is resolved
+    def _mkfile_in(self, final_dir: Directory, new_file_name: str, binary: bool = False) -> File:
         if (final_dir is None):
-            print("Invalid path; try -p to create missing parent directories")
-            return None
-        if (final_dir.get_file(new_file_name)):
-            print("File already exists; please remove or rename")
-            return None
-        return final_dir.new_file(new_file_name)
+            return self._fail(ErrorCode.MISSING_PARENT)
+        with final_dir.lock:
+            if (final_dir.get_file(new_file_name)):
+                return self._fail(ErrorCode.FILE_EXISTS)
+            store = BytesStore() if binary else self.content_store()
+            if (self.blobs is not None):
+                file = final_dir.new_file(new_file_name, buffer=self.blobs.buffer(store))
+            else:
+                file = final_dir.new_file(new_file_name, store)
+        if (file is None):
+            return self._fail(ErrorCode.QUOTA_EXCEEDED)
+        return file
 
     # List all subdirectory names in the current dir
     def list_folders(self) -> list[str]:
@@ -75,36 +239,48 @@ class Filesystem:
     def get_current_path(self) -> str:
         return self.current_dir.path
 
+    # Return the directory at an absolute/relative path, None if invalid
+    def get_directory(self, path: str) -> Directory:
+        dir_list, is_absolute = parse_path(path)
+        return self._walk_dir_path_absolute_or_relative(dir_list, is_absolute)
+
     # Removes a directory; Accepts absolute/relative path
     # Return T/F success/fail
+    @_journaled
     def remove_dir(self, path: str) -> bool:
         dir_list, rm_name, is_absolute = parse_path_with_ending_name(
             path)
         final_dir = self._walk_dir_path_absolute_or_relative(
             dir_list, is_absolute)
         if (final_dir is None):
-            print("Invalid path")
-            return False
-        removed_dir = final_dir.remove_subfolder(rm_name)
+            return self._fail(ErrorCode.INVALID_PATH, False)
+        with self._rename_lock, final_dir.lock:
+            removed_dir = final_dir.remove_subfolder(rm_name)
         if (removed_dir is None):
-            print("Directory doesn't exist")
-            return False
+            return self._fail(ErrorCode.DIR_NOT_FOUND, False)
+        self.path_cache.on_dir_removed()
+        if (self.blobs is not None):
+            self.blobs.reclaim(removed_dir)
         return True
 
     # Removes a file; Accepts absolute/relative path
     # Return T/F success/fail
+    @_journaled
     def remove_file(self, path: str):
         dir_list, rm_name, is_absolute = parse_path_with_ending_name(
             path)
         final_dir = self._walk_dir_path_absolute_or_relative(
             dir_list, is_absolute)
+        return self._remove_file_in(final_dir, rm_name)
+
+    # remove_file once the parent dir is resolved
+    def _remove_file_in(self, final_dir: Directory, rm_name: str) -> bool:
         if (final_dir is None):
-            print("Invalid path")
-            return False
-        removed_file = final_dir.remove_file(rm_name)
+            return self._fail(ErrorCode.INVALID_PATH, False)
+        with final_dir.lock:
+            removed_file = final_dir.remove_file(rm_name)
         if (removed_file is None):
-            print("File doesn't exist")
-            return False
+            return self._fail(ErrorCode.FILE_NOT_FOUND, False)
         return True
 
     # Gets the R/W file handler for more fine grained edit operations
@@ -114,24 +290,37 @@ class Filesystem:
             file_path)
         final_dir = self._walk_dir_path_absolute_or_relative(
             dir_list, is_absolute)
+        handler = self._handler_in(final_dir, file_name, is_write)
+        if (handler is not None and is_write and self.journal is not None):
+            handler.journal = self.journal
+        return handler
+
+    # Unjournaled handler once the parent dir is resolved
+    def _handler_in(self, final_dir: Directory, file_name: str, is_write: bool) -> FileHandler:
         if (final_dir is None):
-            print("Invalid path")
-            return None
+            return self._fail(ErrorCode.INVALID_PATH)
         file = final_dir.get_file(file_name)
         if (file is None):
-            print("File doesn't exist at path")
-            return None
+            return self._fail(ErrorCode.FILE_NOT_FOUND)
         if (is_write):
-            return WriteHandler(file)
+            handler = WriteHandler(file)
+            handler.blobs = self.blobs
         else:
-            return ReadHandler(file)
+            handler = ReadHandler(file)
+        handler.tier = self.cold
+        handler.raise_errors = self.raise_errors
+        return handler
 
-    # Read the contents of the file
+    # Read the contents of the file (bytes for a binary file)
     def read_file(self, file_path: str) -> str:
-        fh = self.getFileHandlerFromPath(file_path, is_write=False)
-        if fh is None or not fh.open():
-            print("Failed to open read file handler")
+        return self._read_with(
+            self.getFileHandlerFromPath(file_path, is_write=False))
+
+    def _read_with(self, fh: ReadHandler) -> str:
+        if (fh is None):
             return ""
+        if (not fh.open(timeout=self.lock_timeout)):
+            return self._fail(ErrorCode.FILE_BUSY, "")
         contents = fh.read()
         fh.close()
         return contents
@@ -140,25 +329,689 @@ class Filesystem:
     # By default overwrites the file
     # Option "-a" appends to file with new line
     # Option "-c" concats to file without new line
-    # Returns T/F on success/fail (fail if invalid file path)
+    # contents: str, or bytes for a binary file
+    # Returns T/F on success/fail (fail if invalid file path, wrong contents
+    # type or past a quota)
     def write_file(self, file_path: str, contents: str, option="") -> bool:
-        fh = self.getFileHandlerFromPath(file_path, is_write=True)
-        if fh is None or not fh.open():
-            print("Failed to open write file handler")
+        return self._write_with(self.getFileHandlerFromPath(
+            file_path, is_write=True), contents, option)
+
+    def _write_with(self, fh: WriteHandler, contents: str, option="") -> bool:
+        if (fh is None):
             return False
-        if (option == "-a"):
-            fh.concat("\n"+contents)
-        elif (option == "-c"):
-            fh.concat(contents)
+        if (not fh.open(timeout=self.lock_timeout)):
+            return self._fail(ErrorCode.FILE_BUSY, False)
+        if (not fh.accepts(contents)):
+            fh.close()
+            return self._fail(ErrorCode.WRONG_CONTENTS_TYPE, False)
+        # With raise_errors the handler raises a refused edit, close anyway
+        try:
+            if (option == "-a"):
+                written = fh.concat((b"\n" if fh.file.is_binary else "\n") + contents)
+            elif (option == "-c"):
+                written = fh.concat(contents)
+            else:
+                written = fh.write(contents)
+        finally:
+            fh.close()
+        if (not written):
+            return self._fail(ErrorCode.QUOTA_EXCEEDED, False)
+        return True
+
+    # Apply many operations in one call
+    # ops: iterable of tuple(method name, *args), e.g. ("mkfile", "/a/b/f", "-p")
+    #   any of mkdir, mkfile, write_file, read_file, remove_file, remove_dir,
+    #   move_file, copy_file, move_dir, copy_dir, changedir
+    # Ops run in order, each with the same result it'd have on its own, but
+    # the parent dir of each distinct path prefix is only resolved once per
+    # batch (until a folder is removed/moved), and with a journal the whole
+    # batch is logged at once and waits for disk once
+    # atomic=True: all-or-nothing; stops at the first failed op and rolls
+    #   the tree back to how it was before the batch
+    #   (changes other threads made meanwhile are rolled back too)
+    # Returns the list of per-op results; after a rollback it ends with the
+    # failed op's result
+    # Without ops, returns a Batch to queue ops on in a with block:
+    #   with fs.batch() as batch:
+    #       batch.mkfile("/a/f")
+    #       batch.write_file("/a/f", "text")
+    #   batch.results
+    # Raises ValueError for an op that can't be batched
+    def batch(self, ops: list[tuple] = None, atomic: bool = False) -> list | Batch:
+        if (ops is None):
+            return Batch(self, atomic)
+        ops = [tuple(op) for op in ops]
+        for op in ops:
+            if (op[0] not in _BATCH_OPS):
+                raise ValueError("Can't batch " + str(op[0]))
+        journal = self.journal
+        if (journal is None):
+            return self._apply_batch(ops, atomic, None)
+        seq = None
+        with journal.lock:
+            # tuple(op, args) for each change to log, in order
+            records = []
+            try:
+                results = self._apply_batch(ops, atomic, records)
+            finally:
+                for op, args in records:
+                    seq = journal.log(op, args)
+        if (seq is not None):
+            journal.wait(seq)
+            self._maybe_checkpoint()
+        return results
+
+    # Precondition: with a journal, its lock is held
+    # records: with a journal, list to add tuple(op, args) to for every
+    #   change, to log once the batch is applied
+    def _apply_batch(self, ops: list[tuple], atomic: bool, records: list) -> list:
+        saved = None
+        if (atomic):
+            with self._rename_lock:
+                saved = _clone_root(self.root)
+                cwd = self.get_current_path()
+        # tuple(starting dir, path prefix) -> resolved parent dir
+        resolved = {}
+        epoch = self.path_cache.version()[0]
+        results = []
+        try:
+            for op, *args in ops:
+                # A folder was removed/moved (by this batch or another thread)
+                if (self.path_cache.version()[0] != epoch):
+                    resolved.clear()
+                    epoch = self.path_cache.version()[0]
+                fast = self._batch_fast_ops.get(op)
+                if (fast is not None):
+                    result = fast(self, resolved, records, *args)
+                else:
+                    method = getattr(self, op)
+                    # Logged with the batch, not one by one
+                    unjournaled = getattr(method, "__wrapped__", None)
+                    if (records is not None and unjournaled is not None):
+                        result = unjournaled(self, *args)
+                        if (_succeeded(result)):
+                            records.append((op, tuple(args)))
+                    else:
+                        result = method(*args)
+                results.append(result)
+                if (atomic and not _succeeded(result)):
+                    self._rollback_batch(saved, cwd, records)
+                    break
+        except BaseException:
+            if (atomic):
+                self._rollback_batch(saved, cwd, records)
+            raise
+        return results
+
+    def _rollback_batch(self, saved: Directory, cwd: str, records: list) -> None:
+        with self._rename_lock:
+            self._reset_root(saved, cwd)
+        if (records is not None):
+            records.clear()
+
+    # Parent dir of path (None if invalid) and the name after it
+    # Resolved through the batch's resolved dict, so each distinct prefix
+    # is only walked once
+    def _batch_parent(self, resolved: dict, path: str, option="") -> tuple[Directory, str]:
+        head, slash, name = path.strip().rpartition("/")
+        start = self.root if head.startswith("/") or (slash and not head) else self.current_dir
+        key = (start, head + slash)
+        dir = resolved.get(key)
+        if (dir is None):
+            dir_list, name, is_absolute = parse_path_with_ending_name(path)
+            dir = self._walk_dir_path_absolute_or_relative(
+                dir_list, is_absolute, option)
+            if (dir is not None):
+                resolved[key] = dir
+        return dir, name
+
+    def _batch_mkdir(self, resolved: dict, records: list, path: str, option="") -> Directory:
+        final_dir, name = self._batch_parent(resolved, path, option)
+        if (name == ""):
+            return self._fail(ErrorCode.NO_DIR_NAME)
+        dir = self._mkdir_in(final_dir, name)
+        if (dir is not None and records is not None):
+            records.append(("mkdir", (path, option)))
+        return dir
+
+    def _batch_mkfile(self, resolved: dict, records: list, path: str, option="", binary: bool = False) -> File:
+        final_dir, name = self._batch_parent(resolved, path, option)
+        if (name == ""):
+            return self._fail(ErrorCode.NO_FILE_NAME)
+        file = self._mkfile_in(final_dir, name, binary)
+        if (file is not None and records is not None):
+            records.append(("mkfile", (path, option, binary)))
+        return file
+
+    def _batch_remove_file(self, resolved: dict, records: list, path: str) -> bool:
+        final_dir, name = self._batch_parent(resolved, path)
+        removed = self._remove_file_in(final_dir, name)
+        if (removed and records is not None):
+            records.append(("remove_file", (path,)))
+        return removed
+
+    def _batch_read_file(self, resolved: dict, records: list, file_path: str) -> str:
+        final_dir, name = self._batch_parent(resolved, file_path)
+        return self._read_with(self._handler_in(final_dir, name, False))
+
+    def _batch_write_file(self, resolved: dict, records: list, file_path: str, contents: str, option="") -> bool:
+        final_dir, name = self._batch_parent(resolved, file_path)
+        fh = self._handler_in(final_dir, name, True)
+        if (not self._write_with(fh, contents, option)):
+            return False
+        if (records is not None):
+            records.append(("write_file", (fh.file.get_path(), contents, option)))
+        return True
+
+    # Batch ops applied through _batch_parent instead of the public method
+    _batch_fast_ops = {
+        "mkdir": _batch_mkdir,
+        "mkfile": _batch_mkfile,
+        "remove_file": _batch_remove_file,
+        "read_file": _batch_read_file,
+        "write_file": _batch_write_file,
+    }
+
+    # Take a point-in-time, read-only snapshot of the whole tree
+    # O(1): the snapshot is a copy-on-write clone of the root, so it only
+    # costs memory along the paths changed after it was taken
+    # Returns None if a snapshot with that name already exists
+    def snapshot(self, name: str = None) -> Snapshot:
+        with self._rename_lock:
+            if (name is None):
+                name = "snapshot" + str(len(self.snapshots))
+                while (name in self.snapshots):
+                    name += "_"
+            if (name in self.snapshots):
+                return self._fail(ErrorCode.SNAPSHOT_EXISTS)
+            snap = Snapshot(name, _clone_root(self.root), self.content_store)
+            snap.raise_errors = self.raise_errors
+            self.snapshots[name] = snap
+            return snap
+
+    # Names of the snapshots taken, oldest first
+    def list_snapshots(self) -> list[str]:
+        return list(self.snapshots.keys())
+
+    # Forget a snapshot; its memory is freed once nothing else refers to it
+    # Return T/F success/fail
+    def drop_snapshot(self, name: str) -> bool:
+        with self._rename_lock:
+            snapshot = self.snapshots.pop(name, None)
+        if (snapshot is None):
+            return self._fail(ErrorCode.SNAPSHOT_NOT_FOUND, False)
+        return True
+
+    # Roll the whole tree back to a snapshot (Snapshot or its name)
+    # The snapshot stays valid and can be restored again later
+    # The current directory is kept if it exists in the snapshot, else it's "/"
+    # With a journal, snapshots aren't in it, so a checkpoint is taken right after
+    # Return T/F success/fail
+    def restore(self, snapshot: Snapshot | str) -> bool:
+        journal = self.journal
+        if (journal is None):
+            return self._restore(snapshot)
+        with self._checkpoint_lock, journal.lock:
+            if (not self._restore(snapshot)):
+                return False
+            return self._checkpoint_locked()
+
+    def _restore(self, snapshot: Snapshot | str) -> bool:
+        if (isinstance(snapshot, str)):
+            snapshot = self.snapshots.get(snapshot)
+        if (snapshot is None):
+            return self._fail(ErrorCode.SNAPSHOT_NOT_FOUND, False)
+        with self._rename_lock:
+            self._reset_root(_clone_root(snapshot.root), self.get_current_path())
+            return True
+
+    # Replace the whole tree with root (a detached clone, see _clone_root)
+    # and cd to cwd if it exists in it, else "/"
+    # Precondition: the rename lock is held
+    def _reset_root(self, root: Directory, cwd: str) -> None:
+        # The old tree is abandoned; its nodes keep the old index
+        self.name_index = NameIndex()
+        self.root = root
+        self.root.index = self.name_index
+        self.name_index.add_lazy(self.root)
+        self.path_cache.clear()
+        self.current_dir = self.root
+        dir_list, _ = parse_path(cwd)
+        current_dir = self._walk_dir_path(self.root, dir_list, False)
+        if (current_dir is not None):
+            self.current_dir = current_dir
+
+    # Save the whole tree to a binary image file at path (see image.py)
+    # Saves a point-in-time snapshot, so other threads can keep writing
+    # Snapshots themselves aren't saved
+    # Return T/F success/fail
+    def save(self, path: str) -> bool:
+        with self._rename_lock:
+            root = _clone_root(self.root)
+        try:
+            save_image(root, path)
+        except OSError:
+            return self._fail(ErrorCode.SAVE_FAILED, False)
+        return True
+
+    # Open a Filesystem saved with save()
+    # O(1): the image is memory mapped, folders and file contents are only
+    # read from it the first time they are touched
+    # content_store: engine class for new files & loaded contents
+    # raise_errors, dedup: as for a new Filesystem; with dedup, loaded files
+    #   are only deduplicated once written (or see deduplicate())
+    # Returns None if the image is missing or invalid (raises with raise_errors)
+    @classmethod
+    def load(cls, path: str, content_store: type[ContentStore] = RopeStore,
+             raise_errors: bool = False, dedup: bool = False) -> Filesystem:
+        fs = cls(content_store, raise_errors=raise_errors, dedup=dedup)
+        try:
+            fs.root = load_image(path, fs.name_index, content_store)
+        except (OSError, ValueError):
+            return fs._fail(ErrorCode.INVALID_IMAGE)
+        fs.current_dir = fs.root
+        # The root's children aren't indexed until they are read
+        fs.name_index.add_lazy(fs.root)
+        return fs
+
+    # Open (or create) a Filesystem whose changes are journaled to directory
+    # Rebuilds the tree from the latest checkpoint + the journal after it
+    # From then on every successful mkdir/mkfile/rmdir/rmfile/mv/cp/cd/set_quota and
+    # every write through a write handler is logged (see journal.py)
+    # checkpoint_every: compact the journal into a new checkpoint after this
+    #   many records, in the background (None: only on checkpoint())
+    # journal_options: sync, batch_size, batch_delay, fsync (see Journal)
+    # Returns None if the latest checkpoint can't be loaded
+    # Call close() when done
+    @classmethod
+    def recover(cls, directory: str, content_store: type[ContentStore] = RopeStore,
+                checkpoint_every: int = 100000, **journal_options) -> Filesystem:
+        os.makedirs(directory, exist_ok=True)
+        checkpoints, journals = list_generations(directory)
+        generation = 0
+        if (checkpoints):
+            generation = checkpoints[-1]
+            fs = cls.load(checkpoint_path(directory, generation), content_store)
+            if (fs is None):
+                return None
+        else:
+            fs = cls(content_store)
+        # Older journals are covered by the checkpoint
+        journals = [gen for gen in journals if gen >= generation]
+        for gen in journals:
+            fs._replay(journal_path(directory, gen))
+        fs.journal = Journal(directory, max([generation] + journals), **journal_options)
+        fs.checkpoint_every = checkpoint_every
+        _remove_generations_before(directory, generation)
+        return fs
+
+    # Compact the journal: save the whole tree as a new checkpoint image and
+    # drop the journal files (and older checkpoint) it replaces
+    # Other threads keep going while the image is written
+    # Return T/F success/fail
+    def checkpoint(self) -> bool:
+        if (self.journal is None):
+            return self._fail(ErrorCode.NO_JOURNAL, False)
+        with self._checkpoint_lock:
+            return self._checkpoint_locked()
+
+    # Precondition: the checkpoint lock is held
+    def _checkpoint_locked(self) -> bool:
+        journal = self.journal
+        with journal.lock:
+            # Everything logged so far is in this snapshot
+            root = _clone_root(self.root)
+            generation = journal.generation + 1
+            journal.rotate(generation)
+            journal.log("changedir", (self.get_current_path(),))
+        # On failure the old checkpoint + both journals still replay fine
+        try:
+            save_image(root, checkpoint_path(journal.directory, generation))
+        except OSError:
+            return self._fail(ErrorCode.CHECKPOINT_FAILED, False)
+        _remove_generations_before(journal.directory, generation)
+        return True
+
+    # Start a background checkpoint once enough has been logged
+    def _maybe_checkpoint(self) -> None:
+        if (self.checkpoint_every is None or
+                self.journal.records_since_checkpoint < self.checkpoint_every):
+            return
+        if (not self._checkpoint_lock.acquire(blocking=False)):
+            return
+        thread = threading.Thread(target=self._background_checkpoint, daemon=True)
+        self._checkpoint_thread = thread
+        thread.start()
+
+    # Runs on its own thread with the checkpoint lock already held
+    def _background_checkpoint(self) -> None:
+        try:
+            self._checkpoint_locked()
+        finally:
+            self._checkpoint_lock.release()
+
+    # Flush and close the journal; the Filesystem stays usable, unjournaled
+    def close(self) -> None:
+        if (self.journal is None):
+            return
+        thread = self._checkpoint_thread
+        if (thread is not None):
+            thread.join()
+        self.journal.close()
+        self.journal = None
+
+    # Re-apply every intact record of a journal file
+    # A torn tail (crash mid-write) is cut off so new records append cleanly
+    def _replay(self, path: str) -> None:
+        records = read_records(path)
+        while True:
+            try:
+                op, *args = next(records)
+            except StopIteration as end:
+                valid_length = end.value
+                break
+            if (op in _REPLAY_HANDLER_OPS):
+                self._replay_handler_op(op, *args)
+            elif (op in _REPLAY_OPS):
+                getattr(self, op)(*args)
+            else:
+                raise ValueError("Unknown journal record " + op)
+        if (valid_length < os.path.getsize(path)):
+            os.truncate(path, valid_length)
+
+    def _replay_handler_op(self, op: str, path: str, *args) -> None:
+        fh = self.getFileHandlerFromPath(path, is_write=True)
+        fh.open()
+        if (op == "fh_write"):
+            fh.write(*args)
+        elif (op == "fh_concat"):
+            fh.concat(*args)
         else:
-            fh.write(contents)
+            cursor, contents = args
+            fh.move_cursor_abs(cursor)
+            fh.insert(contents)
         fh.close()
+
+    # Import a host directory tree under dest_path (created if missing, like -p)
+    # Folders are merged into existing ones, files replace existing ones
+    # Streams: folders are created as the host tree is walked and contents
+    # are read chunk_size bytes at a time (see archive.py)
+    # With a journal, a checkpoint is taken right after (like restore)
+    # Returns dict(files, dirs, bytes, skipped, seconds, files_per_sec, mb_per_sec)
+    # Returns None if host_path isn't a directory, dest_path is invalid,
+    # reading fails midway or a folder/file would go past a quota (what was
+    # imported until then stays)
+    def import_tree(self, host_path: str, dest_path: str = "/", chunk_size: int = CHUNK_SIZE) -> dict:
+        if (not os.path.isdir(host_path)):
+            return self._fail(ErrorCode.HOST_PATH_NOT_FOUND)
+        return self._import(lambda importer, dest: importer.tree(host_path, dest),
+                            dest_path, chunk_size)
+
+    # Import a tar archive read from fileobj (plain, gz, bz2 or xz) under
+    # dest_path, same as import_tree
+    # Members are read front to back, fileobj doesn't need to be seekable
+    # Returns None if the archive is invalid, see import_tree
+    def import_tar(self, fileobj, dest_path: str = "/", chunk_size: int = CHUNK_SIZE) -> dict:
+        return self._import(lambda importer, dest: importer.tar(fileobj, dest),
+                            dest_path, chunk_size)
+
+    def _import(self, run: function, dest_path: str, chunk_size: int) -> dict:
+        journal = self.journal
+        if (journal is None):
+            return self._import_locked(run, dest_path, chunk_size)
+        with self._checkpoint_lock, journal.lock:
+            stats = self._import_locked(run, dest_path, chunk_size)
+            # Even a failed import may have changed the tree
+            if (not self._checkpoint_locked()):
+                return None
+            return stats
+
+    def _import_locked(self, run: function, dest_path: str, chunk_size: int) -> dict:
+        dir_list, is_absolute = parse_path(dest_path)
+        dest = self._walk_dir_path_absolute_or_relative(dir_list, is_absolute, "-p")
+        if (dest is None):
+            return self._fail(ErrorCode.INVALID_PATH)
+        importer = Importer(self.content_store, chunk_size, self.blobs)
+        try:
+            run(importer, dest)
+        except tarfile.TarError:
+            return self._fail(ErrorCode.INVALID_ARCHIVE)
+        except OSError:
+            return self._fail(ErrorCode.IMPORT_FAILED)
+        except QuotaExceeded:
+            return self._fail(ErrorCode.QUOTA_EXCEEDED)
+        finally:
+            if (importer.dirs):
+                self.path_cache.on_dir_created()
+        return importer.stats()
+
+    # Write the folder at path and everything under it to fileobj as an
+    # archive, format "tar" (gzipped if compress) or "zip" (deflated if compress)
+    # Streams: the tree is walked lazily and each file is read chunk_size
+    # bytes at a time straight into the archive writer, so memory doesn't
+    # grow with the tree; fileobj doesn't need to be seekable
+    # Member names are relative, under the folder's name (none for the root)
+    # Each file is archived as of one moment (read under its lock), not the
+    # whole tree: export a snapshot for a consistent archive
+    # Returns dict(files, dirs, bytes, seconds, files_per_sec, mb_per_sec)
+    # Returns None if path is invalid, a file stays locked past lock_timeout
+    # or writing fails midway (fileobj then holds a partial archive)
+    def export(self, path: str, fileobj, format: str = "tar", compress: bool = False,
+               chunk_size: int = CHUNK_SIZE) -> dict:
+        if (format not in EXPORT_FORMATS):
+            raise ValueError("Unknown archive format: " + str(format))
+        dir_list, is_absolute = parse_path(path)
+        dir = self._walk_dir_path_absolute_or_relative(dir_list, is_absolute)
+        if (dir is None):
+            return self._fail(ErrorCode.INVALID_PATH)
+        exporter = Exporter(chunk_size, self.lock_timeout)
+        try:
+            getattr(exporter, format)(dir, fileobj, compress)
+        except LockTimeout:
+            return self._fail(ErrorCode.FILE_BUSY)
+        except OSError:
+            return self._fail(ErrorCode.EXPORT_FAILED)
+        return exporter.stats()
+
+    # Deduplicate the files under path that aren't yet: each one shares the
+    # blob of its contents from then on (see dedup.py)
+    # New & written files are deduplicated as they go; this is for trees
+    # loaded from an image or recovered, which enables deduplication for
+    # the rest of the filesystem's life if it wasn't
+    # Files open by a writer are skipped
+    # Returns dedup_stats(), None if invalid path
+    def deduplicate(self, path: str = "/") -> dict:
+        dir_list, is_absolute = parse_path(path)
+        starting_dir = self._walk_dir_path_absolute_or_relative(
+            dir_list, is_absolute)
+        if (starting_dir is None):
+            return self._fail(ErrorCode.INVALID_PATH)
+        if (self.blobs is None):
+            self.blobs = BlobStore()
+        for _, node in starting_dir.walk():
+            if (not isinstance(node, File) or node.buffer.blob is not None):
+                continue
+            lock = node.lock
+            if (not lock.acquire_write(blocking=False)):
+                continue
+            try:
+                self.blobs.intern(node)
+            finally:
+                lock.release_write()
+        return self.blobs.stats()
+
+    # Dedup ratio & bytes saved by sharing blobs, see BlobStore.stats
+    # Returns None if deduplication isn't enabled
+    def dedup_stats(self) -> dict:
+        if (self.blobs is None):
+            return self._fail(ErrorCode.NO_DEDUP)
+        return self.blobs.stats()
+
+    # Compress the contents of files that go cold, see compression.py
+    # A file is cold once it isn't opened (by a handler, read_file/write_file
+    # included) during after_ops opens or for after_seconds; it's
+    # decompressed again when opened. Up to cache_bytes of decompressed
+    # contents are kept for the most recently opened files
+    # codec: "zlib" (fast) or "lzma" (smaller, slower)
+    # Cold files are compressed by a background thread, never by the open
+    # that finds them cold
+    # Replaces the policy if already enabled
+    # Returns the ColdTier; raises ValueError for an unknown codec
+    def enable_compression(self, codec: str = "zlib", after_ops: int = None,
+                           after_seconds: float = None, cache_bytes: int = 64 << 20,
+                           min_size: int = 256) -> ColdTier:
+        cold = ColdTier(self.content_store, codec, after_ops, after_seconds,
+                        cache_bytes, min_size)
+        self.disable_compression()
+        self.cold = cold
+        return self.cold
+
+    # Stop compressing; compressed contents stay so until they're used
+    def disable_compression(self) -> None:
+        cold = self.cold
+        self.cold = None
+        if (cold is not None):
+            cold.close()
+
+    # Compress every file under path now, whether cold or not (e.g. after
+    # an import); files that are open or share their contents are skipped
+    # Returns the number of files compressed, None if invalid path or
+    # compression isn't enabled
+    def compress(self, path: str = "/") -> int:
+        dir_list, is_absolute = parse_path(path)
+        starting_dir = self._walk_dir_path_absolute_or_relative(
+            dir_list, is_absolute)
+        if (starting_dir is None):
+            return self._fail(ErrorCode.INVALID_PATH)
+        if (self.cold is None):
+            return self._fail(ErrorCode.NO_COMPRESSION)
+        return self.cold.compress_tree(starting_dir)
+
+    # Compress the files that are cold by now, e.g. from a timer when
+    # after_seconds is set and nothing is being opened
+    # Returns the number of files compressed, None if compression isn't enabled
+    def compress_cold(self) -> int:
+        if (self.cold is None):
+            return self._fail(ErrorCode.NO_COMPRESSION)
+        return self.cold.compress_cold()
+
+    # Compression counters & LRU size (see ColdTier.stats), plus the
+    # logical_bytes & resident_bytes of the files under path (content_usage)
+    # Returns None if invalid path or compression isn't enabled
+    def compression_stats(self, path: str = "/") -> dict:
+        if (self.cold is None):
+            return self._fail(ErrorCode.NO_COMPRESSION)
+        usage = self.content_usage(path)
+        if (usage is None):
+            return None
+        stats = self.cold.stats()
+        stats["logical_bytes"] = usage["logical_bytes"]
+        stats["resident_bytes"] = usage["resident_bytes"]
+        return stats
+
+    # Report how file contents under path are stored
+    # Copies share one buffer until written (see File.writable_store)
+    # Returns dict:
+    #   files: number of files
+    #   logical_bytes: total size as seen through every file
+    #   shared_bytes: size of buffers referenced by more than one file (counted once)
+    #   unique_bytes: size of buffers owned by a single file
+    #   resident_bytes: memory the buffers take up (counted once), less than
+    #     their size when compressed or still in an image
+    # Returns None if invalid path
+    def content_usage(self, path: str = "/") -> dict:
+        dir_list, is_absolute = parse_path(path)
+        starting_dir = self._walk_dir_path_absolute_or_relative(
+            dir_list, is_absolute)
+        if (starting_dir is None):
+            return self._fail(ErrorCode.INVALID_PATH)
+        usage = {"files": 0, "logical_bytes": 0,
+                 "shared_bytes": 0, "unique_bytes": 0, "resident_bytes": 0}
+        seen = set()
+        for _, node in starting_dir.walk():
+            if not isinstance(node, File):
+                continue
+            size = len(node.store)
+            usage["files"] += 1
+            usage["logical_bytes"] += size
+            if id(node.buffer) in seen:
+                continue
+            seen.add(id(node.buffer))
+            usage["resident_bytes"] += node.store.resident_size()
+            if node.buffer.is_shared:
+                usage["shared_bytes"] += size
+            else:
+                usage["unique_bytes"] += size
+        return usage
+
+    # Bytes, files & folders under the folder at path, from the totals every
+    # folder keeps up to date (see Directory.usage): O(1), nothing is walked
+    # bytes: length of the contents of every file under it, like
+    #   content_usage's logical_bytes
+    # Returns dict(bytes, files, dirs), None if invalid path
+    def du(self, path: str = "/") -> dict:
+        dir_list, is_absolute = parse_path(path)
+        dir = self._walk_dir_path_absolute_or_relative(dir_list, is_absolute)
+        if (dir is None):
+            return self._fail(ErrorCode.INVALID_PATH)
+        bytes, files, dirs = dir.usage
+        return {"bytes": bytes, "files": files, "dirs": dirs}
+
+    # Describe the file or folder at path; "name" is the file if there's
+    # one, "name/" (trailing slash) always the folder
+    # Returns dict, for a file:
+    #   type "file", path, bytes (length of its contents), binary,
+    #   shared (contents shared with copies), resident_bytes (see content_usage)
+    # for a folder: type "dir", path, bytes, files, dirs (see du),
+    #   max_bytes & max_inodes (its quota, None if uncapped)
+    # Returns None if invalid path
+    def stat(self, path: str) -> dict:
+        dir_list, name, is_absolute = parse_path_with_ending_name(path)
+        parent = self._walk_dir_path_absolute_or_relative(dir_list, is_absolute)
+        file = None
+        if (parent is not None and name not in ("", ".", "..")):
+            file = parent.get_file(name)
+        if (file is not None):
+            store = file.store
+            return {"type": "file", "path": file.get_path(), "bytes": len(store),
+                    "binary": store.is_binary, "shared": file.buffer.is_shared,
+                    "resident_bytes": store.resident_size()}
+        dir_list, is_absolute = parse_path(path)
+        dir = self._walk_dir_path_absolute_or_relative(dir_list, is_absolute)
+        if (dir is None):
+            return self._fail(ErrorCode.INVALID_PATH)
+        bytes, files, dirs = dir.usage
+        max_bytes, max_inodes = dir.quota or (None, None)
+        return {"type": "dir", "path": dir.path, "bytes": bytes, "files": files, "dirs": dirs,
+                "max_bytes": max_bytes, "max_inodes": max_inodes}
+
+    # Cap the folder at path to max_bytes (length of the contents of every
+    # file under it) and/or max_inodes (files + folders under it)
+    # None: no cap; both None removes the folder's quota
+    # Checked in O(1) per capped folder against the totals every folder
+    # keeps (see Directory.usage), as part of the O(depth) update of those
+    # totals. From then on growth past a cap fails with QUOTA_EXCEEDED and
+    # changes nothing: creating, writing (write_file and write handlers),
+    # copying, moving in and importing. Usage already over the cap stays
+    # Copies of the folder (cpdir, snapshots) keep its quota
+    # Return T/F success/fail (fail if invalid path); raises ValueError for
+    # a negative cap
+    @_journaled
+    def set_quota(self, path: str, max_bytes: int = None, max_inodes: int = None) -> bool:
+        if ((max_bytes is not None and max_bytes < 0) or (max_inodes is not None and max_inodes < 0)):
+            raise ValueError("Quotas can't be negative")
+        dir_list, is_absolute = parse_path(path)
+        dir = self._walk_dir_path_absolute_or_relative(dir_list, is_absolute)
+        if (dir is None):
+            return self._fail(ErrorCode.INVALID_PATH, False)
+        dir.set_quota(max_bytes, max_inodes)
         return True
 
     # Given a path and a regex, find every
     # matching folder or file under that path
     # return tup[file_list, folder_list] of the matching pathes
-    # option "-r": Recurse under subdirectories and return all matches
+    # option "-r": Recurse under subdirectories and return all matches,
+    #   sorted by path whether the name index answered or the tree was walked
 
     # Note: path = "." is shorthand for current directory
     def find_with_regex(self, regex: str, path: str, option="") -> tuple[list, list]:
@@ -166,26 +1019,64 @@ class Filesystem:
         starting_dir = self._walk_dir_path_absolute_or_relative(
             dir_list, is_absolute)
         if (starting_dir is None):
-            print("Invalid path")
+            return self._fail(ErrorCode.INVALID_PATH)
+        pattern = re.compile(regex)
+        matches = None
+        if (option == "-r"):
+            matches = self._find_indexed(pattern, starting_dir)
+        if (matches is None):
+            matches = self._find_under(pattern, starting_dir, option)
+            if (option == "-r"):
+                matches = sorted(matches, key=lambda match: match[0])
+        file_output = []
+        folder_output = []
+        for match_path, node in matches:
+            if isinstance(node, File):
+                file_output.append(match_path)
+            else:
+                folder_output.append(match_path)
+        return (file_output, folder_output)
+
+    # Lazy version of find_with_regex
+    # Yields tuple(path, node) for each match as the tree is walked,
+    # so callers can stop early without scanning the whole subtree
+    # Yields nothing if path is invalid
+    def find_iter(self, regex: str, path: str, option=""):
+        dir_list, is_absolute = parse_path(path)
+        starting_dir = self._walk_dir_path_absolute_or_relative(
+            dir_list, is_absolute)
+        if (starting_dir is None):
+            self._fail(ErrorCode.INVALID_PATH)
             return
+        yield from self._find_under(re.compile(regex), starting_dir, option)
 
-        # Inner function (for recursion)
-        def _does_match(obj: File | Directory, regex: str) -> bool:
-            return re.match(regex, obj.name) is not None
+    # Answer a recursive find from the name index
+    # Returns a list of tuple(path, node) sorted by path,
+    # or None if the pattern has no literal text to look up
+    def _find_indexed(self, pattern: re.Pattern, starting_dir: Directory) -> list | None:
+        nodes = self.name_index.match(pattern)
+        if (nodes is None):
+            return None
+        matches = []
+        for node in nodes:
+            # Only keep nodes under the starting dir
+            if (self._is_same_or_under(node.parent, starting_dir)):
+                matches.append((node.get_path(), node))
+        # Children of copy-on-write clones aren't indexed until they are
+        # materialized, walk those subtrees (which materializes them)
+        for dir in self.name_index.lazy_list():
+            if (self._is_same_or_under(dir, starting_dir)):
+                matches.extend(self._find_under(pattern, dir, "-r"))
+        matches.sort(key=lambda match: match[0])
+        return matches
 
-        # Recurse
-        if (option == "-r"):
-            file_output, folder_output = starting_dir.recurse_with_func(
-                _does_match, args=[regex])
-            # Filter matches
-            file_output = [k for (k, v) in file_output.items() if v]
-            folder_output = [k for (k, v) in folder_output.items() if v]
-        else:  # Only check current dir
-            file_output = [f.get_path()
-                           for f in starting_dir.files.values() if _does_match(f, regex)]
-            folder_output = [
-                f.path for f in starting_dir.subfolders.values() if _does_match(f, regex)]
-        return (file_output, folder_output)
+    # Walk the tree and yield each tuple(path, node) matching pattern
+    def _find_under(self, pattern: re.Pattern, starting_dir: Directory, option=""):
+        # Without -r only look at the direct children
+        prune = None if option == "-r" else (lambda path, dir: True)
+        for match_path, node in starting_dir.walk(prune=prune):
+            if pattern.match(node.name) is not None:
+                yield match_path, node
 
     # Moves or Copies source file to dest
     # Can also use this to rename files
@@ -196,9 +1087,11 @@ class Filesystem:
     # Option [-p] Creates missing parent directories along the Dest path
     # Returns true/false on success/failure
 
+    @_journaled
     def move_file(self, source_file_path: str, dest_path: str, option="") -> bool:
         return self._move_or_copy_file(source_file_path, dest_path, False, option)
 
+    @_journaled
     def copy_file(self, source_file_path: str, dest_path: str, option="") -> bool:
         return self._move_or_copy_file(source_file_path, dest_path, True, option)
 
@@ -208,10 +1101,11 @@ class Filesystem:
             source_file_path)
         source_file_dir = self._walk_dir_path_absolute_or_relative(
             dir_list, is_absolute)
-        f = source_file_dir.get_file(source_file_name)
+        f = None
+        if (source_file_dir is not None):
+            f = source_file_dir.get_file(source_file_name)
         if (f is None):
-            print("Source file doesn't exist")
-            return False
+            return self._fail(ErrorCode.SOURCE_FILE_NOT_FOUND, False)
         # Extract Destination Directory
         dir_list, dest_file_name, is_absolute = parse_path_with_ending_name(
             dest_path)
@@ -221,61 +1115,144 @@ class Filesystem:
         dest_dir = self._walk_dir_path_absolute_or_relative(
             dir_list, is_absolute, option)
         if (dest_dir is None):
-            print("Dest Directory doesn't exist")
-            return False
-        # Move or Copy
-        # Option "-b": backup conflicts as "~name"
-        if (option == "-b"):
-            existing_file = dest_dir.get_file(dest_file_name)
-            if (existing_file is not None):
-                print(dest_file_name + " exists, creating backup")
-                existing_file.copy_in_place("~" + existing_file.name)
-            self._move_file_with_override(
-                f, dest_dir, dest_file_name, should_copy)
-            return True
-        # Option "-n": do not override conflicts
-        elif (option == "-n"):
-            existing_file = dest_dir.get_file(dest_file_name)
-            if (existing_file is None):
-                self._move_file_with_override(
-                    f, dest_dir, dest_file_name, should_copy)
-                return True
-            else:
-                print(dest_file_name + " exists in dest, move aborted")
-                return False
-        # normal move with override
-        else:
-            self._move_file_with_override(
-                f, dest_dir, dest_file_name, should_copy)
+            return self._fail(ErrorCode.DEST_DIR_NOT_FOUND, False)
+        with Directory.locks.hold(source_file_dir, dest_dir):
+            # Another thread may have removed/moved it meanwhile
+            f = source_file_dir.get_file(source_file_name)
+            if (f is None):
+                return self._fail(ErrorCode.SOURCE_FILE_NOT_FOUND, False)
+            # Move or Copy
+            # Option "-b": backup conflicts as "~name"
+            if (option == "-b"):
+                existing_file = dest_dir.get_file(dest_file_name)
+                if (existing_file is not None and
+                        existing_file.copy_in_place("~" + existing_file.name) is None):
+                    return self._fail(ErrorCode.QUOTA_EXCEEDED, False)
+            # Option "-n": do not override conflicts
+            elif (option == "-n"):
+                if (dest_dir.get_file(dest_file_name) is not None):
+                    return self._fail(ErrorCode.NAME_CONFLICT, False, dest_file_name)
+            # otherwise a normal move with override
+            if (not self._move_file_with_override(f, dest_dir, dest_file_name, should_copy)):
+                return self._fail(ErrorCode.QUOTA_EXCEEDED, False)
             return True
 
     # Precondition: source_file & dest_dir are not None
     # Moves or copies source file to dest_dir as dest_file_name,
     # overriding name conflicts
-    def _move_file_with_override(self, source_file: File, dest_dir: Directory,  dest_file_name: str, should_copy: bool) -> None:
+    # Returns False, changing nothing, if that's past a quota
+    def _move_file_with_override(self, source_file: File, dest_dir: Directory,  dest_file_name: str, should_copy: bool) -> bool:
         if (should_copy):
             source_file = source_file.copy()
-        else:
-            # unlink source from it's parent
-            old_parent_dir = source_file.parent
-            old_parent_dir.remove_file(source_file.name)
-        source_file.name = dest_file_name
-        dest_dir.add_existing_file(source_file)
+            source_file.name = sys.intern(dest_file_name)
+            return dest_dir.add_existing_file(source_file)
+        # unlink source from it's parent
+        old_parent_dir = source_file.parent
+        old_name = source_file.name
+        old_parent_dir.remove_file(old_name)
+        source_file.name = sys.intern(dest_file_name)
+        if (dest_dir.add_existing_file(source_file)):
+            return True
+        # Past a quota: put it back where it was
+        source_file.name = old_name
+        old_parent_dir.add_existing_file(source_file, check=False)
+        return False
+
+    # Moves or Copies source dir (and everything under it) to dest
+    # Same options as move_file/copy_file:
+    # By default overrides a name conflict dir in dest
+    # Option [-b] On name conflict, a backup of the conflicting dir is created with ~<dirname>
+    # Option [-n] On name conflict, operation fails
+    # Option [-p] Creates missing parent directories along the Dest path
+    # A dir can't be moved into itself or its own subdirectories
+    # Copies are copy-on-write, so copying any size of tree is O(1) up front
+    # Returns true/false on success/failure
+    @_journaled
+    def move_dir(self, source_dir_path: str, dest_path: str, option="") -> bool:
+        return self._move_or_copy_dir(source_dir_path, dest_path, False, option)
+
+    @_journaled
+    def copy_dir(self, source_dir_path: str, dest_path: str, option="") -> bool:
+        return self._move_or_copy_dir(source_dir_path, dest_path, True, option)
+
+    def _move_or_copy_dir(self, source_dir_path: str, dest_path: str, should_copy: bool, option="") -> bool:
+        with self._rename_lock:
+            return self._move_or_copy_dir_locked(source_dir_path, dest_path, should_copy, option)
+
+    # Precondition: the rename lock is held
+    def _move_or_copy_dir_locked(self, source_dir_path: str, dest_path: str, should_copy: bool, option="") -> bool:
+        # Extract Source Dir
+        dir_list, source_dir_name, is_absolute = parse_path_with_ending_name(
+            source_dir_path)
+        if (source_dir_name == ""):
+            return self._fail(ErrorCode.NO_SOURCE_DIR, False)
+        source_parent_dir = self._walk_dir_path_absolute_or_relative(
+            dir_list, is_absolute)
+        source_dir = None
+        if (source_parent_dir is not None):
+            source_dir = source_parent_dir.get_subfolder(source_dir_name)
+        if (source_dir is None):
+            return self._fail(ErrorCode.SOURCE_DIR_NOT_FOUND, False)
+        # Extract Destination Directory
+        dir_list, dest_dir_name, is_absolute = parse_path_with_ending_name(
+            dest_path)
+        # If new dir name is unspecified, keep the same name
+        if (dest_dir_name == ""):
+            dest_dir_name = source_dir_name
+        dest_dir = self._walk_dir_path_absolute_or_relative(
+            dir_list, is_absolute, option)
+        if (dest_dir is None):
+            return self._fail(ErrorCode.DEST_DIR_NOT_FOUND, False)
+        if (not should_copy and self._is_same_or_under(dest_dir, source_dir)):
+            return self._fail(ErrorCode.MOVE_INTO_ITSELF, False)
+        with Directory.locks.hold(source_parent_dir, dest_dir):
+            existing_dir = dest_dir.get_subfolder(dest_dir_name)
+            # Option "-b": backup conflicts as "~name"
+            if (option == "-b"):
+                if (existing_dir is not None and not self._move_dir_with_override(
+                        existing_dir, dest_dir, "~" + dest_dir_name, True)):
+                    return self._fail(ErrorCode.QUOTA_EXCEEDED, False)
+            # Option "-n": do not override conflicts
+            elif (option == "-n"):
+                if (existing_dir is not None):
+                    return self._fail(ErrorCode.NAME_CONFLICT, False, dest_dir_name)
+            if (not self._move_dir_with_override(
+                    source_dir, dest_dir, dest_dir_name, should_copy)):
+                return self._fail(ErrorCode.QUOTA_EXCEEDED, False)
+            return True
+
+    # Is dir the same as ancestor or somewhere under it
+    def _is_same_or_under(self, dir: Directory, ancestor: Directory) -> bool:
+        while (dir is not None):
+            if (dir is ancestor):
+                return True
+            dir = dir.parent
+        return False
 
     # Precondition: source_dir & dest_dir are not None
+    # and when moving, dest_dir is not source_dir or under it
     # Moves or copies source dir to dest_dir as new_name,
     # overriding name conflicts
-    def _move_dir_with_override(self, source_dir: Directory, dest_dir: Directory, new_name: str, should_copy: bool) -> None:
-        source_subfolders = source_dir.subfolders
-        source_files = source_dir.files
-        if (not should_copy):
-            # unlink source from it's parent
+    # Returns False, changing nothing, if that's past a quota
+    def _move_dir_with_override(self, source_dir: Directory, dest_dir: Directory, new_name: str, should_copy: bool) -> bool:
+        if (should_copy):
+            # Copy-on-write clone, children are copied lazily
+            if (not dest_dir.add_existing_subfolder(
+                    source_dir.clone(new_name, dest_dir), new_name)):
+                return False
+        else:
+            # Relink the same folder object; O(1) no matter the subtree size
             old_parent_dir = source_dir.parent
-            old_parent_dir.remove_subfolder(source_dir.name)
-        # Creating a new Directory obj fixes the path on the moved directory
-        d = dest_dir.new_subfolder(new_name)
-        d.subfolders = source_subfolders
-        d.files = source_files
+            old_name = source_dir.name
+            old_parent_dir.detach_subfolder(old_name)
+            if (not dest_dir.add_existing_subfolder(source_dir, new_name)):
+                # Past a quota: put it back where it was
+                old_parent_dir.add_existing_subfolder(source_dir, old_name, check=False)
+                return False
+        # Either way a conflicting dir may have been replaced
+        self.path_cache.on_dir_removed()
+        self.path_cache.on_dir_created()
+        return True
 
     # Given an absolute or relative ordered directory list
     # Walk and return the final directory
@@ -295,11 +1272,18 @@ class Filesystem:
     # If flag is set: create missing parent directories
     # Else Return None if flag is not set and walk is invalid
     # IMPORTANT: Only creates missing child directories, not "../"
+    # Runs of plain names between ".." are resolved through the path cache
     def _walk_dir_path(self, starting_dir: Directory, dirs: list[str], should_create_missing_dir: bool) -> Directory:
         current_dir = starting_dir
+        names = []
         for dir_name in dirs:
             # special case, ".." refers to parent directory
             if (dir_name == ".."):
+                current_dir = self._walk_names(
+                    current_dir, names, should_create_missing_dir)
+                names = []
+                if (current_dir is None):
+                    return None
                 current_dir = current_dir.parent
                 if (current_dir is None):
                     return None
@@ -307,12 +1291,177 @@ class Filesystem:
             elif (dir_name == "."):
                 continue
             else:
-                next_dir = current_dir.get_subfolder(dir_name)
-                if (next_dir is None):
-                    if (should_create_missing_dir):
-                        next_dir = current_dir.new_subfolder(dir_name)
-                    else:
-                        # stop the walk
-                        return None
-                current_dir = next_dir
+                names.append(dir_name)
+        return self._walk_names(current_dir, names, should_create_missing_dir)
+
+    # Walk a run of plain child names from starting_dir, using the path cache
+    def _walk_names(self, starting_dir: Directory, names: list[str], should_create_missing_dir: bool) -> Directory:
+        if (not names):
+            return starting_dir
+        prefix = "" if starting_dir.is_root else starting_dir.path
+        key = prefix + "/" + "/".join(names)
+        found, dir = self.path_cache.lookup(key)
+        if (found and (dir is not None or not should_create_missing_dir)):
+            return dir
+        version = self.path_cache.version()
+        current_dir = starting_dir
+        for i, dir_name in enumerate(names):
+            next_dir = current_dir.get_subfolder(dir_name)
+            if (next_dir is None):
+                if (should_create_missing_dir):
+                    # Another thread may create it first
+                    with current_dir.lock:
+                        next_dir = current_dir.get_subfolder(dir_name)
+                        if (next_dir is None):
+                            # The rest of the path is missing too, create it at once
+                            current_dir = current_dir.new_subfolders(names[i:])
+                            if (current_dir is None):
+                                return self._fail(ErrorCode.QUOTA_EXCEEDED)
+                            self.path_cache.on_dir_created()
+                            break
+                else:
+                    # stop the walk
+                    current_dir = None
+                    break
+            current_dir = next_dir
+        self.path_cache.store(key, current_dir, version)
         return current_dir
+
+
+# Journal records replayed by calling the Filesystem method of that name
+# (write_file records come from batches)
+_REPLAY_OPS = {"changedir", "mkdir", "mkfile", "remove_dir", "remove_file",
+               "move_file", "copy_file", "move_dir", "copy_dir", "write_file",
+               "set_quota"}
+# Public Filesystem methods not recorded by enable_metrics
+_UNMETERED = {"enable_metrics", "disable_metrics", "metrics"}
+# Filesystem methods Filesystem.batch can apply
+_BATCH_OPS = {"changedir", "mkdir", "mkfile", "remove_dir", "remove_file",
+              "move_file", "copy_file", "move_dir", "copy_dir",
+              "write_file", "read_file"}
+# Journal records of WriteHandler edits
+_REPLAY_HANDLER_OPS = {"fh_write", "fh_concat", "fh_insert"}
+
+
+# Delete checkpoints & journals older than generation
+def _remove_generations_before(directory: str, generation: int) -> None:
+    checkpoints, journals = list_generations(directory)
+    for gen in checkpoints:
+        if (gen < generation):
+            os.remove(checkpoint_path(directory, gen))
+    for gen in journals:
+        if (gen < generation):
+            os.remove(journal_path(directory, gen))
+
+
+# Copy-on-write clone of a tree root, detached from any index
+def _clone_root(root: Directory) -> Directory:
+    clone = root.clone("", None)
+    clone.is_root = True
+    return clone
+
+
+# Operations queued for Filesystem.batch, applied when the with block exits
+# Queue with the Filesystem method names, e.g. batch.mkdir("/a", "-p")
+# results holds the per-op results once applied
+class Batch:
+    def __init__(self, fs: Filesystem, atomic: bool = False):
+        self.fs = fs
+        self.atomic = atomic
+        # tuple(method name, *args)
+        self.ops = []
+        self.results = None
+
+    def __getattr__(self, name: str) -> function:
+        if (name not in _BATCH_OPS):
+            raise AttributeError(name)
+        return lambda *args: self.ops.append((name,) + args)
+
+    def __enter__(self) -> Batch:
+        return self
+
+    # Nothing is applied if the block raised
+    def __exit__(self, exc_type, exc, traceback) -> bool:
+        if (exc_type is None):
+            self.results = self.fs.batch(self.ops, self.atomic)
+        return False
+
+
+# Read-only point-in-time view of a Filesystem, see Filesystem.snapshot
+# Supports every read operation (cd, ls, pwd, read, find, read handlers)
+# Every operation that would modify the tree fails
+class Snapshot(Filesystem):
+    def __init__(self, name: str, root: Directory, content_store: type[ContentStore] = RopeStore):
+        super().__init__(content_store)
+        self.name = name
+        self.created = time.time()
+        self.root = root
+        self.current_dir = root
+
+    def _read_only(self) -> None:
+        self._fail(ErrorCode.READ_ONLY)
+
+    def mkdir(self, path: str, option="") -> Directory:
+        self._read_only()
+        return None
+
+    def mkfile(self, path: str, option="", binary: bool = False) -> File:
+        self._read_only()
+        return None
+
+    def remove_dir(self, path: str) -> bool:
+        self._read_only()
+        return False
+
+    def remove_file(self, path: str) -> bool:
+        self._read_only()
+        return False
+
+    def write_file(self, file_path: str, contents: str, option="") -> bool:
+        self._read_only()
+        return False
+
+    def getFileHandlerFromPath(self, file_path: str, is_write: bool) -> FileHandler:
+        if (is_write):
+            self._read_only()
+            return None
+        return super().getFileHandlerFromPath(file_path, is_write)
+
+    def _move_or_copy_file(self, source_file_path: str, dest_path: str, should_copy: bool, option="") -> bool:
+        self._read_only()
+        return False
+
+    def _move_or_copy_dir(self, source_dir_path: str, dest_path: str, should_copy: bool, option="") -> bool:
+        self._read_only()
+        return False
+
+    def snapshot(self, name: str = None) -> Snapshot:
+        self._read_only()
+        return None
+
+    def restore(self, snapshot: Snapshot | str) -> bool:
+        self._read_only()
+        return False
+
+    def _import(self, run: function, dest_path: str, chunk_size: int) -> dict:
+        self._read_only()
+        return None
+
+    def deduplicate(self, path: str = "/") -> dict:
+        self._read_only()
+        return None
+
+    def compress(self, path: str = "/") -> int:
+        self._read_only()
+        return None
+
+    def set_quota(self, path: str, max_bytes: int = None, max_inodes: int = None) -> bool:
+        self._read_only()
+        return False
+
+    # Batch through the read-only methods above
+    _batch_fast_ops = {}
+
+    # Snapshot nodes aren't in a name index, always walk
+    def _find_indexed(self, pattern: re.Pattern, starting_dir: Directory) -> list | None:
+        return None
@@ -0,0 +1,276 @@
+from __future__ import annotations
+import mmap
+import os
+import struct
+from collections import deque
+from contents import ContentStore, BytesStore
+from objects import Directory, File
+
+# Compact binary image of a tree, see Filesystem.save/Filesystem.load
+#
+# Layout (little endian):
+#   header    magic, u32 folder count, u64 offset of the folder table
+#   contents  every distinct contents buffer as utf-8 (raw bytes for
+#             binary files), back to back
+#             (copy-on-write copies share one buffer, so it's written once)
+#   records   one per folder:
+#               u32 subfolder count, u32 file count
+#               per subfolder: u32 folder id, u32 name length, name
+#               per file: u32 name length, name, u64 contents offset,
+#                         u64 contents length in bytes, u64 length in chars,
+#                         u8 1 if binary
+#   table     per folder, by folder id (root is 0):
+#               u64 offset of its record,
+#               u64 bytes, u64 files, u64 folders under it (see Directory.usage),
+#               i64 max bytes, i64 max inodes (its quota, -1 if uncapped)
+#
+# Loading maps the file and reads nothing else up front: a folder's record
+# is only parsed the first time its children are needed, and a file's
+# contents are only decoded the first time they are read
+# A folder's totals & quota come from the table when its parent is
+# materialized, so du/quotas work without reading what's under it
+# (binary contents are served straight from the mapping until modified)
+
+MAGIC = b"MSFSIMG3"
+_HEADER = struct.Struct("<8sIQ")
+_COUNTS = struct.Struct("<II")
+_ENTRY = struct.Struct("<II")
+_NAME_LEN = struct.Struct("<I")
+_CONTENTS = struct.Struct("<QQQ?")
+_TABLE = struct.Struct("<QQQQqq")
+
+
+# Write the tree under root to path
+# Written to a temp file first and renamed over path, so a crash never
+# leaves a half written image and a loaded image that is still mapped
+# keeps its old contents
+def save_image(root: Directory, path: str) -> None:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, 0, 0))
+        # id(buffer) -> tuple(offset, byte length, char length, is binary)
+        written = {}
+        records = []
+        # Folders get ids in BFS order, contents are written as files are seen
+        queue = deque([root])
+        next_id = 1
+        while queue:
+            dir = queue.popleft()
+            subfolders = []
+            for name, sub in dir.subfolders.items():
+                subfolders.append((next_id, name))
+                queue.append(sub)
+                next_id += 1
+            files = []
+            for name, file in dir.files.items():
+                buffer = file.buffer
+                location = written.get(id(buffer))
+                if (location is None):
+                    store = buffer.store
+                    data = store.get() if store.is_binary else store.get().encode()
+                    location = (f.tell(), len(data), len(store), store.is_binary)
+                    f.write(data)
+                    written[id(buffer)] = location
+                files.append((name, location))
+            bytes, file_count, dir_count = dir.usage
+            max_bytes, max_inodes = dir.quota or (None, None)
+            records.append((subfolders, files, (bytes, file_count, dir_count,
+                                                -1 if max_bytes is None else max_bytes,
+                                                -1 if max_inodes is None else max_inodes)))
+        table = []
+        for subfolders, files, usage in records:
+            table.append((f.tell(),) + usage)
+            f.write(_COUNTS.pack(len(subfolders), len(files)))
+            for dir_id, name in subfolders:
+                name = name.encode()
+                f.write(_ENTRY.pack(dir_id, len(name)))
+                f.write(name)
+            for name, location in files:
+                name = name.encode()
+                f.write(_NAME_LEN.pack(len(name)))
+                f.write(name)
+                f.write(_CONTENTS.pack(*location))
+        table_offset = f.tell()
+        for entry in table:
+            f.write(_TABLE.pack(*entry))
+        f.seek(0)
+        f.write(_HEADER.pack(MAGIC, len(records), table_offset))
+    os.replace(tmp_path, path)
+
+
+# Map the image at path and return its root folder, not materialized
+# The rest of the tree is read from the image as it's touched
+# content_store: engine class a file's contents are loaded into
+# Raises OSError/ValueError for a missing or invalid image
+def load_image(path: str, index, content_store: type[ContentStore]) -> Directory:
+    image = _Image(path, content_store)
+    root = Directory("", None, is_root=True, index=index)
+    root._backing = _ImageDir(image, 0)
+    image.usage(0, root)
+    return root
+
+
+# An opened image file
+# Kept alive by the folders and files still reading from it
+class _Image:
+    def __init__(self, path: str, content_store: type[ContentStore]):
+        with open(path, "rb") as f:
+            # The mapping stays valid after the file is closed
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if (len(self.mm) < _HEADER.size):
+            raise ValueError("Invalid image")
+        magic, self.dir_count, self.table_offset = _HEADER.unpack_from(self.mm, 0)
+        if (magic != MAGIC or self.table_offset + _TABLE.size * self.dir_count > len(self.mm)):
+            raise ValueError("Invalid image")
+        self.content_store = content_store
+
+    # Parse folder dir_id's record
+    # Returns tuple(list of tuple(name, folder id),
+    #               list of tuple(name, offset, byte length, char length, is binary))
+    def record(self, dir_id: int) -> tuple[list, list]:
+        mm = self.mm
+        pos = _TABLE.unpack_from(mm, self.table_offset + _TABLE.size * dir_id)[0]
+        subfolder_count, file_count = _COUNTS.unpack_from(mm, pos)
+        pos += _COUNTS.size
+        subfolders = []
+        for _ in range(subfolder_count):
+            child_id, name_len = _ENTRY.unpack_from(mm, pos)
+            pos += _ENTRY.size
+            subfolders.append((mm[pos:pos + name_len].decode(), child_id))
+            pos += name_len
+        files = []
+        for _ in range(file_count):
+            name_len, = _NAME_LEN.unpack_from(mm, pos)
+            pos += _NAME_LEN.size
+            name = mm[pos:pos + name_len].decode()
+            pos += name_len
+            files.append((name,) + _CONTENTS.unpack_from(mm, pos))
+            pos += _CONTENTS.size
+        return subfolders, files
+
+    # Set dir's totals & quota to folder dir_id's
+    def usage(self, dir_id: int, dir: Directory) -> None:
+        _, bytes, file_count, dir_count, max_bytes, max_inodes = _TABLE.unpack_from(
+            self.mm, self.table_offset + _TABLE.size * dir_id)
+        dir._bytes, dir._file_count, dir._dir_count = bytes, file_count, dir_count
+        if (max_bytes >= 0 or max_inodes >= 0):
+            dir.set_quota(None if max_bytes < 0 else max_bytes,
+                          None if max_inodes < 0 else max_inodes)
+
+
+# Backing of a folder that is still in the image (see Directory._backing)
+class _ImageDir:
+    __slots__ = ("image", "dir_id")
+
+    def __init__(self, image: _Image, dir_id: int):
+        self.image = image
+        self.dir_id = dir_id
+
+    # Fill in dir's children from the image, one level down
+    def _populate(self, dir: Directory) -> None:
+        subfolders, files = self.image.record(self.dir_id)
+        for name, child_id in subfolders:
+            child = Directory(name, dir)
+            child._backing = _ImageDir(self.image, child_id)
+            self.image.usage(child_id, child)
+            if (child.index is not None):
+                child.index.add_lazy(child)
+            dir._subfolder_map()[child.name] = child
+        for name, offset, byte_length, length, binary in files:
+            file = File(name, dir, MappedStore(
+                self.image, offset, byte_length, length, binary))
+            dir._file_map()[file.name] = file
+
+
+# Contents of a file that is still in the image
+# Decoded into a regular store (the image's content_store, or a BytesStore
+# for binary contents) the first time they're needed; the length is known
+# without decoding
+# Binary contents are read (get/view) straight from the mapping until
+# the file is modified
+class MappedStore(ContentStore):
+    __slots__ = ("_image", "_offset", "_byte_length", "_length", "is_binary", "_store")
+
+    def __init__(self, image: _Image, offset: int, byte_length: int, length: int, binary: bool = False):
+        self._image = image
+        self._offset = offset
+        self._byte_length = byte_length
+        self._length = length
+        self.is_binary = binary
+        self._store = None
+
+    # The decoded store, loading it on first use
+    def _loaded(self) -> ContentStore:
+        store = self._store
+        if (store is None):
+            if (self.is_binary):
+                store = self._store = BytesStore(self._mapped())
+            else:
+                data = self._image.mm[self._offset:self._offset + self._byte_length]
+                store = self._store = self._image.content_store(data.decode())
+        return store
+
+    # Read-only view of the contents in the mapping
+    def _mapped(self) -> memoryview:
+        return memoryview(self._image.mm)[self._offset:self._offset + self._byte_length]
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._store is not None
+
+    # Contents still in the mapping aren't resident
+    def resident_size(self) -> int:
+        store = self._store
+        return len(store) if store is not None else 0
+
+    def __len__(self) -> int:
+        if (self._store is None):
+            return self._length
+        return len(self._store)
+
+    def get(self, start: int = 0, end: int = None) -> str:
+        if (self.is_binary and self._store is None):
+            return self._mapped()[start:end].tobytes()
+        return self._loaded().get(start, end)
+
+    def view(self, start: int = 0, end: int = None) -> memoryview:
+        if (self._store is None):
+            return self._mapped()[start:end]
+        return self._store.view(start, end)
+
+    # Overwriting never needs the old contents
+    def set(self, text: str) -> None:
+        if (self.is_binary):
+            self._store = BytesStore(text)
+        else:
+            self._store = self._image.content_store(text)
+
+    def concat(self, text: str) -> None:
+        self._loaded().concat(text)
+
+    def insert(self, i: int, text: str) -> None:
+        self._loaded().insert(i, text)
+
+    def copy(self) -> ContentStore:
+        if (self._store is None):
+            return MappedStore(self._image, self._offset, self._byte_length,
+                               self._length, self.is_binary)
+        return self._store.copy()
+
+    def newline_count(self) -> int:
+        return self._loaded().newline_count()
+
+    def newlines_before(self, i: int) -> int:
+        return self._loaded().newlines_before(i)
+
+    def nth_newline(self, k: int) -> int:
+        return self._loaded().nth_newline(k)
+
+    def find_newline(self, start: int) -> int:
+        return self._loaded().find_newline(start)
+
+    def line_count(self) -> int:
+        return self._loaded().line_count()
+
+    def line_start(self, n: int) -> int:
+        return self._loaded().line_start(n)
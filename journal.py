@@ -0,0 +1,228 @@
+from __future__ import annotations
+import base64
+import json
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+
+# Write-ahead journal of logical Filesystem operations, see Filesystem.recover
+#
+# A journal directory holds:
+#   checkpoint.<gen>.img  image of the whole tree (see image.py)
+#   journal.<gen>.log     operations applied after checkpoint <gen> was taken
+# Checkpoint <gen> + journals <gen>, <gen+1>, ... replayed in order give the
+# current tree. A missing checkpoint just means starting from an empty tree
+#
+# Each record is: u32 payload length, u32 crc32 of payload, payload
+# The payload is the JSON list [op, *args]. Replay stops at the first torn
+# or corrupt record, which is where a crash cut the journal short
+# Binary contents (bytes args) are written as {"b64": base64 text}
+#
+# Group commit: records are appended to memory and a background thread
+# writes + fsyncs them in batches, so one fsync covers many operations
+#   sync=True: log()/wait() only returns once the record is on disk;
+#     concurrent callers share one fsync
+#   sync=False: returns right away; a crash can lose the last
+#     batch_delay seconds (or batch_size records) of operations
+#   A batch is written once batch_size records are pending or the oldest
+#   pending record has waited batch_delay seconds
+
+_RECORD = struct.Struct("<II")
+_FILE_NAME = re.compile(r"^(journal|checkpoint)\.(\d+)\.(log|img)$")
+
+
+def journal_path(directory: str, generation: int) -> str:
+    return os.path.join(directory, "journal.%08d.log" % generation)
+
+
+def checkpoint_path(directory: str, generation: int) -> str:
+    return os.path.join(directory, "checkpoint.%08d.img" % generation)
+
+
+# Generations present in directory
+# Returns tuple(checkpoint generations, journal generations), both sorted
+def list_generations(directory: str) -> tuple[list[int], list[int]]:
+    checkpoints = []
+    journals = []
+    for name in os.listdir(directory):
+        match = _FILE_NAME.match(name)
+        if (match is None):
+            continue
+        if (match.group(1) == "journal" and match.group(3) == "log"):
+            journals.append(int(match.group(2)))
+        elif (match.group(1) == "checkpoint" and match.group(3) == "img"):
+            checkpoints.append(int(match.group(2)))
+    return sorted(checkpoints), sorted(journals)
+
+
+def encode_record(op: str, args: tuple) -> bytes:
+    payload = json.dumps([op, *args], separators=(",", ":"),
+                         default=_encode_bytes).encode()
+    return _RECORD.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def _encode_bytes(value) -> dict:
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {"b64": base64.b64encode(value).decode()}
+    raise TypeError("Can't journal " + type(value).__name__)
+
+
+def _decode_bytes(value: dict):
+    if (len(value) == 1 and "b64" in value):
+        return base64.b64decode(value["b64"])
+    return value
+
+
+# Yield every intact record in a journal file as a list [op, *args]
+# Stops at the first torn/corrupt record
+# Returns (as the generator's value) the byte length of the intact prefix
+def read_records(path: str):
+    with open(path, "rb") as f:
+        data = f.read()
+    pos = 0
+    while (pos + _RECORD.size <= len(data)):
+        length, crc = _RECORD.unpack_from(data, pos)
+        payload = data[pos + _RECORD.size:pos + _RECORD.size + length]
+        if (len(payload) < length or zlib.crc32(payload) != crc):
+            break
+        try:
+            record = json.loads(payload, object_hook=_decode_bytes)
+        except ValueError:
+            break
+        yield record
+        pos += _RECORD.size + length
+    return pos
+
+
+class Journal:
+    # directory: where journal files live
+    # generation: journal file to append to
+    # fsync: False skips fsync (only protects against the process dying)
+    def __init__(self, directory: str, generation: int, sync: bool = True,
+                 batch_size: int = 64, batch_delay: float = 0.0, fsync: bool = True):
+        self.directory = directory
+        self.generation = generation
+        self.sync = sync
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.fsync = fsync
+        # Hold while applying an operation and logging it, so records are in
+        # the same order the operations took effect
+        self.lock = threading.RLock()
+        # Records logged since the last rotate (i.e. checkpoint)
+        self.records_since_checkpoint = 0
+        # Counters for benchmarks/tests
+        self.batches = 0
+        self.records = 0
+        self.error = None
+        self._cond = threading.Condition()
+        self._pending = []
+        self._oldest_pending = 0.0
+        self._seq = 0
+        self._durable = 0
+        self._flush_requested = False
+        self._closing = False
+        # Guards _file against rotate while the flusher writes to it
+        self._io_lock = threading.Lock()
+        self._file = open(journal_path(directory, generation), "ab")
+        self._thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self._thread.start()
+
+    # Append a record; returns its sequence number for wait()
+    # Call with self.lock held
+    def log(self, op: str, args: tuple) -> int:
+        data = encode_record(op, args)
+        with self._cond:
+            if (not self._pending):
+                self._oldest_pending = time.monotonic()
+            self._pending.append(data)
+            self._seq += 1
+            self.records_since_checkpoint += 1
+            # The flusher only cares when a batch starts or fills up
+            if (len(self._pending) == 1 or len(self._pending) >= self.batch_size):
+                self._cond.notify_all()
+            return self._seq
+
+    # In sync mode, block until record seq is on disk
+    # Call without self.lock held, so other threads can join the batch
+    # Raises OSError if the journal can't be written
+    def wait(self, seq: int) -> None:
+        if (not self.sync):
+            return
+        self._wait_durable(seq)
+
+    # Write everything logged so far, regardless of batching
+    def flush(self) -> None:
+        with self._cond:
+            seq = self._seq
+            self._flush_requested = True
+            self._cond.notify_all()
+        self._wait_durable(seq)
+
+    # Start a new journal file for generation; everything logged before
+    # stays in the old file
+    # Call with self.lock held
+    def rotate(self, generation: int) -> None:
+        self.flush()
+        with self._io_lock:
+            self._file.close()
+            self.generation = generation
+            self._file = open(journal_path(self.directory, generation), "ab")
+        self.records_since_checkpoint = 0
+
+    def close(self) -> None:
+        self.flush()
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        self._thread.join()
+        with self._io_lock:
+            self._file.close()
+
+    def _wait_durable(self, seq: int) -> None:
+        with self._cond:
+            while (self._durable < seq and self.error is None):
+                self._cond.wait()
+            if (self.error is not None):
+                raise self.error
+
+    # Background thread: write + fsync pending records in batches
+    def _flush_loop(self) -> None:
+        while True:
+            with self._cond:
+                while (not self._pending and not self._closing):
+                    self._flush_requested = False
+                    self._cond.wait()
+                if (not self._pending):
+                    return
+                # Let the batch fill up, unless someone needs it now
+                while (len(self._pending) < self.batch_size and
+                       not self._flush_requested and not self._closing):
+                    remaining = self._oldest_pending + self.batch_delay - time.monotonic()
+                    if (remaining <= 0):
+                        break
+                    self._cond.wait(remaining)
+                batch = self._pending
+                self._pending = []
+                upto = self._seq
+            try:
+                with self._io_lock:
+                    self._file.write(b"".join(batch))
+                    self._file.flush()
+                    if (self.fsync):
+                        os.fsync(self._file.fileno())
+            except OSError as e:
+                with self._cond:
+                    self.error = e
+                    self._cond.notify_all()
+                return
+            with self._cond:
+                self._durable = upto
+                self.batches += 1
+                self.records += len(batch)
+                if (self._durable == self._seq):
+                    self._flush_requested = False
+                self._cond.notify_all()
@@ -0,0 +1,176 @@
+from __future__ import annotations
+import threading
+import time
+from contextlib import contextmanager
+
+# Locking primitives used to make a Filesystem safe to share between threads
+#
+# RWLock guards file contents: many readers or one writer
+# LockStripes hands out a lock per Directory without storing one on every folder
+#
+# Lock ownership is tracked by an owner token (the calling thread by default)
+# rather than by the thread that releases, so a handler opened on one thread
+# can be closed from another (e.g. a thread pool worker)
+
+
+# Reader-writer lock, writer preferring
+#   - any number of owners can hold it for reading at once
+#   - one owner can hold it for writing, excluding all other owners
+#   - a new reader waits while a writer is waiting, so writers aren't starved
+# Reentrant per owner:
+#   - an owner holding it for writing can also take it for reading
+#   - an owner holding it for reading can upgrade to writing once it is the
+#     only reader left; if two owners try to upgrade at once, the second fails
+#     instead of deadlocking
+# blocking=False fails right away, timeout (seconds) bounds the wait
+# Every acquire returns T/F on success/fail
+class RWLock:
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        # owner -> number of read holds
+        self._readers = {}
+        self._writer = None
+        self._writer_holds = 0
+        self._waiting_writers = 0
+        self._upgrading = None
+
+    def acquire_read(self, blocking: bool = True, timeout: float = None, owner=None) -> bool:
+        if (owner is None):
+            owner = threading.get_ident()
+        with self._cond:
+            # Reentrant: a writer or an existing reader never waits
+            if (self._writer != owner and owner not in self._readers):
+                if not self._wait(lambda: self._writer is None and not self._waiting_writers,
+                                  blocking, timeout):
+                    return False
+            self._readers[owner] = self._readers.get(owner, 0) + 1
+            return True
+
+    def release_read(self, owner=None) -> None:
+        if (owner is None):
+            owner = threading.get_ident()
+        with self._cond:
+            holds = self._readers.get(owner)
+            if (holds is None):
+                raise RuntimeError("Cannot release a read lock that isn't held")
+            if (holds == 1):
+                del self._readers[owner]
+                self._cond.notify_all()
+            else:
+                self._readers[owner] = holds - 1
+
+    def acquire_write(self, blocking: bool = True, timeout: float = None, owner=None) -> bool:
+        if (owner is None):
+            owner = threading.get_ident()
+        with self._cond:
+            if (self._writer == owner):
+                self._writer_holds += 1
+                return True
+            upgrading = owner in self._readers
+            if (upgrading):
+                # Two upgraders would wait on each other forever
+                if (self._upgrading is not None):
+                    return False
+                self._upgrading = owner
+            self._waiting_writers += 1
+            try:
+                # An upgrader only waits for the other readers to leave
+                if not self._wait(lambda: self._writer is None and
+                                  len(self._readers) == (1 if upgrading else 0),
+                                  blocking, timeout):
+                    return False
+            finally:
+                self._waiting_writers -= 1
+                if (upgrading):
+                    self._upgrading = None
+                # Readers held back by this waiting writer can go again
+                self._cond.notify_all()
+            self._writer = owner
+            self._writer_holds = 1
+            return True
+
+    def release_write(self, owner=None) -> None:
+        if (owner is None):
+            owner = threading.get_ident()
+        with self._cond:
+            if (self._writer != owner):
+                raise RuntimeError("Cannot release a write lock that isn't held")
+            self._writer_holds -= 1
+            if (self._writer_holds == 0):
+                self._writer = None
+                self._cond.notify_all()
+
+    # Is owner (default: this thread) holding the lock for writing
+    def is_writer(self, owner=None) -> bool:
+        if (owner is None):
+            owner = threading.get_ident()
+        return self._writer == owner
+
+    # Number of owners currently holding the lock for reading
+    @property
+    def reader_count(self) -> int:
+        return len(self._readers)
+
+    @contextmanager
+    def read_locked(self):
+        self.acquire_read()
+        try:
+            yield self
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write_locked(self):
+        self.acquire_write()
+        try:
+            yield self
+        finally:
+            self.release_write()
+
+    # Precondition: self._cond is held
+    # Wait until ready() is true; T/F on success/gave up
+    def _wait(self, ready, blocking: bool, timeout: float) -> bool:
+        if ready():
+            return True
+        if (not blocking):
+            return False
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not ready():
+            if (deadline is None):
+                self._cond.wait()
+                continue
+            remaining = deadline - time.monotonic()
+            if (remaining <= 0):
+                return False
+            self._cond.wait(remaining)
+        return True
+
+
+# Fixed pool of reentrant locks, picked by object identity
+# Gives every Directory its own lock as far as contention is concerned,
+# without allocating a lock per folder; two folders may share a stripe,
+# which only costs some extra contention
+class LockStripes:
+    def __init__(self, count: int = 64):
+        self._locks = [threading.RLock() for _ in range(count)]
+
+    def _index(self, obj) -> int:
+        # ids are aligned, drop the low bits so stripes are used evenly
+        return (id(obj) >> 4) % len(self._locks)
+
+    def get(self, obj) -> threading.RLock:
+        return self._locks[self._index(obj)]
+
+    # Hold the locks of every object at once
+    # Always taken in stripe order so two callers can't deadlock
+    @contextmanager
+    def hold(self, *objs):
+        indexes = sorted({self._index(obj) for obj in objs})
+        locks = [self._locks[i] for i in indexes]
+        for lock in locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(locks):
+                lock.release()
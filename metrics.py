@@ -0,0 +1,213 @@
+from __future__ import annotations
+import threading
+import time
+from errors import last_error
+
+# Opt-in per-operation metrics, see Filesystem.enable_metrics
+#
+# Enabling metrics shadows each public Filesystem method with a timing
+# wrapper set on the instance, and switches every handler it hands out
+# from then on to a subclass with timed read/write methods. Disabling
+# deletes the wrappers again, so a Filesystem without metrics runs the
+# plain class methods: no flag is checked on any call
+#
+# Per operation: calls, errors (raised, or recorded an FsError, see errors.py),
+# bytes in/out (chars for text files) and a latency histogram
+
+# Histogram resolution: each power of two is split into 2**SUB_BUCKET_BITS
+# linear buckets, so a recorded value is off by at most 1/16 (~6%)
+SUB_BUCKET_BITS = 4
+_SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+
+
+# HDR-style log-linear histogram of non-negative ints (nanoseconds here)
+# Constant memory and O(1) record no matter how many values or how spread
+# out; percentiles are read off the bucket counts
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (64 * _SUB_BUCKETS)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def record(self, value: int) -> None:
+        self.counts[_bucket(value)] += 1
+        self.count += 1
+        self.total += value
+        if (self.min is None or value < self.min):
+            self.min = value
+        if (value > self.max):
+            self.max = value
+
+    # Value at percentile p (0-100): the upper end of the bucket holding
+    # the value at that rank, capped by the max recorded
+    def percentile(self, p: float) -> int:
+        if (self.count == 0):
+            return 0
+        rank = max(round(p / 100 * self.count), 1)
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if (seen >= rank):
+                return min(_bucket_upper(i), self.max)
+        return self.max
+
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+# Bucket of value: exact below _SUB_BUCKETS, then _SUB_BUCKETS linear
+# buckets per power of two
+def _bucket(value: int) -> int:
+    if (value < _SUB_BUCKETS):
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS - 1
+    return shift * _SUB_BUCKETS + (value >> shift)
+
+
+# Largest value landing in bucket i
+def _bucket_upper(i: int) -> int:
+    if (i < 2 * _SUB_BUCKETS):
+        return i
+    shift, top = divmod(i, _SUB_BUCKETS)
+    top += _SUB_BUCKETS
+    shift -= 1
+    return ((top + 1) << shift) - 1
+
+
+# Counters & latencies of one operation
+class OpStats:
+    __slots__ = ("calls", "errors", "bytes_in", "bytes_out", "latency")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.latency = Histogram()
+
+    def as_dict(self) -> dict:
+        latency = self.latency
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "latency_us": {
+                "mean": latency.mean() / 1000,
+                "min": (latency.min or 0) / 1000,
+                "p50": latency.percentile(50) / 1000,
+                "p90": latency.percentile(90) / 1000,
+                "p99": latency.percentile(99) / 1000,
+                "p999": latency.percentile(99.9) / 1000,
+                "max": latency.max / 1000,
+            },
+        }
+
+
+# Every operation's stats for one Filesystem
+# Thread safe
+class Metrics:
+    def __init__(self):
+        # operation name -> OpStats
+        self.ops = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, nanoseconds: int, failed: bool, bytes_in: int, bytes_out: int) -> None:
+        with self._lock:
+            stats = self.ops.get(name)
+            if (stats is None):
+                stats = self.ops[name] = OpStats()
+            stats.calls += 1
+            stats.errors += failed
+            stats.bytes_in += bytes_in
+            stats.bytes_out += bytes_out
+            stats.latency.record(nanoseconds)
+
+    # operation name -> dict of its counters & latency percentiles
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {name: stats.as_dict() for name, stats in sorted(self.ops.items())}
+
+    def reset(self) -> None:
+        with self._lock:
+            self.ops = {}
+
+    # Wrap a method so every call is recorded as name
+    # bytes_in(args) / bytes_out(result) size the data passed in / out
+    # A call failed if it raised or recorded a new last_error()
+    def wrap(self, name: str, method: function, bytes_in: function = None,
+             bytes_out: function = None) -> function:
+        record = self.record
+        clock = time.perf_counter_ns
+
+        def wrapper(*args, **kwargs):
+            error = last_error()
+            start = clock()
+            try:
+                result = method(*args, **kwargs)
+            except BaseException:
+                record(name, clock() - start, True,
+                       bytes_in(args) if bytes_in is not None else 0, 0)
+                raise
+            elapsed = clock() - start
+            record(name, elapsed, last_error() is not error,
+                   bytes_in(args) if bytes_in is not None else 0,
+                   bytes_out(result) if bytes_out is not None and result is not None else 0)
+            return result
+        wrapper.__name__ = method.__name__
+        wrapper.__qualname__ = method.__qualname__
+        wrapper.__doc__ = method.__doc__
+        # Keep exposing a journaled method's unjournaled function (see
+        # Filesystem.batch), which then bypasses the wrapper
+        unwrapped = getattr(method, "__wrapped__", None)
+        if (unwrapped is not None):
+            wrapper.__wrapped__ = unwrapped
+        return wrapper
+
+
+def _size(value) -> int:
+    return len(value) if value is not None else 0
+
+
+# Data passed in / returned by a Filesystem method, by method name
+# bytes_in gets the call's positional args
+FILESYSTEM_BYTES_IN = {
+    "write_file": lambda args: _size(args[1]) if len(args) > 1 else 0,
+}
+FILESYSTEM_BYTES_OUT = {
+    "read_file": _size,
+}
+# Handler methods recorded as "<class>.<method>"
+HANDLER_METHODS = {
+    "ReadHandler": ("read_next", "read_to_end", "read_line", "read", "readinto", "read_view"),
+    "WriteHandler": ("write", "concat", "insert"),
+}
+# (args[0] is the handler)
+HANDLER_BYTES_IN = {
+    "write": lambda args: _size(args[1]),
+    "concat": lambda args: _size(args[1]),
+    "insert": lambda args: _size(args[1]),
+}
+HANDLER_BYTES_OUT = {
+    "read_next": _size,
+    "read_to_end": _size,
+    "read_line": _size,
+    "read": _size,
+    "read_view": _size,
+    # returns the number of bytes copied
+    "readinto": lambda n: n,
+}
+
+
+# Subclass of a handler class whose read/write methods record to metrics
+# Adds no fields, so a handler's __class__ can be switched to it
+def metered_handler_class(metrics: Metrics, cls: type) -> type:
+    kind = cls.__name__
+    methods = {"__slots__": ()}
+    for method_name in HANDLER_METHODS.get(kind, ()):
+        methods[method_name] = metrics.wrap(
+            kind + "." + method_name, getattr(cls, method_name),
+            HANDLER_BYTES_IN.get(method_name), HANDLER_BYTES_OUT.get(method_name))
+    return type("Metered" + kind, (cls,), methods)
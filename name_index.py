@@ -0,0 +1,323 @@
+from __future__ import annotations
+import re
+import threading
+import weakref
+
+
+# Global index of every file & folder name in a tree
+# Kept up to date by Directory as children are linked/unlinked
+#   name -> the node with that name, or a set of them if there are several
+#   (most names are unique; a set per name would dominate the index's memory)
+#   trigram -> set of names containing that trigram
+# Lets find_with_regex answer patterns that contain literal text
+# without scanning the whole tree
+# Children of copy-on-write clones are only indexed once materialized;
+# until then the clone is tracked in lazy_dirs
+# Thread safe; lock order is copy-on-write lock (objects.py) -> index lock
+class NameIndex:
+    def __init__(self):
+        self._nodes = {}
+        self._trigrams = {}
+        self.lazy_dirs = weakref.WeakSet()
+        self._lock = threading.RLock()
+
+    # Register a node under its current name
+    def add(self, node) -> None:
+        with self._lock:
+            entry = self._nodes.get(node.name)
+            if entry is None:
+                self._nodes[node.name] = node
+                for t in _trigrams(node.name):
+                    self._trigrams.setdefault(t, set()).add(node.name)
+            elif isinstance(entry, set):
+                entry.add(node)
+            elif entry is not node:
+                self._nodes[node.name] = {entry, node}
+
+    # Register a node that was just linked under node.parent
+    # The parent's index is checked under the lock, so a node linked while
+    # another thread removes the parent's subtree is never left in the index
+    def link(self, node) -> None:
+        with self._lock:
+            index = node.parent.index
+            if (hasattr(node, "index")):
+                node.index = index
+            if (index is self):
+                self.add(node)
+                return
+        if (index is not None):
+            index.link(node)
+
+    # Unregister a node, NOOp if it isn't registered
+    def remove(self, node) -> None:
+        with self._lock:
+            entry = self._nodes.get(node.name)
+            if isinstance(entry, set):
+                entry.discard(node)
+                if (len(entry) == 1):
+                    self._nodes[node.name] = entry.pop()
+                return
+            if entry is node:
+                del self._nodes[node.name]
+                for t in _trigrams(node.name):
+                    names = self._trigrams[t]
+                    names.discard(node.name)
+                    if not names:
+                        del self._trigrams[t]
+
+    # Track an unmaterialized clone
+    def add_lazy(self, dir) -> None:
+        with self._lock:
+            self.lazy_dirs.add(dir)
+
+    def discard_lazy(self, dir) -> None:
+        with self._lock:
+            self.lazy_dirs.discard(dir)
+
+    # Unmaterialized clones, as a list that is safe to iterate
+    def lazy_list(self) -> list:
+        with self._lock:
+            return list(self.lazy_dirs)
+
+    # Unregister a folder and everything under it
+    # The folders are detached from the index, so anything created under
+    # them later (e.g. a clone materializing) isn't registered either
+    # Doesn't descend into unmaterialized clones, nothing under them is indexed
+    # Pruning at clones also means the walk never materializes anything,
+    # so the index lock is never held while waiting on the copy-on-write lock
+    def remove_subtree(self, dir) -> None:
+        with self._lock:
+            if (not dir.is_lazy):
+                for _, node in dir.walk(prune=lambda path, d: d.is_lazy):
+                    self.remove(node)
+                    if (hasattr(node, "index")):
+                        node.index = None
+                        self.lazy_dirs.discard(node)
+            self.lazy_dirs.discard(dir)
+            self.remove(dir)
+            dir.index = None
+
+    # Register a folder and everything under it, the reverse of remove_subtree
+    def add_subtree(self, dir) -> None:
+        with self._lock:
+            dir.index = self
+            self.add(dir)
+            if (dir.is_lazy):
+                self.lazy_dirs.add(dir)
+                return
+            for _, node in dir.walk(prune=lambda path, d: d.is_lazy):
+                self.add(node)
+                if (hasattr(node, "index")):
+                    node.index = self
+                    if (node.is_lazy):
+                        self.lazy_dirs.add(node)
+
+    # Number of distinct names
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    # Return every indexed node whose name matches the compiled pattern
+    # (re.match semantics), or None if the pattern has no usable
+    # literal text and the caller should scan the tree instead
+    def match(self, pattern: re.Pattern) -> list | None:
+        with self._lock:
+            names = self._candidate_names(pattern)
+            if names is None:
+                return None
+            output = []
+            for name in names:
+                if pattern.match(name) is not None:
+                    entry = self._nodes[name]
+                    if isinstance(entry, set):
+                        output.extend(entry)
+                    else:
+                        output.append(entry)
+            return output
+
+    # Narrow down the names that could match using trigrams of the
+    # literals the pattern requires
+    def _candidate_names(self, pattern: re.Pattern) -> set | None:
+        literals = required_literals(pattern)
+        trigrams = set()
+        for literal in literals:
+            trigrams.update(_trigrams(literal))
+        if not trigrams:
+            return None
+        # Start from the rarest trigram so the intersections stay small
+        sets = sorted((self._trigrams.get(t, set()) for t in trigrams), key=len)
+        names = set(sets[0])
+        for s in sets[1:]:
+            if not names:
+                break
+            names &= s
+        return names
+
+
+def _trigrams(text: str) -> set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+# Return the runs of literal text every match of pattern must contain
+# e.g. "name[0-9]+" -> ["name"], "a.*bcd" -> ["a", "bcd"]
+# Returns [] when nothing can be guaranteed (e.g. case insensitive)
+# The pattern is read by a small tokenizer of its own (see _tokens) rather
+# than re's private parser; anything it isn't sure about ends the current
+# run, so it may find fewer literals than there are but never a wrong one
+def required_literals(pattern: re.Pattern) -> list[str]:
+    if pattern.flags & (re.IGNORECASE | re.VERBOSE):
+        return []
+    try:
+        tokens = list(_tokens(pattern.pattern))
+        if any(kind == "|" for kind, _ in tokens):
+            return []
+        literals = []
+        run = _collect_literals(tokens, literals, [])
+    except (ValueError, IndexError):
+        return []
+    if run:
+        literals.append("".join(run))
+    return literals
+
+
+# Escapes that match one fixed char, the rest (\d, \w, \x41, \1...) vary
+# or would need decoding, so they end a run
+_LITERAL_ESCAPES = frozenset(r"\.^$*+?{}[]()|-/#&~ '" + '"' + "!%,:;<=>@_`")
+# Zero-width escapes, they don't consume chars so a run goes on across them
+_ANCHOR_ESCAPES = frozenset("AbBZ")
+# "{m}", "{m,}", "{,n}", "{m,n}" (a "{" that isn't one is a literal)
+_REPEAT = re.compile(r"\{(\d*)(,\d*)?\}")
+
+
+# Split a regex into tuple(kind, value):
+#   ("char", c) a literal char, ("anchor", None) a zero-width assertion,
+#   ("group", inner text), ("repeat", min count), ("|", None) an alternation,
+#   ("any", None) anything else that matches a varying char (., [...], \d...)
+def _tokens(text: str):
+    i = 0
+    n = len(text)
+    while i < n:
+        c = text[i]
+        if c == "\\":
+            e = text[i + 1]
+            i += 2
+            if e in _ANCHOR_ESCAPES:
+                yield "anchor", None
+            elif e in _LITERAL_ESCAPES:
+                yield "char", e
+            else:
+                # Skip the arguments of \xhh, \uhhhh, \N{name}, \123...
+                if e == "x":
+                    i += 2
+                elif e == "u":
+                    i += 4
+                elif e == "U":
+                    i += 8
+                elif e == "N":
+                    i = text.index("}", i) + 1
+                elif e.isdigit():
+                    while i < n and text[i].isdigit():
+                        i += 1
+                yield "any", None
+        elif c == "[":
+            i = _class_end(text, i)
+            yield "any", None
+        elif c == "(":
+            end = _group_end(text, i)
+            yield "group", text[i + 1:end]
+            i = end + 1
+        elif c in "*?+":
+            i += 1
+            # Lazy / possessive modifiers
+            if i < n and text[i] in "?+":
+                i += 1
+            yield "repeat", 1 if c == "+" else 0
+        elif c == "{" and _REPEAT.match(text, i):
+            match = _REPEAT.match(text, i)
+            i = match.end()
+            if i < n and text[i] in "?+":
+                i += 1
+            yield "repeat", int(match.group(1) or 0)
+        elif c in "^$":
+            i += 1
+            yield "anchor", None
+        elif c == "|":
+            i += 1
+            yield "|", None
+        elif c == ".":
+            i += 1
+            yield "any", None
+        else:
+            i += 1
+            yield "char", c
+
+
+# Index just past the "]" closing the class that starts at i
+def _class_end(text: str, i: int) -> int:
+    i += 1
+    if text[i] == "^":
+        i += 1
+    # A "]" first is a literal
+    if text[i] == "]":
+        i += 1
+    while text[i] != "]":
+        i += 2 if text[i] == "\\" else 1
+    return i + 1
+
+
+# Index of the ")" closing the group that starts at i
+def _group_end(text: str, i: int) -> int:
+    depth = 0
+    while True:
+        c = text[i]
+        if c == "\\":
+            i += 2
+            continue
+        if c == "[":
+            i = _class_end(text, i)
+            continue
+        if c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+            if depth == 0:
+                return i
+        i += 1
+
+
+# The pattern inside a plain (capturing, non-capturing or named) group,
+# None for lookarounds, inline flags, conditionals, comments...
+def _group_body(inner: str) -> str | None:
+    if not inner.startswith("?"):
+        return inner
+    if inner.startswith("?:"):
+        return inner[2:]
+    if inner.startswith("?P<"):
+        return inner[inner.index(">") + 1:]
+    return None
+
+
+# Walk a token list; contiguous literal chars extend the current run,
+# anything that can vary ends it
+# A char or group under a repeat that may skip it ends the run before it,
+# one repeated at least once ends the run after its first copy
+def _collect_literals(tokens: list, literals: list, run: list) -> list:
+    for i, (kind, value) in enumerate(tokens):
+        repeat = tokens[i + 1][1] if i + 1 < len(tokens) and tokens[i + 1][0] == "repeat" else None
+        if kind == "anchor" or kind == "repeat":
+            # Anchors don't consume chars; repeats were handled with their atom
+            continue
+        if kind == "char" and repeat != 0:
+            run.append(value)
+            if repeat is None:
+                continue
+        elif kind == "group" and repeat is None:
+            body = _group_body(value)
+            if body is not None:
+                tokens_in = list(_tokens(body))
+                if not any(k == "|" for k, _ in tokens_in):
+                    run = _collect_literals(tokens_in, literals, run)
+                    continue
+        if run:
+            literals.append("".join(run))
+        run = []
+    return run
@@ -1,39 +1,437 @@
 from __future__ import annotations
+import sys
+import threading
+import types
+import weakref
+from contents import ContentStore, ContentBuffer, RopeStore, BytesStore
+from name_index import NameIndex
+from locks import RWLock, LockStripes
+from errors import ErrorCode, fail, last_error
+
+# Namespace locks for folders, see Directory.lock
+_dir_locks = LockStripes()
+# Guards copy-on-write bookkeeping (clones, materializing, privatizing buffers)
+# Only taken while a clone exists or a buffer is shared
+_cow_lock = threading.RLock()
+# Guards creating a File's RWLock on first use
+_file_lock_init = threading.Lock()
+# Guards every folder's usage totals & quota, linking/unlinking children and
+# editing contents (see Directory.usage)
+# Taken last: only content stores' own locks are acquired while it's held
+_usage_lock = threading.Lock()
+# What a folder without files/subfolders reports as its children
+# Shared & read-only; a folder only allocates its own dict once a child is added
+_NO_CHILDREN = types.MappingProxyType({})
 
 
 class Directory:
-    def __init__(self, name: str, parent: Directory, is_root=False):
+    # Tens of millions of folders can be alive at once, so no __dict__
+    # (see benchmarks/memory_bench.py)
+    __slots__ = ("is_root", "name", "parent", "index", "_path_memo",
+                 "_subfolders", "_files", "_backing", "_clones",
+                 "_bytes", "_file_count", "_dir_count", "_quota", "__weakref__")
+    # Paths are computed from parent links on demand and memoized per folder
+    # Renaming/moving any folder bumps the generation, which invalidates
+    # every memo in O(1) instead of rewriting the whole moved subtree
+    path_generation = 0
+    # Set False to never keep memoized paths around
+    memoize_paths = True
+    # Every copy-on-write clone whose children haven't been materialized yet
+    # Empty in the common case, which keeps _before_write a single check
+    _lazy = weakref.WeakSet()
+    # Every folder's striped namespace lock
+    locks = _dir_locks
+    # Set once any folder gets a quota; until then growing skips the checks
+    quotas_set = False
+
+    # index: NameIndex shared by the whole tree, inherited from the parent
+    def __init__(self, name: str, parent: Directory, is_root=False, index: NameIndex = None):
         self.is_root = is_root
-        self.name = name
+        # Names repeat across folders (src, README, ...), interned they're stored once
+        self.name = sys.intern(name)
         self.parent = parent
-        # Prevent double //
-        if (is_root):
-            self.path = "/"
-        elif (parent.is_root):
-            self.path = parent.path + name
-        else:
-            self.path = parent.path + "/" + name
-        self.subfolders = {}
-        self.files = {}
+        if (index is None and parent is not None):
+            index = parent.index
+        self.index = index
+        # tuple(generation, path), a single assignment so threads never
+        # see a path paired with the wrong generation
+        self._path_memo = None
+        # Child maps by name, None until the first child is added
+        self._subfolders = None
+        self._files = None
+        # Copy-on-write: while set, this folder's children are
+        # logically the children of _backing and aren't materialized yet
+        # Either a Directory (clone) or anything else with _populate(dir),
+        # e.g. a folder in an on-disk image (see image.py)
+        self._backing = None
+        # Unmaterialized clones backed by this folder
+        self._clones = None
+        # Totals of everything under this folder (not itself): length of
+        # the files' contents, files, folders. Kept up to date in O(depth)
+        # as children are linked/unlinked and files resized (see _grow)
+        self._bytes = 0
+        self._file_count = 0
+        self._dir_count = 0
+        # tuple(max bytes, max inodes) under this folder, None: no quota
+        self._quota = None
+
+    # Child folders by name; materializes a copy-on-write clone on first access
+    # Read-only view when there are none, add/remove them with the methods below
+    @property
+    def subfolders(self) -> dict[str, Directory]:
+        if (self._backing is not None):
+            self._materialize()
+        return self._subfolders or _NO_CHILDREN
+
+    # Files by name; materializes a copy-on-write clone on first access
+    # Read-only view when there are none, add/remove them with the methods below
+    @property
+    def files(self) -> dict[str, File]:
+        if (self._backing is not None):
+            self._materialize()
+        return self._files or _NO_CHILDREN
+
+    # Child maps for modifying, allocated on first use
+    def _subfolder_map(self) -> dict[str, Directory]:
+        if (self._backing is not None):
+            self._materialize()
+        if (self._subfolders is None):
+            self._subfolders = {}
+        return self._subfolders
+
+    def _file_map(self) -> dict[str, File]:
+        if (self._backing is not None):
+            self._materialize()
+        if (self._files is None):
+            self._files = {}
+        return self._files
+
+    @property
+    def is_lazy(self) -> bool:
+        return self._backing is not None
+
+    # Lock guarding this folder's children
+    # Hold it to check-then-modify them atomically (e.g. create if missing)
+    @property
+    def lock(self) -> threading.RLock:
+        return _dir_locks.get(self)
+
+    # Copy-on-write copy of this folder named new_name under parent (not linked)
+    # O(1): children are only copied one level at a time, the first time
+    # either side is read through the clone or written
+    def clone(self, new_name: str, parent: Directory) -> Directory:
+        d = Directory(new_name, parent)
+        with _usage_lock:
+            d._bytes, d._file_count, d._dir_count = self._bytes, self._file_count, self._dir_count
+            d._quota = self._quota
+        with _cow_lock:
+            d._backing = self
+            if (self._clones is None):
+                self._clones = weakref.WeakSet()
+            self._clones.add(d)
+            Directory._lazy.add(d)
+            if (d.index is not None):
+                d.index.add_lazy(d)
+        return d
+
+    # Fill in this folder's children from its backing, one level down
+    def _materialize(self) -> None:
+        with _cow_lock:
+            # Another thread may have materialized it while we waited
+            if (self._backing is not None):
+                self._materialize_locked()
+
+    def _materialize_locked(self) -> None:
+        source = self._backing
+        self._backing = None
+        Directory._lazy.discard(self)
+        if (self.index is not None):
+            self.index.discard_lazy(self)
+        source._populate(self)
+        if (self.index is not None):
+            for node in self.subfolders.values():
+                self.index.link(node)
+            for node in self.files.values():
+                self.index.link(node)
+
+    # Backing side of _materialize, for a clone of this folder
+    # Subfolders become clones themselves, files share their contents buffer
+    def _populate(self, clone: Directory) -> None:
+        self._clones.discard(clone)
+        if (self.subfolders):
+            clone._subfolders = {name: dir.clone(name, clone)
+                                 for name, dir in self.subfolders.items()}
+        if (self.files):
+            clone._files = {name: File(name, clone, buffer=file.buffer.share())
+                            for name, file in self.files.items()}
+
+    # Must be called before this folder (or a file in it) is modified
+    # Clones backed by this folder or any ancestor still read through to it,
+    # so materialize them along the path first
+    def _before_write(self) -> None:
+        if (not Directory._lazy):
+            return
+        with _cow_lock:
+            ancestors = []
+            dir = self
+            while (dir is not None):
+                ancestors.append(dir)
+                dir = dir.parent
+            # Top-down: materializing an ancestor's clone registers new clones
+            # on the next folder down the path
+            for dir in reversed(ancestors):
+                if (dir._clones):
+                    for clone in list(dir._clones):
+                        clone._materialize()
+
+    @property
+    def path(self) -> str:
+        if (self.is_root):
+            return "/"
+        generation = Directory.path_generation
+        memo = self._path_memo
+        if (memo is not None and memo[0] == generation):
+            return memo[1]
+        # Climb until the root or a folder with a valid memo
+        chain = []
+        dir = self
+        path = ""
+        while (not dir.is_root):
+            memo = dir._path_memo
+            if (memo is not None and memo[0] == generation):
+                path = memo[1]
+                break
+            chain.append(dir)
+            dir = dir.parent
+        # Rebuild top-down, memoizing each folder on the way
+        for dir in reversed(chain):
+            # Prevent double //
+            path = path + "/" + dir.name
+            if (Directory.memoize_paths):
+                dir._path_memo = (generation, path)
+        return path
+
+    def get_path(self) -> str:
+        return self.path
+
+    # tuple(bytes, files, folders) under this folder, see _grow
+    # bytes: length of the files' contents (chars for text files, like
+    #   content_usage), each file counted even when copies share contents
+    # O(1): the totals are kept up to date, nothing is walked
+    @property
+    def usage(self) -> tuple[int, int, int]:
+        with _usage_lock:
+            return (self._bytes, self._file_count, self._dir_count)
+
+    # tuple(max bytes, max inodes) under this folder, None if no quota
+    @property
+    def quota(self) -> tuple[int, int] | None:
+        return self._quota
+
+    # Cap the bytes and/or inodes (files + folders) under this folder
+    # None: no cap; both None removes the quota
+    # Growth past a cap is refused from then on; what's already there stays,
+    # even if over it
+    def set_quota(self, max_bytes: int = None, max_inodes: int = None) -> None:
+        with _usage_lock:
+            if (max_bytes is None and max_inodes is None):
+                self._quota = None
+                return
+            self._quota = (max_bytes, max_inodes)
+            Directory.quotas_set = True
+
+    # The folder this one is linked under, None for a root or a folder that
+    # was unlinked (removed, or detached while being moved) since
+    def _linked_parent(self) -> Directory:
+        parent = self.parent
+        if (parent is None or parent._subfolders is None or
+                parent._subfolders.get(self.name) is not self):
+            return None
+        return parent
+
+    # Would adding bytes & inodes go past this folder's quota
+    def _over_quota(self, bytes: int, inodes: int) -> bool:
+        max_bytes, max_inodes = self._quota
+        return ((bytes > 0 and max_bytes is not None and self._bytes + bytes > max_bytes) or
+                (inodes > 0 and max_inodes is not None and
+                 self._file_count + self._dir_count + inodes > max_inodes))
+
+    # Add to the totals of this folder & every folder it's linked under
+    # O(depth). Growth past a quota on the way is refused (returns False,
+    # nothing added) unless check is False; shrinking always succeeds
+    # Precondition: _usage_lock is held, and the change it accounts for is
+    # made before releasing it
+    def _grow(self, bytes: int, files: int, dirs: int, check: bool = True) -> bool:
+        if (check and Directory.quotas_set and (bytes > 0 or files + dirs > 0)):
+            dir = self
+            while (dir is not None):
+                if (dir._quota is not None and dir._over_quota(bytes, files + dirs)):
+                    return False
+                dir = dir._linked_parent()
+        # _linked_parent, inlined: this runs on every create/remove/write
+        dir = self
+        while True:
+            dir._bytes += bytes
+            dir._file_count += files
+            dir._dir_count += dirs
+            parent = dir.parent
+            if (parent is None):
+                return True
+            subfolders = parent._subfolders
+            if (subfolders is None or subfolders.get(dir.name) is not dir):
+                return True
+            dir = parent
 
     # Create a sub directory under this directory
+    # Returns None if that's past a quota
     def new_subfolder(self, new_name: str) -> Directory:
+        self._before_write()
+        subfolders = self._subfolder_map()
         d = Directory(new_name, self)
-        self.subfolders[new_name] = d
+        with _usage_lock:
+            if (not self._grow(0, 0, 1)):
+                return None
+            subfolders[d.name] = d
+        if (self.index is not None):
+            self.index.link(d)
         return d
 
+    # Create the chain of folders names[0]/names[1]/... under this directory
+    # (none of them existing yet) and return the last one
+    # Same as new_subfolder one name at a time, but the totals are updated
+    # once for the whole chain, so mkdir -p of a deep path stays O(depth)
+    # Returns None, creating nothing, if the chain is past a quota
+    def new_subfolders(self, names: list[str]) -> Directory:
+        self._before_write()
+        subfolders = self._subfolder_map()
+        chain = [Directory(names[0], self)]
+        for name in names[1:]:
+            d = Directory(name, chain[-1])
+            chain[-1]._subfolders = {d.name: d}
+            chain.append(d)
+        # Not linked yet, no other thread sees them
+        for i, d in enumerate(chain):
+            d._dir_count = len(chain) - 1 - i
+        with _usage_lock:
+            if (not self._grow(0, 0, len(chain))):
+                return None
+            subfolders[chain[0].name] = chain[0]
+        if (self.index is not None):
+            for d in chain:
+                self.index.link(d)
+        return chain[-1]
+
     # Create new file under this directory
-    def new_file(self, file_name: str) -> File:
-        f = File(file_name, self)
-        self.files[file_name] = f
+    # A file already linked under the same name is replaced
+    # store: content engine for the new file (defaults to a rope,
+    #   BytesStore for a binary file)
+    # buffer: existing ContentBuffer to share instead of a new store
+    # Returns None if that's past a quota
+    def new_file(self, file_name: str, store: ContentStore = None, buffer: ContentBuffer = None) -> File:
+        self._before_write()
+        files = self._file_map()
+        f = File(file_name, self, store, buffer)
+        with _usage_lock:
+            replaced = files.get(f.name)
+            if (not self._grow_by_file(f, replaced)):
+                return None
+            files[f.name] = f
+        if (self.index is not None):
+            if (replaced is not None):
+                self.index.remove(replaced)
+            self.index.link(f)
         return f
 
+    # _grow by file replacing replaced (None if not replacing any)
+    def _grow_by_file(self, file: File, replaced: File, check: bool = True) -> bool:
+        if (replaced is None):
+            return self._grow(len(file.store), 1, 0, check)
+        if (replaced is file):
+            return True
+        return self._grow(len(file.store) - len(replaced.store), 0, 0, check)
+
     # Given an existing file, link it to this directory
-    def add_existing_file(self, file: File):
+    # A file already linked under the same name is replaced
+    # Returns False (not linked) if that's past a quota, unless check is False
+    def add_existing_file(self, file: File, check: bool = True) -> bool:
         if (file is None):
-            return
-        self.files[file.name] = file
-        file.parent = self
+            return False
+        self._before_write()
+        files = self._file_map()
+        with _usage_lock:
+            replaced = files.get(file.name)
+            if (not self._grow_by_file(file, replaced, check)):
+                return False
+            files[file.name] = file
+            file.parent = self
+        if (self.index is not None):
+            if (replaced is not None and replaced is not file):
+                self.index.remove(replaced)
+            self.index.link(file)
+        return True
+
+    # Link an existing folder (and everything under it) under this dir as new_name
+    # A folder already linked under that name is replaced
+    # O(1): descendants derive their path from parent links, and the
+    # folder's totals move along with it
+    # Returns False (not linked) if that's past a quota, unless check is False
+    def add_existing_subfolder(self, dir: Directory, new_name: str, check: bool = True) -> bool:
+        self._before_write()
+        subfolders = self._subfolder_map()
+        new_name = sys.intern(new_name)
+        # A folder coming from another tree (or a removed one) is reindexed whole
+        index = dir.index
+        reindex = (index is not self.index)
+        if (index is not None):
+            if (reindex):
+                index.remove_subtree(dir)
+            else:
+                index.remove(dir)
+        with _usage_lock:
+            replaced = subfolders.get(new_name)
+            if (replaced is dir):
+                replaced = None
+            bytes, files, dirs = dir._bytes, dir._file_count, dir._dir_count + 1
+            if (replaced is not None):
+                bytes -= replaced._bytes
+                files -= replaced._file_count
+                dirs -= replaced._dir_count + 1
+            linked = self._grow(bytes, files, dirs, check)
+            if (linked):
+                dir.name = new_name
+                dir.parent = self
+                subfolders[new_name] = dir
+        if (not linked):
+            if (index is not None):
+                if (reindex):
+                    index.add_subtree(dir)
+                else:
+                    index.add(dir)
+            return False
+        if (replaced is not None and self.index is not None):
+            self.index.remove_subtree(replaced)
+        if (self.index is not None):
+            if (reindex):
+                self.index.add_subtree(dir)
+            else:
+                self.index.add(dir)
+        Directory.path_generation += 1
+        return True
+
+    # Unlink a subfolder without forgetting its subtree, so it can be
+    # relinked elsewhere with add_existing_subfolder
+    # NOOp if doesn't exist.
+    def detach_subfolder(self, subfolder_name: str) -> Directory:
+        self._before_write()
+        return self._unlink_subfolder(subfolder_name)
+
+    def _unlink_subfolder(self, subfolder_name: str) -> Directory:
+        subfolders = self._subfolder_map()
+        with _usage_lock:
+            d = subfolders.pop(subfolder_name, None)
+            if (d is not None):
+                self._grow(-d._bytes, -d._file_count, -d._dir_count - 1)
+        return d
 
     def get_file(self, file_name: str) -> File:
         if file_name in self.files.keys():
@@ -49,11 +447,58 @@ class Directory:
 
     # Removes subfolder, NOOp if doesn't exist.
     def remove_subfolder(self, subfolder_name):
-        return self.subfolders.pop(subfolder_name, None)
+        self._before_write()
+        d = self._unlink_subfolder(subfolder_name)
+        if (d is not None and self.index is not None):
+            self.index.remove_subtree(d)
+        return d
 
     # Removes file, NOOp if doesn't exist.
     def remove_file(self, file_name: str) -> File:
-        return self.files.pop(file_name, None)
+        self._before_write()
+        files = self._file_map()
+        with _usage_lock:
+            f = files.pop(file_name, None)
+            if (f is not None):
+                self._grow(-len(f.store), -1, 0)
+        if (f is not None and self.index is not None):
+            self.index.remove(f)
+        return f
+
+    # Lazily walk every folder & file under this dir (not including this dir)
+    # Iterative, so deep trees don't hit the recursion limit
+    # Yields tuple(path, node) where node is a File or Directory
+    # order "pre": a folder is yielded before its contents (files first, then subfolders)
+    # order "post": a folder is yielded after its contents
+    # prune(path, folder) -> True skips descending into that folder
+    #   (the folder itself is still yielded)
+    # Don't add/remove children while walking; siblings are snapshotted per folder
+    def walk(self, order: str = "pre", prune: function = None):
+        post = (order == "post")
+        prefix = "" if self.is_root else self.path
+        for file in tuple(self.files.values()):
+            yield prefix + "/" + file.name, file
+        # Each frame: (folder, folder path, iterator over its subfolders)
+        stack = [(self, prefix, iter(tuple(self.subfolders.values())))]
+        while stack:
+            dir, dir_path, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                if post and stack:
+                    yield dir_path, dir
+                continue
+            child_path = dir_path + "/" + child.name
+            if not post:
+                yield child_path, child
+            if prune is not None and prune(child_path, child):
+                if post:
+                    yield child_path, child
+                continue
+            for file in tuple(child.files.values()):
+                yield child_path + "/" + file.name, file
+            stack.append(
+                (child, child_path, iter(tuple(child.subfolders.values()))))
 
     # Starting from this dir, invoke an arbitrary func on every folder & file
     # + recursively on every subfolder
@@ -69,64 +514,161 @@ class Directory:
     def recurse_with_func(self, func: function, args: list) -> tuple[dict, dict]:
         output_files = {}
         output_folders = {}
-        for file in self.files.values():
-            output_files[file.get_path()] = func(file, *args)
-        for dir in self.subfolders.values():
-            output_folders[dir.path] = func(dir, *args)
-            recurse_output_files, recurse_output_folders = dir.recurse_with_func(
-                func, args)
-            # merge dicts; no worries about key conflict due to unique pathes as keys
-            output_files = {**output_files, **recurse_output_files}
-            output_folders = {**output_folders, **recurse_output_folders}
+        for path, node in self.walk():
+            if isinstance(node, File):
+                output_files[path] = func(node, *args)
+            else:
+                output_folders[path] = func(node, *args)
         return (output_files, output_folders)
 
 
 class File:
-    def __init__(self, name: str, parent: Directory):
-        self.name = name
-        self.contents = ""
+    __slots__ = ("name", "buffer", "parent", "_lock", "read_handlers", "write_handler", "__weakref__")
+
+    # store: content engine for a new file (defaults to a rope)
+    # buffer: existing ContentBuffer to share instead (see copy)
+    def __init__(self, name: str, parent: Directory, store: ContentStore = None, buffer: ContentBuffer = None):
+        self.name = sys.intern(name)
+        # Contents live in a pluggable store, see contents.py
+        # The store sits in a refcounted buffer so copies can share it
+        if (buffer is None):
+            buffer = ContentBuffer(store if store is not None else RopeStore())
+        self.buffer = buffer
         self.parent = parent
-        # TODO implement read/write lock logic
-        # Supports multiple open reads
-        self.read_handlers = set()
+        # Reader-writer lock, created on first use (see lock)
+        self._lock = None
+        # Supports multiple open reads; created with the lock, as only
+        # handlers holding it touch the set
+        self.read_handlers = None
         # Supports only 1 open write
         self.write_handler = None
 
+    def __del__(self):
+        buffer = getattr(self, "buffer", None)
+        if (buffer is not None):
+            buffer.release()
+
+    # Many readers or one writer, held by open handlers
+    # Most files never get a handler, so the lock (and read_handlers) is
+    # only allocated on demand
+    @property
+    def lock(self) -> RWLock:
+        if (self._lock is None):
+            with _file_lock_init:
+                if (self._lock is None):
+                    self.read_handlers = set()
+                    self._lock = RWLock()
+        return self._lock
+
+    # Store for reading; may be shared with other files, don't modify it
+    @property
+    def store(self) -> ContentStore:
+        return self.buffer.store
+
+    # Store for modifying this file
+    # If the buffer is shared, this file first gets a private copy
+    # A blob no one else references stops being one: its hash won't hold
+    def writable_store(self) -> ContentStore:
+        self.parent._before_write()
+        buffer = self.buffer
+        if (buffer.is_shared or buffer.blob is not None):
+            # Another thread may be sharing/privatizing the same buffer
+            with _cow_lock:
+                buffer = self.buffer
+                if (buffer.blob is not None and not buffer.is_shared):
+                    # From here on no other file can find & share it
+                    blobs, key = buffer.blob
+                    blobs.discard(key, buffer)
+                if (buffer.is_shared):
+                    buffer.release()
+                    self.buffer = ContentBuffer(buffer.store.copy())
+        return self.buffer.store
+
+    # Binary files hold bytes, text files hold str
+    @property
+    def is_binary(self) -> bool:
+        return self.store.is_binary
+
+    # Whole contents as a str (bytes for a binary file)
+    @property
+    def contents(self) -> str | bytes:
+        return self.store.get()
+
+    # Past a quota, the contents are left as they were (see edit)
+    @contents.setter
+    def contents(self, text: str | bytes) -> None:
+        if (not self.edit(lambda store: store.set(text), len(text), True)):
+            fail(ErrorCode.QUOTA_EXCEEDED)
+
+    # Modify the contents with edit(store), which adds added chars/bytes to
+    # them (replacing them if replace), and add that to the totals of the
+    # folders the file is in (see Directory.usage)
+    # Edited under the usage lock, so a file being linked/unlinked meanwhile
+    # is accounted with the length it really has then
+    # Returns False, leaving the contents as they were, if the growth is
+    # past a quota
+    def edit(self, edit: function, added: int, replace: bool = False) -> bool:
+        store = self.writable_store()
+        with _usage_lock:
+            delta = added - len(store) if replace else added
+            parent = self.parent
+            files = parent._files
+            if (delta != 0 and files is not None and files.get(self.name) is self and
+                    not parent._grow(delta, 0, 0)):
+                return False
+            edit(store)
+        return True
+
     def get_path(self) -> str:
         if self.parent.is_root:
             return "/"+self.name
         else:
             return self.parent.path + "/" + self.name
 
+    # Copy-on-write copy; shares contents until either file is written
     def copy(self) -> File:
-        f = File(self.name, self.parent)
-        f.contents = self.contents
-        return f
+        return File(self.name, self.parent, buffer=self.buffer.share())
 
-    # Deep copy this file in the same dir with new_name
-    # returns the new file
+    # Copy this file in the same dir with new_name (copy-on-write)
+    # returns the new file, None if that's past a quota
     def copy_in_place(self, new_name: str) -> File:
         if (new_name == self.name):
             raise Exception("Can't copy file with same name")
         else:
-            f = File(new_name, self.parent)
-            self.parent.add_existing_file(f)
-            f.contents = self.contents
+            f = File(new_name, self.parent, buffer=self.buffer.share())
+            if (not self.parent.add_existing_file(f)):
+                return None
             return f
 
 # Allows reading and writing of file in chunks
 class FileHandler:
+    __slots__ = ("file", "cursor", "is_open", "_owner", "tier", "raise_errors")
+
     def __init__(self, file: File):
         self.file = file
         self.cursor = 0  # Used to maintain current position
         self.is_open = False
+        # Lock owner the handler was opened by, see RWLock
+        self._owner = None
+        # ColdTier told of every open (see compression.py), set by the
+        # Filesystem that handed out the handler
+        self.tier = None
+        # Raise failures instead of returning them, like the Filesystem that
+        # handed out the handler (see Filesystem raise_errors)
+        self.raise_errors = False
+
+    # Record a failure and return result, or raise it (see Filesystem._fail)
+    def _fail(self, code: ErrorCode, result=None):
+        fail(code, result)
+        if (self.raise_errors):
+            raise last_error()
+        return result
 
     # Moves the cursor to absolute index
     # Returns T/F for success/fail
     def move_cursor_abs(self, i: int) -> bool:
-        if (i < 0 or i > len(self.file.contents)):
-            print("Cursor value out of bounds")
-            return False
+        if (i < 0 or i > len(self.file.store)):
+            return self._fail(ErrorCode.CURSOR_OUT_OF_BOUNDS, False)
         self.cursor = i
         return True
 
@@ -135,28 +677,41 @@ class FileHandler:
     # Returns T/F for success/fail
     def move_cursor_rel(self, i: int) -> bool:
         new_pos = self.cursor + i
-        if (new_pos < 0 or new_pos >= len(self.file.contents)):
-            print("Cursor value out of bounds")
-            return False
+        if (new_pos < 0 or new_pos >= len(self.file.store)):
+            return self._fail(ErrorCode.CURSOR_OUT_OF_BOUNDS, False)
         self.cursor = new_pos
         return True
 
+    # Moves the cursor to the start of line n (0 based)
+    # Returns T/F for success/fail
+    def seek_line(self, n: int) -> bool:
+        if (n < 0 or (n != 0 and n >= self.file.store.line_count())):
+            return self._fail(ErrorCode.LINE_OUT_OF_BOUNDS, False)
+        self.cursor = self.file.store.line_start(n)
+        return True
+
+    # Number of lines in the file
+    def line_count(self) -> int:
+        return self.file.store.line_count()
+
     # If i is out of bounds, round i to 0 or EoF
     def _round_index(self, i: int) -> int:
-        if i > len(self.file.contents):
-            i = len(self.file.contents)
+        if i > len(self.file.store):
+            i = len(self.file.store)
         if i < 0:
             i = 0
         return i
 
 
 class ReadHandler(FileHandler):
+    __slots__ = ()
+
     # Read next i chars
     def read_next(self, i: int) -> str:
         if not self.is_open:
             raise Exception("Cannot read from unopened handler")
         new_index = self._round_index(self.cursor+i)
-        output = self.file.contents[self.cursor:new_index]
+        output = self.file.store.get(self.cursor, new_index)
         self.cursor = new_index
         return output
 
@@ -164,79 +719,198 @@ class ReadHandler(FileHandler):
     def read_to_end(self) -> str:
         if not self.is_open:
             raise Exception("Cannot read from unopened handler")
-        output = self.file.contents[self.cursor:]
-        self.cursor = len(self.file.contents)
+        output = self.file.store.get(self.cursor)
+        self.cursor = len(self.file.store)
         return output
 
-    # Stream output until the next newline starting from cursor
+    # Read until the next newline (inclusive) starting from cursor
     def read_line(self) -> str:
         if not self.is_open:
             raise Exception("Cannot read from unopened handler")
-        output = ""
-        for i in range(self.cursor, len(self.file.contents)):
-            c = self.file.contents[self.cursor]
-            output += c
-            self.cursor = self._round_index(self.cursor + 1)
-            if (c == "\n"):
-                break
+        store = self.file.store
+        if self.cursor >= len(store):
+            return ""
+        newline = store.find_newline(self.cursor)
+        end = len(store) if newline == -1 else newline + 1
+        output = store.get(self.cursor, end)
+        self.cursor = end
         return output
 
     # Outputs all file contents, doesn't move cursor
     def read(self) -> str:
         if not self.is_open:
             raise Exception("Cannot read from unopened handler")
-        return self.file.contents
+        return self.file.store.get()
+
+    # Copy the next bytes into buffer (e.g. a preallocated bytearray) until
+    # it's full or EoF, with no intermediate bytes object; binary files only
+    # Returns the number of bytes copied, 0 at EoF
+    def readinto(self, buffer) -> int:
+        store = self._binary_store()
+        target = memoryview(buffer).cast("B")
+        end = self._round_index(self.cursor + len(target))
+        n = end - self.cursor
+        target[:n] = store.view(self.cursor, end)
+        self.cursor = end
+        return n
+
+    # Zero-copy memoryview of the next n bytes (to EoF if n is None);
+    # binary files only
+    # The view keeps showing the contents as they were when it was taken,
+    # even after the file is written
+    def read_view(self, n: int = None) -> memoryview:
+        store = self._binary_store()
+        end = len(store) if n is None else self._round_index(self.cursor + n)
+        output = store.view(self.cursor, end)
+        self.cursor = end
+        return output
 
-    # Opening a read handler is always successful
-    def open(self) -> bool:
+    def _binary_store(self) -> ContentStore:
+        if not self.is_open:
+            raise Exception("Cannot read from unopened handler")
+        store = self.file.store
+        if not store.is_binary:
+            raise TypeError("Not a binary file")
+        return store
+
+    # Open the handler, taking the file's lock for reading
+    # Any number of read handlers can be open at once; while another thread
+    # has a write handler open, waits for it to close
+    # blocking=False fails right away, timeout (seconds) bounds the wait
+    # The thread holding the write handler can always open read handlers
+    # owner: who holds the lock, defaults to the calling thread
+    #   (e.g. AsyncFilesystem passes the asyncio task)
+    # Returns T/F on success/fail
+    def open(self, blocking: bool = True, timeout: float = None, owner=None) -> bool:
+        if (self.is_open):
+            self.cursor = 0
+            return True
+        if (owner is None):
+            owner = threading.get_ident()
+        if (not self.file.lock.acquire_read(blocking, timeout, owner)):
+            return False
+        self._owner = owner
         self.file.read_handlers.add(self)
         self.is_open = True
         self.cursor = 0
+        if (self.tier is not None):
+            self.tier.on_open(self.file)
         return True
 
-    # Close the handler
+    # Close the handler, can be called from any thread
     def close(self) -> None:
-        self.file.read_handlers.remove(self)
+        if (not self.is_open):
+            return
         self.is_open = False
+        self.file.read_handlers.discard(self)
+        self.file.lock.release_read(self._owner)
 
 
 class WriteHandler(FileHandler):
+    __slots__ = ("journal", "blobs")
+
+    def __init__(self, file: File):
+        super().__init__(file)
+        # Journal every edit is logged to (see journal.py), set by the
+        # Filesystem that handed out the handler
+        self.journal = None
+        # BlobStore the file's contents are deduplicated into on close
+        # (see dedup.py), set by the Filesystem that handed out the handler
+        self.blobs = None
+
     # Overwrites file contents
-    def write(self, contents: str) -> None:
+    # Returns T/F for success/fail (fail if past a quota, see Directory.set_quota)
+    def write(self, contents: str) -> bool:
         if not self.is_open:
             raise Exception("Cannot write with unopened handler")
-        self.file.contents = contents
-        self.cursor = len(self.file.contents)
+        if not self._edit("fh_write", lambda store: store.set(contents), True, contents):
+            return False
+        self.cursor = len(self.file.store)
+        return True
 
     # Appends file contents to end
-    def concat(self, contents: str) -> None:
+    # Returns T/F for success/fail (fail if past a quota)
+    def concat(self, contents: str) -> bool:
         if not self.is_open:
             raise Exception("Cannot write with unopened handler")
-        self.file.contents += contents
-        self.cursor = len(self.file.contents)
+        if not self._edit("fh_concat", lambda store: store.concat(contents), False, contents):
+            return False
+        self.cursor = len(self.file.store)
+        return True
 
     # Inserts contents at current cursor
     # Cursor now points to cursor + len(contents)
-    def insert(self, contents: str) -> None:
+    # Returns T/F for success/fail (fail if past a quota)
+    def insert(self, contents: str) -> bool:
         if not self.is_open:
             raise Exception("Cannot write with unopened handler")
-        c = self.file.contents
-        self.file.contents = c[0:self.cursor] + contents + c[self.cursor:]
-        self.cursor = self.cursor + len(contents)
+        cursor = self.cursor
+        if not self._edit("fh_insert", lambda store: store.insert(cursor, contents),
+                          False, cursor, contents):
+            return False
+        self.cursor = cursor + len(contents)
+        return True
 
-    # Open the write handler
-    # Returns false if an open one already exists
+    # Binary files take bytes-like contents, text files take str
+    def accepts(self, contents) -> bool:
+        if (self.file.store.is_binary):
+            return isinstance(contents, (bytes, bytearray, memoryview))
+        return isinstance(contents, str)
+
+    # Apply edit(store) to the file, and log it to the journal as op(path, *args)
+    # args end with the contents being written, which replace the file's
+    # contents if replace, else are added to them (see File.edit)
+    # Returns False, with nothing applied or logged, if past a quota
+    def _edit(self, op: str, edit: function, replace: bool, *args) -> bool:
+        contents = args[-1]
+        if not self.accepts(contents):
+            raise TypeError("Binary files take bytes, text files take str")
+        journal = self.journal
+        if (journal is None):
+            if (not self.file.edit(edit, len(contents), replace)):
+                return self._fail(ErrorCode.QUOTA_EXCEEDED, False)
+            return True
+        with journal.lock:
+            if (not self.file.edit(edit, len(contents), replace)):
+                return self._fail(ErrorCode.QUOTA_EXCEEDED, False)
+            seq = journal.log(op, (self.file.get_path(),) + args)
+        journal.wait(seq)
+        return True
 
-    def open(self) -> bool:
-        if (self.file.write_handler is None):
-            self.file.write_handler = self
-            self.is_open = True
+    # Open the handler, taking the file's lock for writing
+    # Only 1 write handler can be open at once, and no read handlers from
+    # other threads; waits for them to close
+    # blocking=False fails right away, timeout (seconds) bounds the wait
+    # Returns false right away if this thread already has one open,
+    # waiting on itself would never end
+    # owner: who holds the lock, defaults to the calling thread
+    # Returns T/F on success/fail
+    def open(self, blocking: bool = True, timeout: float = None, owner=None) -> bool:
+        if (self.is_open):
             self.cursor = 0
             return True
-        else:
+        lock = self.file.lock
+        if (owner is None):
+            owner = threading.get_ident()
+        if (lock.is_writer(owner)):
             return False
+        if (not lock.acquire_write(blocking, timeout, owner)):
+            return False
+        self._owner = owner
+        self.file.write_handler = self
+        self.is_open = True
+        self.cursor = 0
+        if (self.tier is not None):
+            self.tier.on_open(self.file)
+        return True
 
-    # Close the handler
+    # Close the handler, can be called from any thread
+    # Deduplicates what was written, while still holding the lock
     def close(self) -> None:
-        self.file.write_handler = None
+        if (not self.is_open):
+            return
+        if (self.blobs is not None and self.file.buffer.blob is None):
+            self.blobs.intern(self.file)
         self.is_open = False
+        self.file.write_handler = None
+        self.file.lock.release_write(self._owner)
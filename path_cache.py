@@ -0,0 +1,115 @@
+from __future__ import annotations
+import threading
+from collections import OrderedDict
+
+
+# Bounded LRU cache of resolved directory paths (a dentry cache)
+#   normalized absolute path -> Directory   (positive entry)
+#   normalized absolute path -> None        (negative entry, path doesn't exist)
+#
+# Invalidation is O(1):
+#   - creating a directory drops every negative entry
+#   - removing/moving a directory bumps an epoch; positive entries from an
+#     older epoch are re-checked against the tree on their next hit
+# Thread safe
+class PathCache:
+    def __init__(self, capacity: int = 4096, negative_capacity: int = 1024):
+        self.capacity = capacity
+        self.negative_capacity = negative_capacity
+        # path -> tuple(Directory, epoch)
+        self._positive = OrderedDict()
+        self._negative = OrderedDict()
+        self._epoch = 0
+        # Bumped by on_dir_created
+        self._creations = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    # Return tuple(found, Directory)
+    # found=True with Directory=None is a cached "doesn't exist"
+    def lookup(self, path: str) -> tuple[bool, Directory]:
+        with self._lock:
+            entry = self._positive.get(path)
+            if entry is not None:
+                dir, epoch = entry
+                if epoch == self._epoch or _is_linked_at(dir, path):
+                    if epoch != self._epoch:
+                        self._positive[path] = (dir, self._epoch)
+                    self._positive.move_to_end(path)
+                    self.hits += 1
+                    return True, dir
+                del self._positive[path]
+            elif path in self._negative:
+                self._negative.move_to_end(path)
+                self.hits += 1
+                return True, None
+            self.misses += 1
+            return False, None
+
+    # Opaque token to take before walking the tree, passed back to store
+    # So a directory created/removed by another thread during the walk
+    # can't leave a stale result in the cache
+    def version(self) -> tuple[int, int]:
+        return (self._epoch, self._creations)
+
+    # Cache the result of a walk; dir=None caches a missing path
+    # version: from version() before the walk, defaults to now
+    def store(self, path: str, dir: Directory, version: tuple[int, int] = None) -> None:
+        if dir is None:
+            entries, capacity = self._negative, self.negative_capacity
+        else:
+            entries, capacity = self._positive, self.capacity
+        if capacity <= 0:
+            return
+        with self._lock:
+            epoch, creations = version if version is not None else self.version()
+            if dir is None:
+                # A directory was created since, the miss may be wrong
+                if creations != self._creations:
+                    return
+                value = None
+            else:
+                # Stamped with the old epoch, re-checked on the next hit
+                value = (dir, epoch)
+            entries[path] = value
+            entries.move_to_end(path)
+            if len(entries) > capacity:
+                entries.popitem(last=False)
+
+    # A directory was created, cached misses may now exist
+    def on_dir_created(self) -> None:
+        with self._lock:
+            self._creations += 1
+            if self._negative:
+                self._negative.clear()
+
+    # A directory was removed or moved, cached hits may now be stale
+    def on_dir_removed(self) -> None:
+        with self._lock:
+            self._epoch += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._positive.clear()
+            self._negative.clear()
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._positive),
+            "negative_entries": len(self._negative),
+        }
+
+
+# Is dir still linked into a tree at exactly this absolute path
+def _is_linked_at(dir: Directory, path: str) -> bool:
+    names = []
+    while not dir.is_root:
+        parent = dir.parent
+        if parent is None or parent.subfolders.get(dir.name) is not dir:
+            return False
+        names.append(dir.name)
+        dir = parent
+    return "/" + "/".join(reversed(names)) == path
@@ -1,11 +1,65 @@
+from __future__ import annotations
+import argparse
+import math
+import os
+import sys
+import time
 from objects import *
 from filesystem import *
+from errors import ErrorCode, last_error, clear_error
 
 
 # Cmdline Simulator
 class Simulator:
-    def __init__(self):
+    # metrics: record per-operation metrics from the start, otherwise
+    #   they're only turned on by the first stats command
+    def __init__(self, metrics: bool = False):
         self.filesystem = Filesystem()
+        if (metrics):
+            self.filesystem.enable_metrics()
+        # Line iterator while running a script, see run_script
+        self._script = None
+        # command name -> list of latencies (seconds) while running a script
+        self.latencies = None
+        # command name -> method(text) running it
+        self.commands = {
+            "help": self.cmd_help,
+            "mkdir": self.cmd_mkdir,
+            "mkfile": self.cmd_mkfile,
+            "ls": self.cmd_ls,
+            "cd": self.cmd_cd,
+            "pwd": self.cmd_pwd,
+            "rmdir": self.cmd_rmdir,
+            "rmfile": self.cmd_rmfile,
+            "find": self.cmd_find,
+            "read": self.cmd_read,
+            "editmode": self.cmd_editmode,
+            "mvfile": self.cmd_mvfile,
+            "cpfile": self.cmd_cpfile,
+            "mvdir": self.cmd_mvdir,
+            "cpdir": self.cmd_cpdir,
+            "write": self.cmd_write,
+            "stats": self.cmd_stats,
+            "import": self.cmd_import,
+            "export": self.cmd_export,
+            "dedup": self.cmd_dedup,
+            "compress": self.cmd_compress,
+            "du": self.cmd_du,
+            "stat": self.cmd_stat,
+            "quota": self.cmd_quota,
+        }
+        # edit mode command name -> method(text, rh, wh) running it
+        self.edit_commands = {
+            "read_line": self.edit_read_line,
+            "read_to_end": self.edit_read_to_end,
+            "read_next": self.edit_read_next,
+            "move_abs": self.edit_move_abs,
+            "move_rel": self.edit_move_rel,
+            "seek_line": self.edit_seek_line,
+            "line_count": self.edit_line_count,
+            "insert": self.edit_insert,
+            "print_cursor": self.edit_print_cursor,
+        }
 
     def print_help(self):
         help_text = """
@@ -21,6 +75,9 @@ class Simulator:
                   [-b]         On file name conflict, a backup of the conflicting file is created with ~<filename>
                   [-n]         On file name conflict, operation fails 
                   [-p]         Creates missing parent directories along the Dest path
+        mvdir/cpdir [op] <source> <dest>
+                            Moves/Copies source dir (and everything under it) as dest
+                            Same options as mvfile/cpfile; copies are copy-on-write
         pwd                 get current working directory path
         ls                  list current directory's subdirectories & files
         cd <path>           switch directory (absolute or relative path)
@@ -37,148 +94,331 @@ class Simulator:
         write [op] <file_path> contents
               [-c]           concats contents to file (no new line)
               [-a]           appends contents to file with new line
+        stats [reset]       per-operation calls, errors, bytes & latencies so far
+                            (the first stats turns metrics on, or start with --metrics)
+        import <host_path> [dest]
+                            import a host directory tree or tar archive under dest (default /)
+        export <path> <host_file>
+                            write the folder at path to a host archive; .zip for zip,
+                            .tar.gz/.tgz for gzipped tar, else tar
+        dedup [path]        share one copy of equal file contents under path (default /),
+                            and from then on; prints the dedup stats
+        compress [path]     compress file contents under path (default /) now, and cold
+                            ones (unopened for 1000 opens) from then on; prints
+                            resident vs logical size
+        du [path]           bytes, files & dirs under path (default /) and each of its subdirectories
+        stat <path>         size & type of a file, or totals & quota of a directory (<path>/)
+        quota <dir> [max_bytes] [max_inodes]
+                            cap the bytes and/or files + dirs under dir, - for no cap;
+                            no caps removes the quota
         
         ***Extra Modes***
         editmode <file>      open read/write mode
         """
         print(help_text)
 
+    # Run one command line
     def parse_output(self, text):
         text = text.split(" ")
-        if (text[0] == "help"):
-            self.print_help()
-        elif (text[0] == "mkdir"):
-            if (len(text) == 3):
-                self.filesystem.mkdir(text[2], text[1])
-            elif (len(text) == 2):
-                self.filesystem.mkdir(text[1])
-            else:
-                print("Wrong number of arguments")
-        elif (text[0] == "mkfile"):
-            if (len(text) == 3):
-                self.filesystem.mkfile(text[2], text[1])
-            elif (len(text) == 2):
-                self.filesystem.mkfile(text[1])
-            else:
-                print("Wrong number of arguments")
-        elif (text[0] == "ls"):
-            if (len(text) > 1):
-                print("Wrong number of arguments")
-                return
-            print("***Folders***")
-            print(self.filesystem.list_folders())
-            print("\n")
-            print("***Files***")
-            print(self.filesystem.list_files())
-        elif (text[0] == "cd"):
-            if (len(text) == 2):
-                self.filesystem.changedir(text[1])
-            else:
-                print("Wrong number of arguments")
-        elif (text[0] == "pwd"):
-            print(self.filesystem.get_current_path())
-        elif (text[0] == "rmdir"):
-            if (len(text) == 2):
-                self.filesystem.remove_dir(text[1])
-            else:
-                print("Wrong number of arguments")
-        elif (text[0] == "rmfile"):
-            if (len(text) == 2):
-                self.filesystem.remove_file(text[1])
-            else:
-                print("Wrong number of arguments")
-        elif (text[0] == "find"):
-            if len(text) == 3:
-                files, folders = self.filesystem.find_with_regex(
-                    text[1], text[2])
-            elif len(text) == 4 and (text[1] == "-r"):
-                files, folders = self.filesystem.find_with_regex(
-                    text[2], text[3], "-r")
-            else:
-                print("Invalid find command")
-                return
-            print("**Matching File")
-            print(files)
-            print("**Matching Folders")
-            print(folders)
-        elif (text[0] == "read"):
-            if (len(text) == 2):
-                print(self.filesystem.read_file(text[1]))
-            else:
-                print("Wrong number of arguments")
-        elif (text[0] == "editmode"):
-            if (len(text) == 2):
-                self.enter_edit_mode(text[1])
-            else:
-                print("Wrong number of arguments")
-        elif (text[0] == "mvfile"):
-            if (len(text) == 4):
-                self.filesystem.move_file(text[2], text[3], text[1])
-            elif (len(text) == 3):
-                self.filesystem.move_file(text[1], text[2])
-            else:
-                print("Wrong number of arguments")
-        elif (text[0] == "cpfile"):
-            if (len(text) == 4):
-                self.filesystem.copy_file(text[2], text[3], text[1])
-            elif (len(text) == 3):
-                self.filesystem.copy_file(text[1], text[2])
-            else:
-                print("Wrong number of arguments")
-        elif (text[0] == "write"):
-            if (text[1] == "-a" or text[1] == "-c"):
-                self.filesystem.write_file(
-                    text[2], ' '.join(text[3:]), text[1])
-            else:
-                self.filesystem.write_file(text[1], ' '.join(text[2:]))
-        else:
+        command = self.commands.get(text[0])
+        if (command is None):
             print("Invalid Command")
+            return
+        clear_error()
+        command(text)
+        self.print_error()
+
+    # Print why the last command failed, if it did (see errors.py)
+    # The Filesystem itself never prints
+    def print_error(self):
+        error = last_error()
+        if (error is not None):
+            print(error)
+            clear_error()
+
+    def cmd_help(self, text):
+        self.print_help()
+
+    def cmd_mkdir(self, text):
+        if (len(text) == 3):
+            self.filesystem.mkdir(text[2], text[1])
+        elif (len(text) == 2):
+            self.filesystem.mkdir(text[1])
+        else:
+            print("Wrong number of arguments")
+
+    def cmd_mkfile(self, text):
+        if (len(text) == 3):
+            self.filesystem.mkfile(text[2], text[1])
+        elif (len(text) == 2):
+            self.filesystem.mkfile(text[1])
+        else:
+            print("Wrong number of arguments")
+
+    def cmd_ls(self, text):
+        if (len(text) > 1):
+            print("Wrong number of arguments")
+            return
+        print("***Folders***")
+        print(self.filesystem.list_folders())
+        print("\n")
+        print("***Files***")
+        print(self.filesystem.list_files())
+
+    def cmd_cd(self, text):
+        if (len(text) == 2):
+            self.filesystem.changedir(text[1])
+        else:
+            print("Wrong number of arguments")
+
+    def cmd_pwd(self, text):
+        print(self.filesystem.get_current_path())
+
+    def cmd_rmdir(self, text):
+        if (len(text) == 2):
+            self.filesystem.remove_dir(text[1])
+        else:
+            print("Wrong number of arguments")
+
+    def cmd_rmfile(self, text):
+        if (len(text) == 2):
+            self.filesystem.remove_file(text[1])
+        else:
+            print("Wrong number of arguments")
+
+    def cmd_find(self, text):
+        if len(text) == 3:
+            matches = self.filesystem.find_with_regex(
+                text[1], text[2])
+        elif len(text) == 4 and (text[1] == "-r"):
+            matches = self.filesystem.find_with_regex(
+                text[2], text[3], "-r")
+        else:
+            print("Invalid find command")
+            return
+        if (matches is None):
+            return
+        files, folders = matches
+        print("**Matching File")
+        print(files)
+        print("**Matching Folders")
+        print(folders)
+
+    def cmd_read(self, text):
+        if (len(text) == 2):
+            contents = self.filesystem.read_file(text[1])
+            if (last_error() is None):
+                print(contents)
+        else:
+            print("Wrong number of arguments")
+
+    def cmd_editmode(self, text):
+        if (len(text) == 2):
+            self.enter_edit_mode(text[1])
+        else:
+            print("Wrong number of arguments")
+
+    # mvfile, cpfile, mvdir, cpdir: [op] <source> <dest>
+    def _move_or_copy(self, method, text):
+        if (len(text) == 4):
+            method(text[2], text[3], text[1])
+        elif (len(text) == 3):
+            method(text[1], text[2])
+        else:
+            print("Wrong number of arguments")
+
+    def cmd_mvfile(self, text):
+        self._move_or_copy(self.filesystem.move_file, text)
+
+    def cmd_cpfile(self, text):
+        self._move_or_copy(self.filesystem.copy_file, text)
+
+    def cmd_mvdir(self, text):
+        self._move_or_copy(self.filesystem.move_dir, text)
+
+    def cmd_cpdir(self, text):
+        self._move_or_copy(self.filesystem.copy_dir, text)
+
+    def cmd_write(self, text):
+        if (text[1] == "-a" or text[1] == "-c"):
+            self.filesystem.write_file(
+                text[2], ' '.join(text[3:]), text[1])
+        else:
+            self.filesystem.write_file(text[1], ' '.join(text[2:]))
+
+    def cmd_import(self, text):
+        if (len(text) not in (2, 3)):
+            print("Wrong number of arguments")
+            return
+        dest = text[2] if len(text) == 3 else "/"
+        if (os.path.isfile(text[1])):
+            with open(text[1], "rb") as f:
+                stats = self.filesystem.import_tar(f, dest)
+        else:
+            stats = self.filesystem.import_tree(text[1], dest)
+        if (stats is not None):
+            print("Imported %d files, %d dirs, %.1f MB in %.3fs (%.0f files/sec, %.1f MB/sec)" % (
+                stats["files"], stats["dirs"], stats["bytes"] / 1e6, stats["seconds"],
+                stats["files_per_sec"], stats["mb_per_sec"]))
+
+    def cmd_export(self, text):
+        if (len(text) != 3):
+            print("Wrong number of arguments")
+            return
+        host_file = text[2]
+        format = "zip" if host_file.endswith(".zip") else "tar"
+        compress = host_file.endswith((".tar.gz", ".tgz"))
+        try:
+            with open(host_file, "wb") as f:
+                stats = self.filesystem.export(text[1], f, format, compress)
+        except OSError:
+            print(ErrorCode.EXPORT_FAILED.value)
+            return
+        if (stats is None):
+            os.remove(host_file)
+            return
+        print("Exported %d files, %d dirs, %.1f MB in %.3fs (%.0f files/sec, %.1f MB/sec)" % (
+            stats["files"], stats["dirs"], stats["bytes"] / 1e6, stats["seconds"],
+            stats["files_per_sec"], stats["mb_per_sec"]))
+
+    def cmd_dedup(self, text):
+        stats = self.filesystem.deduplicate(text[1] if len(text) > 1 else "/")
+        if (stats is not None):
+            print("%d blobs for %d files: %d of %d bytes stored, %d saved (%.2fx)" % (
+                stats["blobs"], stats["refs"], stats["stored_bytes"], stats["logical_bytes"],
+                stats["saved_bytes"], stats["dedup_ratio"]))
+
+    def cmd_compress(self, text):
+        if (self.filesystem.cold is None):
+            self.filesystem.enable_compression(after_ops=1000)
+        path = text[1] if len(text) > 1 else "/"
+        compressed = self.filesystem.compress(path)
+        if (compressed is None):
+            return
+        stats = self.filesystem.compression_stats(path)
+        print("Compressed %d files: %d bytes resident of %d logical (%d cached)" % (
+            compressed, stats["resident_bytes"], stats["logical_bytes"], stats["cached_bytes"]))
 
+    def cmd_du(self, text):
+        if (len(text) > 2):
+            print("Wrong number of arguments")
+            return
+        path = text[1] if len(text) == 2 else "/"
+        usage = self.filesystem.du(path)
+        if (usage is None):
+            return
+        prefix = path.rstrip("/")
+        for name in sorted(self.filesystem.get_directory(path).subfolders):
+            self._print_usage(self.filesystem.du(prefix + "/" + name), prefix + "/" + name)
+        self._print_usage(usage, path)
+
+    def _print_usage(self, usage: dict, path: str):
+        print("%12d bytes %8d files %8d dirs  %s" % (
+            usage["bytes"], usage["files"], usage["dirs"], path))
+
+    def cmd_stat(self, text):
+        if (len(text) != 2):
+            print("Wrong number of arguments")
+            return
+        stat = self.filesystem.stat(text[1])
+        if (stat is None):
+            return
+        if (stat["type"] == "file"):
+            print("file %s: %d bytes, %s%s" % (
+                stat["path"], stat["bytes"], "binary" if stat["binary"] else "text",
+                ", shared" if stat["shared"] else ""))
+            return
+        quota = []
+        if (stat["max_bytes"] is not None):
+            quota.append("%d bytes" % stat["max_bytes"])
+        if (stat["max_inodes"] is not None):
+            quota.append("%d inodes" % stat["max_inodes"])
+        print("dir %s: %d bytes, %d files, %d dirs; quota %s" % (
+            stat["path"], stat["bytes"], stat["files"], stat["dirs"],
+            ", ".join(quota) if quota else "none"))
+
+    def cmd_quota(self, text):
+        if (len(text) not in (2, 3, 4)):
+            print("Wrong number of arguments")
+            return
+        try:
+            limits = [None if limit == "-" else int(limit) for limit in text[2:]]
+            self.filesystem.set_quota(text[1], *limits)
+        except ValueError:
+            print("Quotas are numbers >= 0, or - for no cap")
+
+    # Filesystem metrics so far (see Filesystem.enable_metrics); "stats reset" clears them
+    def cmd_stats(self, text):
+        if (len(text) > 1 and text[1] == "reset"):
+            self.filesystem.enable_metrics().reset()
+            return
+        if (self.filesystem.metrics() is None):
+            self.filesystem.enable_metrics()
+            print("Metrics on, operations are recorded from now on")
+            return
+        print_stats(self.filesystem.metrics())
+
+    # Run one edit mode command line
     def parse_edit_mode_output(self, text, rh: ReadHandler, wh: WriteHandler):
         text = text.split(" ")
-        if (text[0] == "read_line"):
-            out = rh.read_line()
-            # Only strip \n in the simmulator
-            # because print already adds a newline
-            if (len(out) > 1 and out[-1] == "\n"):
-                out = out[:-1]
-            if (len(out) > 1):
-                print(out)
-        elif (text[0] == "read_to_end"):
-            print(rh.read_to_end())
-        elif (text[0] == "read_next"):
-            if (len(text) == 0):
-                print("Missing arguments")
-            else:
-                print(rh.read_next(int(text[1])))
-        elif (text[0] == "move_abs"):
-            if (len(text) < 3):
-                print("Missing arguments")
-            elif (text[1] == "r"):
-                rh.move_cursor_abs(int(text[2]))
-            elif (text[1] == "w"):
-                wh.move_cursor_abs(int(text[2]))
-            else:
-                print("Please specifiy r or w cursor")
-        elif (text[0] == "move_rel"):
-            if (len(text) < 3):
-                print("Missing arguments")
-            elif (text[1] == "r"):
-                rh.move_cursor_rel(int(text[2]))
-            elif (text[1] == "w"):
-                wh.move_cursor_rel(int(text[2]))
-            else:
-                print("Please specifiy r or w cursor")
-        elif (text[0] == "insert"):
-            if (len(text) < 2):
-                print("Missing Arguments")
-            else:
-                wh.insert(text[1])
-        elif (text[0] == "print_cursor"):
-            print("read cursor: " + str(rh.cursor))
-            print("write cursor: " + str(wh.cursor))
-        else:
+        command = self.edit_commands.get(text[0])
+        if (command is None):
             print("invalid command")
+            return
+        clear_error()
+        command(text, rh, wh)
+        self.print_error()
+
+    def edit_read_line(self, text, rh: ReadHandler, wh: WriteHandler):
+        out = rh.read_line()
+        # Only strip \n in the simmulator
+        # because print already adds a newline
+        if (len(out) > 1 and out[-1] == "\n"):
+            out = out[:-1]
+        if (len(out) > 1):
+            print(out)
+
+    def edit_read_to_end(self, text, rh: ReadHandler, wh: WriteHandler):
+        print(rh.read_to_end())
+
+    def edit_read_next(self, text, rh: ReadHandler, wh: WriteHandler):
+        if (len(text) < 2):
+            print("Missing arguments")
+        else:
+            print(rh.read_next(int(text[1])))
+
+    # move_abs, move_rel, seek_line: [r/w] <int>
+    def _move_cursor(self, method_name: str, text, rh: ReadHandler, wh: WriteHandler):
+        if (len(text) < 3):
+            print("Missing arguments")
+        elif (text[1] == "r"):
+            getattr(rh, method_name)(int(text[2]))
+        elif (text[1] == "w"):
+            getattr(wh, method_name)(int(text[2]))
+        else:
+            print("Please specifiy r or w cursor")
+
+    def edit_move_abs(self, text, rh: ReadHandler, wh: WriteHandler):
+        self._move_cursor("move_cursor_abs", text, rh, wh)
+
+    def edit_move_rel(self, text, rh: ReadHandler, wh: WriteHandler):
+        self._move_cursor("move_cursor_rel", text, rh, wh)
+
+    def edit_seek_line(self, text, rh: ReadHandler, wh: WriteHandler):
+        self._move_cursor("seek_line", text, rh, wh)
+
+    def edit_line_count(self, text, rh: ReadHandler, wh: WriteHandler):
+        print(rh.line_count())
+
+    def edit_insert(self, text, rh: ReadHandler, wh: WriteHandler):
+        if (len(text) < 2):
+            print("Missing Arguments")
+        else:
+            wh.insert(text[1])
+
+    def edit_print_cursor(self, text, rh: ReadHandler, wh: WriteHandler):
+        print("read cursor: " + str(rh.cursor))
+        print("write cursor: " + str(wh.cursor))
 
     def enter_edit_mode(self, path: str):
         welcome_text = '''
@@ -190,23 +430,29 @@ class Simulator:
             insert <text>    -> inserts text at current write cursor
             move_abs [r/w] <int>  -> moves read/write cursor to absolute position <int>
             move_rel [r/w] <int>  -> move read/write cursor with relative position
+            seek_line [r/w] <int> -> moves read/write cursor to the start of line <int> (0 based)
+            line_count      -> number of lines in the file
             print_cursor    -> (debug) print cursor number
             exit            -> exit EditMode
         '''
-        print(welcome_text)
+        if (self._script is None):
+            print(welcome_text)
         rh = self.filesystem.getFileHandlerFromPath(path, is_write=False)
+        if (rh is None):
+            return
         rh.open()
         wh = self.filesystem.getFileHandlerFromPath(path, is_write=True)
         wh.open()
 
-        inp = input("> ")
+        inp = self._read_command()
         while (inp != "exit"):
             try:
-                self.parse_edit_mode_output(inp, rh, wh)
+                self._run_timed(inp, self.parse_edit_mode_output, rh, wh)
             except Exception as e:
                 print(e)
-            inp = input("> ")
-        print("Exiting EditMode; Going back to cmdline\n\n")
+            inp = self._read_command()
+        if (self._script is None):
+            print("Exiting EditMode; Going back to cmdline\n\n")
         rh.close()
         wh.close()
 
@@ -214,14 +460,108 @@ class Simulator:
         print("**Command line Test**")
         print("**type 'help' for options**")
 
-        text = input("> ")
+        text = self._read_command()
         while (text != "exit"):
             try:
                 self.parse_output(text)
             except Exception as e:
                 print(e)
-            text = input("> ")
+            text = self._read_command()
+
+    # Run every command in lines (e.g. an open file or sys.stdin) without
+    # prompts, then print ops/sec & per-command latencies to stderr
+    # (stdout only has the commands' own output, so runs can be diffed)
+    # Blank lines and lines starting with # are skipped; "exit" stops early
+    def run_script(self, lines) -> None:
+        self._script = iter(lines)
+        self.latencies = {}
+        begin = time.perf_counter()
+        text = self._read_command()
+        while (text != "exit"):
+            try:
+                self._run_timed(text, self.parse_output)
+            except Exception as e:
+                print(e)
+            text = self._read_command()
+        elapsed = time.perf_counter() - begin
+        self._script = None
+        print_summary(self.latencies, elapsed, sys.stderr)
+
+    # Next command, from the script when running one, else the prompt
+    # End of the script reads as "exit"
+    def _read_command(self) -> str:
+        if (self._script is None):
+            return input("> ")
+        for line in self._script:
+            line = line.rstrip("\r\n")
+            if (line.strip() and not line.startswith("#")):
+                return line
+        return "exit"
+
+    # parse(text, *args), recording its latency when running a script
+    # An editmode session isn't recorded, its commands are, one by one
+    def _run_timed(self, text: str, parse: function, *args) -> None:
+        if (self.latencies is None):
+            parse(text, *args)
+            return
+        name = text.split(" ")[0]
+        start = time.perf_counter()
+        try:
+            parse(text, *args)
+        finally:
+            if (name != "editmode"):
+                self.latencies.setdefault(name, []).append(time.perf_counter() - start)
+
+
+# Percentile p (0-100) of sorted values, nearest rank
+def percentile(values: list[float], p: float) -> float:
+    rank = max(math.ceil(p / 100 * len(values)), 1)
+    return values[rank - 1]
+
+
+# Print ops/sec and latency percentiles per command
+# latencies: command name -> list of seconds
+def print_summary(latencies: dict, elapsed: float, out=sys.stdout) -> None:
+    total = sum(len(values) for values in latencies.values())
+    rate = total / elapsed if elapsed > 0 else 0
+    print("*** %d commands in %.3fs, %.0f ops/sec" % (total, elapsed, rate), file=out)
+    print("%-12s %8s %10s %10s %10s %10s" %
+          ("command", "count", "p50 us", "p90 us", "p99 us", "max us"), file=out)
+    for name in sorted(latencies):
+        values = sorted(latencies[name])
+        print("%-12s %8d %10.1f %10.1f %10.1f %10.1f" % (
+            name, len(values), percentile(values, 50) * 1e6, percentile(values, 90) * 1e6,
+            percentile(values, 99) * 1e6, values[-1] * 1e6), file=out)
+
+
+# Print a row per operation of Filesystem.metrics()
+def print_stats(stats: dict, out=None) -> None:
+    print("%-28s %8s %7s %10s %10s %10s %10s %10s" % (
+        "operation", "calls", "errors", "bytes in", "bytes out", "p50 us", "p99 us", "max us"), file=out)
+    for name, op in stats.items():
+        latency = op["latency_us"]
+        print("%-28s %8d %7d %10d %10d %10.1f %10.1f %10.1f" % (
+            name, op["calls"], op["errors"], op["bytes_in"], op["bytes_out"],
+            latency["p50"], latency["p99"], latency["max"]), file=out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Filesystem command line simulator")
+    parser.add_argument("--script", metavar="FILE",
+                        help="run the commands in FILE without prompting (- for stdin)")
+    parser.add_argument("--metrics", action="store_true",
+                        help="record per-operation metrics (stats) from the start")
+    args = parser.parse_args()
+    simulator = Simulator(args.metrics)
+    if (args.script is not None and args.script != "-"):
+        with open(args.script) as f:
+            simulator.run_script(f)
+    # Commands piped in
+    elif (args.script == "-" or not sys.stdin.isatty()):
+        simulator.run_script(sys.stdin)
+    else:
+        simulator.start()
 
 
-s = Simulator()
-s.start()
+if __name__ == "__main__":
+    main()
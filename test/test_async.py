@@ -0,0 +1,165 @@
+import asyncio
+import threading
+import unittest
+from unittest import mock
+from async_filesystem import AsyncFilesystem
+from filesystem import *
+
+
+# Tests the asyncio front-end
+class TestAsyncFilesystem(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.afs = AsyncFilesystem(chunk_size=4)
+        await self.afs.mkfile("/d/f", "-p")
+
+    async def test_mirrors_api(self):
+        assert await self.afs.write_file("/d/f", "hello") == True
+        assert await self.afs.write_file("/d/f", "world", "-a") == True
+        assert await self.afs.read_file("/d/f") == "hello\nworld"
+        assert await self.afs.copy_file("/d/f", "/g") == True
+        assert await self.afs.move_dir("/d", "/e") == True
+        assert await self.afs.changedir("/e") == True
+        assert await self.afs.get_current_path() == "/e"
+        assert await self.afs.list_files() == ["f"]
+        assert await self.afs.remove_file("/g") == True
+        assert await self.afs.read_file("/g") == ""
+        assert await self.afs.mkdir("/e") is None
+
+    async def test_find(self):
+        for i in range(20):
+            await self.afs.mkfile("/d/sub%d/file%d" % (i, i), "-p")
+        files, folders = await self.afs.find_with_regex("file1", "/", "-r")
+        assert files == ["/d/sub1/file1"] + ["/d/sub%d/file%d" % (i, i) for i in range(10, 20)]
+        # no literal text, walked in chunks
+        files, folders = await self.afs.find_with_regex("sub.*", "/d", "-r")
+        assert len(folders) == 20
+        assert await self.afs.find_with_regex("f", "/missing") is None
+        matches = [path async for path, _ in self.afs.find_iter("f$", "/d")]
+        assert matches == ["/d/f"]
+
+    # A long walk lets other tasks run in between chunks
+    async def test_find_yields_to_loop(self):
+        for i in range(50):
+            await self.afs.mkdir("/d/sub%d" % i)
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0)
+        task = asyncio.create_task(ticker())
+        await asyncio.sleep(0)
+        before = ticks
+        await self.afs.find_with_regex(".*", "/", "-r")
+        task.cancel()
+        assert ticks - before >= 10
+
+    # Waiters get the write slot in order instead of failing
+    async def test_open_waits_fairly(self):
+        holder = await self.afs.open_handler("/d/f", is_write=True)
+        order = []
+
+        async def writer(name):
+            fh = await self.afs.open_handler("/d/f", is_write=True)
+            order.append(name)
+            fh.concat(name)
+            await asyncio.sleep(0.01)
+            fh.close()
+
+        async def reader(name):
+            fh = await self.afs.open_handler("/d/f", is_write=False)
+            order.append(name)
+            fh.close()
+        tasks = []
+        for coro in [writer("a"), reader("r"), writer("b")]:
+            tasks.append(asyncio.create_task(coro))
+            await asyncio.sleep(0.01)
+        holder.close()
+        await asyncio.gather(*tasks)
+        assert order == ["a", "r", "b"]
+        assert await self.afs.read_file("/d/f") == "ab"
+
+    async def test_open_timeout(self):
+        holder = await self.afs.open_handler("/d/f", is_write=True)
+
+        async def other():
+            return await self.afs.open_handler("/d/f", is_write=False, timeout=0.05)
+        assert await asyncio.create_task(other()) is None
+        holder.close()
+        assert await self.afs.open_handler("/d/missing", is_write=False) is None
+
+    # The task holding a write handler can still read the file
+    async def test_same_task_reads_while_writing(self):
+        wh = await self.afs.open_handler("/d/f", is_write=True)
+        wh.write("mine")
+        assert await self.afs.read_file("/d/f") == "mine"
+        assert await self.afs.open_handler("/d/f", is_write=True) is None
+        wh.close()
+
+    # A cancelled waiter doesn't keep the lock
+    async def test_cancelled_open(self):
+        holder = await self.afs.open_handler("/d/f", is_write=True)
+        task = asyncio.create_task(self.afs.open_handler("/d/f", is_write=True))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        holder.close()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        await asyncio.sleep(0.1)
+        assert await self.afs.write_file("/d/f", "free") == True
+
+    # Opening (which may decompress) and reading run on the executor
+    async def test_read_off_loop(self):
+        await self.afs.write_file("/d/f", "contents")
+        threads = []
+
+        def recorded(method):
+            def run(*args, **kwargs):
+                threads.append(threading.current_thread())
+                return method(*args, **kwargs)
+            return run
+        with mock.patch.object(ReadHandler, "open", recorded(ReadHandler.open)), \
+                mock.patch.object(ReadHandler, "read", recorded(ReadHandler.read)):
+            assert await self.afs.read_file("/d/f") == "contents"
+        assert len(threads) == 2
+        assert threading.current_thread() not in threads
+
+    # A write refused by a quota fails like Filesystem.write_file
+    async def test_write_over_quota(self):
+        self.afs.fs.set_quota("/d", max_bytes=5)
+        assert await self.afs.write_file("/d/f", "0123456789") == False
+        assert last_error().code == ErrorCode.QUOTA_EXCEEDED
+        assert await self.afs.write_file("/d/f", "01234") == True
+        assert await self.afs.write_file("/d/f", "5", "-c") == False
+        assert await self.afs.read_file("/d/f") == "01234"
+        # the handler was closed
+        assert await self.afs.write_file("/d/f", "") == True
+
+    # Handlers held by plain threads are waited on too
+    async def test_waits_for_thread(self):
+        fs = self.afs.fs
+        wh = fs.getFileHandlerFromPath("/d/f", is_write=True)
+        opened = threading.Event()
+        release = threading.Event()
+
+        def hold():
+            wh.open()
+            opened.set()
+            release.wait()
+            wh.write("thread")
+            wh.close()
+        t = threading.Thread(target=hold)
+        t.start()
+        opened.wait()
+        read = asyncio.create_task(self.afs.read_file("/d/f"))
+        await asyncio.sleep(0.01)
+        assert not read.done()
+        release.set()
+        assert await read == "thread"
+        t.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import tempfile
+import unittest
+from filesystem import *
+
+
+# Tests batched operations
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.fs = Filesystem()
+
+    def test_results_in_order(self):
+        results = self.fs.batch([
+            ("mkdir", "/a/b", "-p"),
+            ("mkfile", "/a/b/f1"),
+            ("mkfile", "/a/b/f1"),
+            ("write_file", "/a/b/f1", "hello"),
+            ("write_file", "/a/b/f1", "world", "-a"),
+            ("read_file", "/a/b/f1"),
+            ("mkfile", "/missing/f"),
+            ("remove_file", "/a/b/f1"),
+            ("read_file", "/a/b/f1"),
+        ])
+        assert isinstance(results[0], Directory)
+        assert isinstance(results[1], File)
+        assert results[2:] == [None, True, True, "hello\nworld", None, True, ""]
+        assert self.fs.list_folders() == ["a"]
+
+    # Relative paths follow cd's within the batch
+    def test_relative_paths(self):
+        self.fs.mkdir("/a/b", "-p")
+        results = self.fs.batch([
+            ("changedir", "/a"),
+            ("mkfile", "b/f"),
+            ("changedir", "b"),
+            ("mkfile", "f2"),
+            ("mkfile", "../f3"),
+        ])
+        assert all(results)
+        assert sorted(self.fs.find_with_regex("f", "/", "-r")[0]) == \
+            ["/a/b/f", "/a/b/f2", "/a/f3"]
+
+    # Resolved parents are dropped once a folder is removed/moved
+    def test_moved_parent(self):
+        results = self.fs.batch([
+            ("mkdir", "/a/b", "-p"),
+            ("mkfile", "/a/b/f"),
+            ("move_dir", "/a/b", "/c"),
+            ("mkfile", "/a/b/g"),
+            ("mkfile", "/c/g"),
+        ])
+        assert results[2] == True and results[3] is None
+        assert isinstance(results[4], File)
+        assert self.fs.find_with_regex("[fg]", "/", "-r")[0] == ["/c/f", "/c/g"]
+
+    def test_atomic_rollback(self):
+        self.fs.mkdir("/keep")
+        self.fs.changedir("/keep")
+        results = self.fs.batch([
+            ("mkfile", "/keep/f"),
+            ("write_file", "/keep/f", "x"),
+            ("changedir", "/"),
+            ("remove_dir", "/keep"),
+            ("mkdir", "/missing/d"),
+            ("mkdir", "/never"),
+        ], atomic=True)
+        assert len(results) == 5 and results[4] is None
+        assert self.fs.get_current_path() == "/keep"
+        assert self.fs.list_files() == []
+        self.fs.changedir("/")
+        assert self.fs.list_folders() == ["keep"]
+        assert self.fs.find_with_regex("f", "/", "-r") == ([], [])
+
+    def test_atomic_success(self):
+        results = self.fs.batch([("mkdir", "/a"), ("mkfile", "/a/f")], atomic=True)
+        assert all(results)
+        assert self.fs.find_with_regex("f", "/", "-r") == (["/a/f"], [])
+
+    def test_context(self):
+        with self.fs.batch() as batch:
+            batch.mkfile("/a/f", "-p")
+            batch.write_file("/a/f", "text")
+            assert self.fs.get_directory("/a") is None
+        assert batch.results[1] == True
+        assert self.fs.read_file("/a/f") == "text"
+        with self.assertRaises(AttributeError):
+            batch.snapshot()
+
+    def test_unknown_op(self):
+        with self.assertRaises(ValueError):
+            self.fs.batch([("mkdir", "/a"), ("save", "/tmp/x")])
+        assert self.fs.list_folders() == []
+
+    def test_snapshot_is_read_only(self):
+        self.fs.mkfile("/f")
+        self.fs.write_file("/f", "x")
+        snap = self.fs.snapshot()
+        assert snap.batch([("read_file", "/f"), ("mkfile", "/g")]) == ["x", None]
+
+    # The batch is journaled and replays to the same tree
+    def test_journal(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            fs = Filesystem.recover(tmp, fsync=False)
+            fs.batch([
+                ("mkdir", "/a/b", "-p"),
+                ("mkfile", "/a/b/f"),
+                ("write_file", "/a/b/f", "hello"),
+                ("write_file", "/a/b/f", "world", "-a"),
+                ("copy_dir", "/a", "/c"),
+                ("mkdir", "/x/y"),
+            ])
+            fs.batch([("mkdir", "/gone"), ("mkdir", "/missing/d")], atomic=True)
+            records = fs.journal.records
+            fs.close()
+            assert records == 5
+            fs = Filesystem.recover(tmp, fsync=False)
+            assert fs.read_file("/c/b/f") == "hello\nworld"
+            assert fs.list_folders() == ["a", "c"]
+            fs.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
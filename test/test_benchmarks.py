@@ -0,0 +1,38 @@
+import unittest
+from benchmarks.scenarios import SCENARIOS
+from benchmarks.run import scenario_params, run_scenario, parse_overrides
+from benchmarks.compare import compare
+
+
+# Tests the benchmark suite itself, at a tiny scale
+class TestBenchmarks(unittest.TestCase):
+
+    # Every scenario runs and counts its ops
+    def test_scenarios_run(self):
+        for name in SCENARIOS:
+            params = scenario_params(name, scale=0.005)
+            result = run_scenario(name, params, repeat=1)
+            assert result["ops"] > 0, name
+            assert result["ops_per_sec"] > 0, name
+            assert result["params"] == params
+
+    def test_params(self):
+        params = scenario_params("find_walk", 0.5, parse_overrides(["find_walk.fanout=3"]))
+        assert params == {"nodes": 50000, "queries": 2, "fanout": 3}
+        with self.assertRaises(ValueError):
+            parse_overrides(["find_walk.missing=1"])
+
+    def test_compare(self):
+        def report(rates, nodes=10):
+            return {"results": {name: {"params": {"nodes": nodes}, "ops_per_sec": rate}
+                                for name, rate in rates.items()}}
+        baseline = report({"a": 100, "b": 100, "c": 100, "gone": 100})
+        rows = compare(baseline, report({"a": 95, "b": 80, "c": 120, "new": 1}), 0.10)
+        assert [(row["name"], row["status"]) for row in rows] == \
+            [("a", "ok"), ("b", "REGRESSION"), ("c", "faster")]
+        rows = compare(baseline, report({"a": 10}, nodes=20), 0.10)
+        assert rows[0]["status"] == "params differ"
+
+
+if __name__ == '__main__':
+    unittest.main()
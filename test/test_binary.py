@@ -0,0 +1,120 @@
+import os
+import tempfile
+import unittest
+from filesystem import *
+from image import MappedStore
+
+
+# Tests binary files and zero-copy reads
+class TestBinary(unittest.TestCase):
+
+    def setUp(self):
+        self.fs = Filesystem()
+        self.fs.mkfile("/blob", binary=True)
+        self.fs.write_file("/blob", b"\x00\x01line\nrest")
+
+    def open_read(self, path: str = "/blob") -> ReadHandler:
+        rh = self.fs.getFileHandlerFromPath(path, is_write=False)
+        rh.open()
+        return rh
+
+    def test_read_write(self):
+        assert self.fs.read_file("/blob") == b"\x00\x01line\nrest"
+        self.fs.write_file("/blob", b"more", "-a")
+        self.fs.write_file("/blob", bytearray(b"!"), "-c")
+        assert self.fs.read_file("/blob") == b"\x00\x01line\nrest\nmore!"
+        rh = self.open_read()
+        assert rh.line_count() == 3
+        rh.seek_line(1)
+        assert rh.read_line() == b"rest\n"
+        assert rh.read_next(2) == b"mo"
+        rh.close()
+
+    # Text files still take str and binary files bytes
+    def test_wrong_type(self):
+        self.fs.mkfile("/text")
+        assert self.fs.write_file("/text", b"bytes") == False
+        assert self.fs.write_file("/blob", "text") == False
+        assert self.fs.read_file("/blob") == b"\x00\x01line\nrest"
+        wh = self.fs.getFileHandlerFromPath("/text", is_write=True)
+        wh.open()
+        with self.assertRaises(TypeError):
+            wh.insert(b"x")
+        wh.close()
+        rh = self.open_read("/text")
+        with self.assertRaises(TypeError):
+            rh.read_view()
+        rh.close()
+
+    def test_read_view(self):
+        rh = self.open_read()
+        view = rh.read_view(2)
+        assert isinstance(view, memoryview) and view.readonly
+        assert view == b"\x00\x01"
+        assert rh.read_view() == b"line\nrest"
+        assert rh.read_view(10) == b""
+        rh.close()
+
+    # A view keeps the contents it was taken with
+    def test_view_survives_writes(self):
+        rh = self.open_read()
+        view = rh.read_view()
+        rh.close()
+        self.fs.write_file("/blob", b"tail", "-c")
+        wh = self.fs.getFileHandlerFromPath("/blob", is_write=True)
+        wh.open()
+        wh.insert(b"head")
+        wh.close()
+        assert view == b"\x00\x01line\nrest"
+        assert self.fs.read_file("/blob") == b"head\x00\x01line\nresttail"
+
+    def test_readinto(self):
+        rh = self.open_read()
+        buffer = bytearray(4)
+        chunks = []
+        n = rh.readinto(buffer)
+        while n:
+            chunks.append(bytes(buffer[:n]))
+            n = rh.readinto(buffer)
+        assert chunks == [b"\x00\x01li", b"ne\nr", b"est"]
+        rh.close()
+
+    def test_copy_on_write(self):
+        self.fs.copy_file("/blob", "/copy")
+        self.fs.write_file("/copy", b"x", "-c")
+        assert self.fs.read_file("/blob") == b"\x00\x01line\nrest"
+        assert self.fs.read_file("/copy") == b"\x00\x01line\nrestx"
+
+    # Binary contents are served from the mapping until modified
+    def test_image(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "fs.img")
+            self.fs.save(path)
+            fs = Filesystem.load(path)
+            store = fs.root.get_file("blob").store
+            assert isinstance(store, MappedStore) and store.is_binary
+            rh = fs.getFileHandlerFromPath("/blob", is_write=False)
+            rh.open()
+            assert rh.read_view(6) == b"\x00\x01line"
+            rh.close()
+            assert fs.read_file("/blob") == b"\x00\x01line\nrest"
+            assert not store.is_loaded
+            fs.write_file("/blob", b"!", "-c")
+            assert fs.read_file("/blob") == b"\x00\x01line\nrest!"
+            del rh, store
+
+    def test_journal(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            fs = Filesystem.recover(tmp, fsync=False)
+            fs.mkfile("/blob", binary=True)
+            fs.write_file("/blob", bytes(range(256)))
+            fs.write_file("/blob", b"\xff", "-c")
+            fs.close()
+            fs = Filesystem.recover(tmp, fsync=False)
+            assert fs.root.get_file("blob").is_binary
+            assert fs.read_file("/blob") == bytes(range(256)) + b"\xff"
+            fs.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,212 @@
+import contextlib
+import io
+import os
+import tempfile
+import threading
+import time
+import unittest
+from compression import CompressedStore
+from errors import ErrorCode, last_error
+from filesystem import Filesystem
+from simulator import Simulator
+
+TEXT = "a cold line of text\n" * 100
+
+
+# Tests compression of cold contents & the LRU of decompressed contents
+class TestCompression(unittest.TestCase):
+
+    def setUp(self):
+        self.fs = Filesystem()
+
+    def file(self, path: str):
+        dir_path, _, name = path.rpartition("/")
+        return self.fs.get_directory(dir_path or "/").get_file(name)
+
+    def write(self, path: str, contents) -> None:
+        self.fs.mkfile(path, "-p", isinstance(contents, bytes))
+        self.fs.write_file(path, contents)
+
+    def is_compressed(self, path: str) -> bool:
+        store = self.file(path).store
+        return isinstance(store, CompressedStore) and not store.is_loaded
+
+    # Cold files are compressed by the sweeper thread, give it time
+    def wait_compressed(self, path: str) -> bool:
+        deadline = time.monotonic() + 5
+        while (not self.is_compressed(path) and time.monotonic() < deadline):
+            time.sleep(0.001)
+        return self.is_compressed(path)
+
+    # Files not opened during after_ops opens are compressed
+    def test_after_ops(self):
+        self.fs.enable_compression(after_ops=3)
+        self.write("/cold", TEXT)
+        self.write("/hot", TEXT)
+        for _ in range(3):
+            self.fs.read_file("/hot")
+        assert self.wait_compressed("/cold")
+        assert not self.is_compressed("/hot")
+        usage = self.fs.content_usage()
+        assert usage["logical_bytes"] == 2 * len(TEXT)
+        assert usage["resident_bytes"] < 1.6 * len(TEXT)
+        # decompressed transparently
+        assert self.fs.read_file("/cold") == TEXT
+        assert self.file("/cold").store.is_loaded
+
+    # The sweeper wakes every after_seconds even when nothing is opened
+    def test_after_seconds(self):
+        self.fs.enable_compression(after_seconds=0.01)
+        self.write("/a", TEXT)
+        assert self.wait_compressed("/a")
+        assert self.fs.read_file("/a") == TEXT
+
+    # Without the sweeper (e.g. a disabled policy), compress_cold does it
+    def test_compress_cold(self):
+        tier = self.fs.enable_compression(after_ops=1)
+        tier.close()
+        self.write("/a", TEXT)
+        self.write("/b", TEXT)
+        assert not self.is_compressed("/a")
+        assert self.fs.compress_cold() == 1
+        assert self.is_compressed("/a")
+
+    # Opening a file never compresses others on the opening thread
+    def test_open_doesnt_compress(self):
+        tier = self.fs.enable_compression(after_ops=1)
+        threads = []
+        compress = tier.compress
+
+        def record(file):
+            threads.append(threading.current_thread())
+            return compress(file)
+        tier.compress = record
+        for name in ("a", "b", "c"):
+            self.write("/" + name, TEXT)
+        assert self.wait_compressed("/a") and self.wait_compressed("/b")
+        assert threading.main_thread() not in threads
+        self.fs.disable_compression()
+        assert not tier._sweeper.is_alive()
+
+    # Decompressed copies are dropped least recently opened first
+    def test_lru(self):
+        self.fs.enable_compression(cache_bytes=2 * len(TEXT) + 2)
+        for name in ("a", "b", "c"):
+            self.write("/" + name, TEXT + name)
+        assert self.fs.compress() == 3
+        self.fs.read_file("/a")
+        self.fs.read_file("/b")
+        self.fs.read_file("/a")
+        self.fs.read_file("/c")
+        assert not self.is_compressed("/a")
+        assert self.is_compressed("/b")
+        assert not self.is_compressed("/c")
+        stats = self.fs.compression_stats()
+        assert stats["cache_hits"] == 1
+        assert stats["decompressions"] == 3
+        assert stats["cached"] == 2
+        assert stats["cached_bytes"] <= 2 * len(TEXT) + 2
+        # dropping a copy doesn't lose anything
+        assert self.fs.read_file("/b") == TEXT + "b"
+
+    # A written copy is the file's own: never dropped by the LRU, and
+    # compressed afresh once cold again
+    def test_write(self):
+        tier = self.fs.enable_compression(after_ops=2, cache_bytes=0)
+        self.write("/f", TEXT)
+        self.fs.compress()
+        wh = self.fs.getFileHandlerFromPath("/f", True)
+        wh.open()
+        wh.move_cursor_abs(5)
+        wh.insert("!")
+        # other files opened meanwhile would evict a clean copy
+        self.write("/g", "x")
+        wh.close()
+        assert self.fs.read_file("/f") == TEXT[:5] + "!" + TEXT[5:]
+        self.fs.read_file("/g")
+        self.fs.read_file("/g")
+        assert self.wait_compressed("/f")
+        assert self.fs.read_file("/f") == TEXT[:5] + "!" + TEXT[5:]
+        self.fs.write_file("/f", "short")
+        assert self.fs.read_file("/f") == "short"
+        assert tier.stats()["compressions"] == 2
+
+    def test_binary_lzma(self):
+        data = bytes(range(256)) * 8
+        self.fs.enable_compression("lzma")
+        self.write("/b", data)
+        self.fs.compress()
+        assert self.is_compressed("/b")
+        rh = self.fs.getFileHandlerFromPath("/b", False)
+        rh.open()
+        assert rh.read_view(4).tobytes() == data[:4]
+        rh.close()
+        assert self.fs.read_file("/b") == data
+        with self.assertRaises(ValueError):
+            self.fs.enable_compression("rar")
+
+    # Small, open or shared contents stay as they are
+    def test_skipped(self):
+        self.fs.enable_compression()
+        self.write("/small", "tiny")
+        self.write("/shared", TEXT)
+        self.fs.copy_file("/shared", "/copy")
+        self.write("/open", TEXT)
+        self.write("/noise", bytes(os.urandom(1000)))
+        rh = self.fs.getFileHandlerFromPath("/open", False)
+        rh.open()
+        assert self.fs.compress() == 0
+        rh.close()
+        assert self.fs.compress() == 1
+        assert self.is_compressed("/open")
+
+    # Copies share the compressed bytes until written
+    def test_copy(self):
+        self.fs.enable_compression()
+        self.write("/f", TEXT)
+        self.fs.compress()
+        self.fs.copy_file("/f", "/g")
+        self.fs.write_file("/g", "!", "-c")
+        assert self.fs.read_file("/g") == TEXT + "!"
+        assert self.fs.read_file("/f") == TEXT
+        assert isinstance(self.file("/f").store, CompressedStore)
+        assert self.file("/g").store is not self.file("/f").store
+
+    # Compressed contents are saved as plain contents
+    def test_image(self):
+        self.fs.enable_compression()
+        self.write("/d/f", TEXT)
+        self.fs.compress()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "image")
+            assert self.fs.save(path)
+            fs = Filesystem.load(path)
+            assert fs.read_file("/d/f") == TEXT
+            assert fs.content_usage()["resident_bytes"] == len(TEXT)
+
+    def test_errors(self):
+        assert self.fs.compress() is None
+        assert last_error().code == ErrorCode.NO_COMPRESSION
+        assert self.fs.compression_stats() is None
+        self.fs.enable_compression()
+        assert self.fs.compress("/missing") is None
+        assert last_error().code == ErrorCode.INVALID_PATH
+        assert self.fs.snapshot("s").compress() is None
+        assert last_error().code == ErrorCode.READ_ONLY
+        self.fs.disable_compression()
+        assert self.fs.compress_cold() is None
+
+    def test_simulator(self):
+        simulator = Simulator()
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            simulator.run_script(io.StringIO(
+                "mkfile /a\nwrite /a " + "x" * 1000 + "\ncompress\nread /a\n"))
+        lines = out.getvalue().splitlines()
+        assert lines[0].startswith("Compressed 1 files: ")
+        assert lines[0].endswith("of 1000 logical (0 cached)")
+        assert lines[1] == "x" * 1000
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,210 @@
+import random
+import tracemalloc
+import unittest
+from filesystem import *
+from contents import LEAF_MAX
+
+
+# Tests the content storage engines behind File
+class TestContents(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = random.Random(1234)
+
+    # Run the same random edits against a store and a plain str
+    def _check_against_str(self, store: ContentStore):
+        model = ""
+        for _ in range(500):
+            op = self.rng.randrange(3)
+            text = "x" * self.rng.randrange(1, 3 * LEAF_MAX) \
+                if self.rng.random() < 0.1 else str(self.rng.randrange(10**6))
+            if op == 0:
+                i = self.rng.randrange(len(model) + 1)
+                store.insert(i, text)
+                model = model[:i] + text + model[i:]
+            elif op == 1:
+                store.concat(text)
+                model += text
+            else:
+                start = self.rng.randrange(len(model) + 1)
+                end = self.rng.randrange(start, len(model) + 1)
+                assert store.get(start, end) == model[start:end]
+            assert len(store) == len(model)
+        assert store.get() == model
+
+    def test_string_store(self):
+        self._check_against_str(StringStore())
+
+    def test_rope_store(self):
+        self._check_against_str(RopeStore())
+
+    # A rope with many small inserts should stay shallow
+    def test_rope_stays_balanced(self):
+        store = RopeStore("a" * (LEAF_MAX * 65))
+        for i in range(2000):
+            store.insert(self.rng.randrange(len(store) + 1), "b")
+        # every node keeps the AVL invariant
+        stack = [store._root]
+        while stack:
+            node = stack.pop()
+            if node.height:
+                assert abs(node.left.height - node.right.height) <= 1
+                stack.extend([node.left, node.right])
+        assert store.get().count("b") == 2000
+
+    # Newline lookups agree with a plain str after random edits
+    def _check_lines(self, store: ContentStore):
+        model = ""
+        for _ in range(300):
+            text = "".join(self.rng.choice("ab\n") for _ in range(
+                self.rng.randrange(1, 40 if self.rng.random() < 0.9 else 5000)))
+            if self.rng.random() < 0.5:
+                i = self.rng.randrange(len(model) + 1)
+                store.insert(i, text)
+                model = model[:i] + text + model[i:]
+            else:
+                store.concat(text)
+                model += text
+            start = self.rng.randrange(len(model) + 1)
+            assert store.find_newline(start) == model.find("\n", start)
+            lines = model.splitlines(keepends=True)
+            assert store.line_count() == len(lines)
+            n = self.rng.randrange(len(lines))
+            assert store.line_start(n) == sum(len(l) for l in lines[:n])
+
+    def test_string_store_lines(self):
+        self._check_lines(StringStore())
+
+    def test_rope_store_lines(self):
+        self._check_lines(RopeStore())
+
+    # A file built by concats reads back line by line
+    def test_rope_read_lines_after_concat(self):
+        fs = Filesystem()
+        fs.mkfile("f")
+        lines = ["line %d %s\n" % (i, "x" * self.rng.randrange(80)) for i in range(5000)]
+        lines.append("no newline")
+        wh = fs.getFileHandlerFromPath("f", is_write=True)
+        wh.open()
+        for line in lines:
+            wh.concat(line)
+        wh.close()
+        store = fs.root.get_file("f").store
+        rh = fs.getFileHandlerFromPath("f", is_write=False)
+        rh.open()
+        read = []
+        line = rh.read_line()
+        while line:
+            read.append(line)
+            line = rh.read_line()
+        rh.seek_line(4000)
+        assert rh.read_line() == lines[4000]
+        rh.close()
+        assert read == lines
+        assert read == store.get().splitlines(keepends=True)
+
+    # The leaves are the only copy: reading all of it doesn't keep a flat one
+    def test_rope_keeps_no_flat_copy(self):
+        text = "0123456789" * 100000
+        store = RopeStore(text)
+        store.concat("!")
+        del text
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        for _ in range(3):
+            assert len(store.get()) == 1000001
+        kept = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        assert kept < 10000
+        assert store.resident_size() == len(store)
+
+    def test_rope_copy_is_independent(self):
+        store = RopeStore("hello world")
+        other = store.copy()
+        store.insert(5, ",")
+        other.concat("!")
+        assert store.get() == "hello, world"
+        assert other.get() == "hello world!"
+
+    # An engine missing part of the API fails when created, not when used
+    def test_incomplete_store(self):
+        class NoInsert(ContentStore):
+            __slots__ = ("text",)
+
+            def __len__(self):
+                return 0
+
+        with self.assertRaises(TypeError):
+            NoInsert()
+
+    # Handlers behave the same on top of either engine
+    def test_handlers_with_string_store(self):
+        fs = Filesystem(content_store=StringStore)
+        fs.mkfile("f")
+        wh = fs.getFileHandlerFromPath("f", is_write=True)
+        wh.open()
+        wh.write("abcdefg")
+        wh.move_cursor_abs(2)
+        wh.insert("HI")
+        wh.close()
+        assert fs.read_file("f") == "abHIcdefg"
+        assert isinstance(wh.file.store, StringStore)
+
+    def test_insert_into_large_file(self):
+        fs = Filesystem()
+        fs.mkfile("big")
+        fs.write_file("big", "0123456789" * 10000)
+        wh = fs.getFileHandlerFromPath("big", is_write=True)
+        wh.open()
+        wh.move_cursor_abs(50000)
+        for _ in range(1000):
+            wh.insert("ab")
+        wh.close()
+        rh = fs.getFileHandlerFromPath("big", is_write=False)
+        rh.open()
+        rh.move_cursor_abs(49998)
+        assert rh.read_next(6) == "89abab"
+        rh.move_cursor_abs(52000)
+        assert rh.read_next(4) == "0123"
+        rh.close()
+        assert len(fs.read_file("big")) == 102000
+
+    # *** Copy-on-write contents ***
+    def test_cpfile_shares_until_write(self):
+        fs = Filesystem()
+        fs.mkfile("f")
+        fs.write_file("f", "x" * 100)
+        fs.copy_file("f", "g")
+        assert fs.content_usage() == {"files": 2, "logical_bytes": 200,
+                                      "shared_bytes": 100, "unique_bytes": 0,
+                                      "resident_bytes": 100}
+        # first write gives g its own copy, f is untouched
+        fs.write_file("g", "y", "-c")
+        assert fs.read_file("f") == "x" * 100
+        assert fs.read_file("g") == "x" * 100 + "y"
+        assert fs.content_usage() == {"files": 2, "logical_bytes": 201,
+                                      "shared_bytes": 0, "unique_bytes": 201,
+                                      "resident_bytes": 201}
+
+    def test_backup_shares_contents(self):
+        fs = Filesystem()
+        fs.mkfile("f")
+        fs.write_file("f", "old")
+        fs.mkfile("/d/f", "-p")
+        fs.write_file("/d/f", "new")
+        fs.copy_file("/d/f", "/", "-b")
+        # "~f" shares the old buffer, "f" and "/d/f" share the new one
+        assert fs.read_file("~f") == "old"
+        assert fs.content_usage()["shared_bytes"] == 3
+        assert fs.content_usage()["unique_bytes"] == 3
+        # removing a copy releases its reference
+        fs.remove_file("/d/f")
+        assert fs.content_usage()["shared_bytes"] == 0
+
+    def test_content_usage_invalid_path(self):
+        fs = Filesystem()
+        assert fs.content_usage("/missing") is None
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+import contextlib
+import gc
+import io
+import tarfile
+import unittest
+from dedup import content_key
+from errors import ErrorCode, last_error
+from filesystem import Filesystem
+from simulator import Simulator
+
+
+# Tests content-addressed deduplication of file contents
+class TestDedup(unittest.TestCase):
+
+    def setUp(self):
+        self.fs = Filesystem(dedup=True)
+        # Reclaiming mustn't depend on the garbage collector
+        gc.disable()
+
+    def tearDown(self):
+        gc.enable()
+
+    def file(self, path: str):
+        dir_path, _, name = path.rpartition("/")
+        return self.fs.get_directory(dir_path or "/").get_file(name)
+
+    def write(self, path: str, contents, binary: bool = False) -> None:
+        self.fs.mkfile(path, "-p", binary)
+        self.fs.write_file(path, contents)
+
+    # Files written independently with the same contents share one blob
+    def test_shared(self):
+        self.write("/a/f", "template")
+        self.write("/b/g", "template")
+        self.write("/c", "other")
+        assert self.file("/a/f").buffer is self.file("/b/g").buffer
+        assert self.file("/c").buffer is not self.file("/a/f").buffer
+        stats = self.fs.dedup_stats()
+        assert stats["blobs"] == 2
+        assert stats["refs"] == 3
+        assert stats["stored_bytes"] == 13
+        assert stats["logical_bytes"] == 21
+        assert stats["saved_bytes"] == 8
+        assert abs(stats["dedup_ratio"] - 21 / 13) < 1e-9
+
+    # Same bytes in a binary and a text file aren't shared
+    def test_binary(self):
+        self.write("/t", "abc")
+        self.write("/b", b"abc", True)
+        self.write("/b2", b"abc", True)
+        assert self.file("/b").buffer is self.file("/b2").buffer
+        assert self.file("/t").buffer is not self.file("/b").buffer
+        assert self.fs.read_file("/t") == "abc"
+        assert self.fs.read_file("/b2") == b"abc"
+
+    # Writing to a shared file gives it a private copy, then it's
+    # deduplicated by its new contents
+    def test_write(self):
+        self.write("/a", "same")
+        self.write("/b", "same")
+        self.write("/c", "changed")
+        self.fs.write_file("/b", "changed")
+        assert self.fs.read_file("/a") == "same"
+        assert self.file("/b").buffer is self.file("/c").buffer
+        # edits through a handler to a file no one shares
+        wh = self.fs.getFileHandlerFromPath("/a", True)
+        wh.open()
+        wh.concat("!")
+        blob = self.file("/a").buffer
+        assert blob.blob is None
+        wh.close()
+        assert blob.blob is not None
+        self.write("/d", "same!")
+        assert self.file("/d").buffer is blob
+        assert self.fs.dedup_stats()["blobs"] == 2
+
+    def test_remove_file(self):
+        self.write("/a", "x")
+        self.write("/b", "x")
+        self.fs.remove_file("/a")
+        assert self.fs.dedup_stats()["blobs"] == 1
+        self.fs.remove_file("/b")
+        stats = self.fs.dedup_stats()
+        assert stats["blobs"] == 0
+        assert stats["reclaimed"] == 1
+
+    # Removed folders link their files in cycles, yet their blobs are
+    # reclaimed right away
+    def test_remove_dir(self):
+        self.write("/d/e/f", "x")
+        self.write("/d/g", "y")
+        self.write("/h", "y")
+        self.fs.remove_dir("/d")
+        stats = self.fs.dedup_stats()
+        assert stats["blobs"] == 1
+        assert stats["refs"] == 1
+        assert self.fs.read_file("/h") == "y"
+
+    # Clones (snapshots, copy_dir, atomic batches) keep reading the removed
+    # folders' contents
+    def test_remove_dir_clones(self):
+        self.write("/d/e/f", "x")
+        snapshot = self.fs.snapshot("s")
+        self.fs.copy_dir("/d", "/copy")
+        self.fs.remove_dir("/d")
+        assert snapshot.read_file("/d/e/f") == "x"
+        assert self.fs.read_file("/copy/e/f") == "x"
+        self.write("/k/f", "y")
+        results = self.fs.batch([("remove_dir", "/k"), ("remove_file", "/missing")], atomic=True)
+        assert results[-1] is False
+        assert self.fs.read_file("/k/f") == "y"
+
+    # A removed file with an open handler keeps its contents
+    def test_remove_dir_open(self):
+        self.write("/d/f", "x")
+        rh = self.fs.getFileHandlerFromPath("/d/f", False)
+        rh.open()
+        self.fs.remove_dir("/d")
+        assert rh.read() == "x"
+        rh.close()
+
+    # Imported contents are hashed as they're read, with the same keys
+    def test_import(self):
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w") as archive:
+            for name, data in (("a", "héllo".encode()), ("b", "héllo".encode()), ("c", b"\xff")):
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                archive.addfile(info, io.BytesIO(data))
+        buffer.seek(0)
+        self.fs.import_tar(buffer, "/t", chunk_size=2)
+        assert self.file("/t/a").buffer is self.file("/t/b").buffer
+        assert self.file("/t/a").buffer.blob[1] == content_key(self.file("/t/a").store)
+        self.write("/w", "héllo")
+        assert self.file("/w").buffer is self.file("/t/a").buffer
+        self.write("/x", b"\xff", True)
+        assert self.file("/x").buffer is self.file("/t/c").buffer
+
+    # deduplicate() catches up on files that predate deduplication
+    def test_deduplicate(self):
+        fs = self.fs = Filesystem()
+        for path in ("/a", "/b", "/d/c"):
+            fs.mkfile(path, "-p")
+            fs.write_file(path, "same")
+        assert fs.dedup_stats() is None
+        assert last_error().code == ErrorCode.NO_DEDUP
+        stats = fs.deduplicate()
+        assert stats["blobs"] == 1
+        assert stats["refs"] == 3
+        assert stats["saved_bytes"] == 8
+        # written files are deduplicated from then on
+        fs.mkfile("/e")
+        fs.write_file("/e", "same")
+        assert self.file("/e").buffer is self.file("/a").buffer
+        assert fs.deduplicate("/missing") is None
+        assert last_error().code == ErrorCode.INVALID_PATH
+        assert fs.snapshot("s").deduplicate() is None
+        assert last_error().code == ErrorCode.READ_ONLY
+
+    def test_simulator(self):
+        simulator = Simulator()
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            simulator.run_script(io.StringIO(
+                "mkfile /a\nwrite /a text\ncpfile /a /b\nmkfile /c\nwrite /c text\ndedup\n"))
+        assert out.getvalue().splitlines()[-1] == "1 blobs for 3 files: 4 of 12 bytes stored, 8 saved (3.00x)"
+
+
+if __name__ == '__main__':
+    unittest.main()
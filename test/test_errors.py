@@ -0,0 +1,149 @@
+import asyncio
+import contextlib
+import io
+import threading
+import unittest
+from async_filesystem import AsyncFilesystem
+from errors import ErrorCode, FsError, last_error, clear_error
+from filesystem import Filesystem
+
+
+# Tests the typed error codes replacing printed messages
+class TestErrors(unittest.TestCase):
+
+    def setUp(self):
+        clear_error()
+        self.fs = Filesystem()
+        self.fs.mkfile("/d/f", "-p")
+
+    def test_codes(self):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            assert self.fs.changedir("/missing") == False
+            assert last_error().code == ErrorCode.INVALID_PATH
+            assert self.fs.mkdir("/d") is None
+            assert last_error().code == ErrorCode.DIR_EXISTS
+            assert self.fs.mkfile("/x/y") is None
+            assert last_error().code == ErrorCode.MISSING_PARENT
+            assert self.fs.read_file("/d/g") == ""
+            assert last_error().code == ErrorCode.FILE_NOT_FOUND
+            assert self.fs.write_file("/d/f", b"bytes") == False
+            assert last_error().code == ErrorCode.WRONG_CONTENTS_TYPE
+            assert self.fs.move_dir("/d", "/d/e") == False
+            assert last_error().code == ErrorCode.MOVE_INTO_ITSELF
+            assert self.fs.find_with_regex("f", "/missing") is None
+            assert last_error().code == ErrorCode.INVALID_PATH
+        # quiet: nothing is printed
+        assert out.getvalue() == ""
+
+    def test_name_and_message(self):
+        self.fs.copy_file("/d/f", "/d/g")
+        assert self.fs.copy_file("/d/f", "/d/g", "-n") == False
+        error = last_error()
+        assert error.code == ErrorCode.NAME_CONFLICT
+        assert error.name == "g"
+        assert str(error) == "g exists in dest, move aborted"
+
+    # Like errno: a success doesn't clear the last error
+    def test_sticky(self):
+        self.fs.remove_file("/d/missing")
+        assert self.fs.mkdir("/e") is not None
+        assert last_error().code == ErrorCode.FILE_NOT_FOUND
+        clear_error()
+        assert last_error() is None
+
+    def test_handler(self):
+        rh = self.fs.getFileHandlerFromPath("/d/f", is_write=False)
+        assert rh.move_cursor_abs(5) == False
+        assert last_error().code == ErrorCode.CURSOR_OUT_OF_BOUNDS
+        assert rh.seek_line(3) == False
+        assert last_error().code == ErrorCode.LINE_OUT_OF_BOUNDS
+
+    def test_snapshot(self):
+        snapshot = self.fs.snapshot("s")
+        assert snapshot.mkdir("/e") is None
+        assert last_error().code == ErrorCode.READ_ONLY
+        assert self.fs.restore("missing") == False
+        assert last_error().code == ErrorCode.SNAPSHOT_NOT_FOUND
+
+    def test_raise_errors(self):
+        fs = Filesystem(raise_errors=True)
+        with self.assertRaises(FsError) as raised:
+            fs.remove_dir("/missing")
+        assert raised.exception.code == ErrorCode.DIR_NOT_FOUND
+        assert raised.exception is last_error()
+        with self.assertRaises(FsError):
+            fs.snapshot().mkdir("/a")
+        # an atomic batch rolls back on the raised error
+        fs.mkdir("/a")
+        with self.assertRaises(FsError):
+            fs.batch([("mkdir", "/b"), ("mkdir", "/a")], atomic=True)
+        assert fs.list_folders() == ["a"]
+
+    # Handlers from a raising Filesystem raise too
+    def _raising_handler(self) -> tuple:
+        fs = Filesystem(raise_errors=True)
+        fs.mkfile("/f")
+        fs.write_file("/f", "one\ntwo")
+        wh = fs.getFileHandlerFromPath("/f", is_write=True)
+        wh.open()
+        self.addCleanup(wh.close)
+        return fs, wh
+
+    def test_raise_errors_cursor_abs(self):
+        fs, wh = self._raising_handler()
+        with self.assertRaises(FsError) as raised:
+            wh.move_cursor_abs(100)
+        assert raised.exception.code == ErrorCode.CURSOR_OUT_OF_BOUNDS
+        assert wh.cursor == 0
+
+    def test_raise_errors_cursor_rel(self):
+        fs, wh = self._raising_handler()
+        with self.assertRaises(FsError) as raised:
+            wh.move_cursor_rel(-1)
+        assert raised.exception.code == ErrorCode.CURSOR_OUT_OF_BOUNDS
+
+    def test_raise_errors_seek_line(self):
+        fs, wh = self._raising_handler()
+        with self.assertRaises(FsError) as raised:
+            wh.seek_line(5)
+        assert raised.exception.code == ErrorCode.LINE_OUT_OF_BOUNDS
+
+    def test_raise_errors_quota(self):
+        fs, wh = self._raising_handler()
+        fs.set_quota("/", max_bytes=10)
+        with self.assertRaises(FsError) as raised:
+            wh.concat("x" * 10)
+        assert raised.exception.code == ErrorCode.QUOTA_EXCEEDED
+        with self.assertRaises(FsError) as raised:
+            wh.insert("x" * 10)
+        assert raised.exception.code == ErrorCode.QUOTA_EXCEEDED
+        assert wh.file.contents == "one\ntwo"
+        # write_file raises as well, and doesn't leave the file locked
+        wh.close()
+        with self.assertRaises(FsError) as raised:
+            fs.write_file("/f", "x" * 20)
+        assert raised.exception.code == ErrorCode.QUOTA_EXCEEDED
+        assert fs.write_file("/f", "x") == True
+
+    # Each thread has its own last error
+    def test_threads(self):
+        self.fs.remove_dir("/missing")
+        errors = []
+        thread = threading.Thread(target=lambda: errors.append(last_error()))
+        thread.start()
+        thread.join()
+        assert errors == [None]
+        assert last_error().code == ErrorCode.DIR_NOT_FOUND
+
+    # Errors on the executor are passed back to the calling task
+    def test_async(self):
+        async def run():
+            afs = AsyncFilesystem(self.fs)
+            assert await afs.mkdir("/d") is None
+            return last_error()
+        assert asyncio.run(run()).code == ErrorCode.DIR_EXISTS
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+import contextlib
+import io
+import os
+import tarfile
+import tempfile
+import threading
+import unittest
+import zipfile
+from errors import ErrorCode, last_error
+from filesystem import Filesystem
+from simulator import Simulator
+
+
+# Writes only, like a pipe or socket: no seek/tell
+class Sink:
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def getvalue(self) -> bytes:
+        return b"".join(self.chunks)
+
+
+# Tests streaming export of a subtree to tar & zip archives
+class TestExport(unittest.TestCase):
+
+    def setUp(self):
+        self.fs = Filesystem()
+        self.fs.mkfile("/a/b/text.txt", "-p")
+        self.fs.write_file("/a/b/text.txt", "héllo\nwörld")
+        self.fs.mkfile("/a/bin", "", True)
+        self.fs.write_file("/a/bin", b"\xff\x00\x01")
+        self.fs.mkfile("/a/empty")
+        self.fs.mkdir("/a/c")
+        self.fs.mkfile("/top")
+
+    def check_tree(self, fs: Filesystem, prefix: str) -> None:
+        assert fs.read_file(prefix + "/b/text.txt") == "héllo\nwörld"
+        assert fs.read_file(prefix + "/bin") == b"\xff\x00\x01"
+        assert fs.read_file(prefix + "/empty") == ""
+        assert fs.get_directory(prefix + "/c") is not None
+
+    # Exported then imported back, the tree is the same
+    def test_tar_round_trip(self):
+        for compress in (False, True):
+            buffer = io.BytesIO()
+            # tiny chunks split the UTF-8 sequences
+            stats = self.fs.export("/a", buffer, compress=compress, chunk_size=3)
+            assert stats["files"] == 3
+            assert stats["dirs"] == 3
+            assert stats["bytes"] == 16
+            buffer.seek(0)
+            fs = Filesystem()
+            fs.import_tar(buffer, "/t")
+            self.check_tree(fs, "/t/a")
+
+    def test_tar_members(self):
+        buffer = io.BytesIO()
+        self.fs.export("/", buffer)
+        buffer.seek(0)
+        with tarfile.open(fileobj=buffer) as archive:
+            names = archive.getnames()
+            # parents come before their children
+            assert names.index("a") < names.index("a/b") < names.index("a/b/text.txt")
+            assert sorted(names) == ["a", "a/b", "a/b/text.txt", "a/bin", "a/c", "a/empty", "top"]
+            assert archive.getmember("a/c").isdir()
+            assert archive.extractfile("a/b/text.txt").read() == "héllo\nwörld".encode()
+
+    def test_zip(self):
+        for compress in (False, True):
+            buffer = io.BytesIO()
+            stats = self.fs.export("/a/", buffer, "zip", compress, chunk_size=3)
+            assert stats["files"] == 3
+            assert stats["bytes"] == 16
+            with zipfile.ZipFile(buffer) as archive:
+                assert archive.testzip() is None
+                assert sorted(archive.namelist()) == [
+                    "a/", "a/b/", "a/b/text.txt", "a/bin", "a/c/", "a/empty"]
+                assert archive.read("a/b/text.txt") == "héllo\nwörld".encode()
+                assert archive.read("a/bin") == b"\xff\x00\x01"
+
+    # Nothing is seeked: archives can be streamed to a pipe/socket
+    def test_unseekable(self):
+        sink = Sink()
+        self.fs.export("/a", sink, compress=True)
+        fs = Filesystem()
+        fs.import_tar(io.BytesIO(sink.getvalue()))
+        self.check_tree(fs, "/a")
+        sink = Sink()
+        self.fs.export("/a", sink, "zip")
+        with zipfile.ZipFile(io.BytesIO(sink.getvalue())) as archive:
+            assert archive.read("a/bin") == b"\xff\x00\x01"
+
+    # Larger than a chunk, text is sized in a first pass then streamed
+    def test_large_text(self):
+        text = "ünïcode line\n" * 1000
+        self.fs.write_file("/top", text)
+        buffer = io.BytesIO()
+        stats = self.fs.export("/", buffer, chunk_size=100)
+        buffer.seek(0)
+        with tarfile.open(fileobj=buffer) as archive:
+            assert archive.extractfile("top").read() == text.encode()
+        assert stats["bytes"] == 16 + len(text.encode())
+
+    def test_snapshot(self):
+        snapshot = self.fs.snapshot("s")
+        self.fs.write_file("/a/bin", b"new")
+        buffer = io.BytesIO()
+        assert snapshot.export("/a", buffer)["files"] == 3
+        buffer.seek(0)
+        fs = Filesystem()
+        fs.import_tar(buffer)
+        assert fs.read_file("/a/bin") == b"\xff\x00\x01"
+
+    def test_errors(self):
+        assert self.fs.export("/missing", io.BytesIO()) is None
+        assert last_error().code == ErrorCode.INVALID_PATH
+        with self.assertRaises(ValueError):
+            self.fs.export("/", io.BytesIO(), "rar")
+        # a file held by a writer in another thread
+        self.fs.lock_timeout = 0.01
+        wh = self.fs.getFileHandlerFromPath("/a/bin", True)
+        thread = threading.Thread(target=wh.open)
+        thread.start()
+        thread.join()
+        assert self.fs.export("/a", io.BytesIO()) is None
+        assert last_error().code == ErrorCode.FILE_BUSY
+        wh.close()
+        with tempfile.TemporaryFile() as f:
+            closed = open(f.fileno(), "rb", closefd=False)
+            assert self.fs.export("/a", closed) is None
+            assert last_error().code == ErrorCode.EXPORT_FAILED
+            closed.close()
+
+    def test_simulator(self):
+        simulator = Simulator()
+        simulator.filesystem = self.fs
+        with tempfile.TemporaryDirectory() as directory:
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out), contextlib.redirect_stderr(io.StringIO()):
+                simulator.run_script(io.StringIO(
+                    "export /a " + os.path.join(directory, "a.zip") + "\n"
+                    "export /a " + os.path.join(directory, "a.tgz") + "\n"
+                    "export /missing " + os.path.join(directory, "m.tar") + "\n"))
+            lines = out.getvalue().splitlines()
+            assert lines[0].startswith("Exported 3 files, 3 dirs")
+            assert lines[1].startswith("Exported 3 files, 3 dirs")
+            assert lines[2] == ErrorCode.INVALID_PATH.value
+            assert zipfile.is_zipfile(os.path.join(directory, "a.zip"))
+            with tarfile.open(os.path.join(directory, "a.tgz"), "r:gz") as archive:
+                assert "a/bin" in archive.getnames()
+            assert not os.path.exists(os.path.join(directory, "m.tar"))
+
+
+if __name__ == '__main__':
+    unittest.main()
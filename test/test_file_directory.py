@@ -310,5 +310,205 @@ class TestFileDirectory(unittest.TestCase):
         self.fs.copy_file("/d1/d2/file", "file2")
         assert self.fs.list_files() == ["file", "file2"]
 
+    # *** Path cache ***
+    def test_path_cache_hits(self):
+        self.fs.mkdir("/d1/d2/d3", "-p")
+        self.fs.changedir("/d1/d2/d3")
+        hits = self.fs.path_cache.hits
+        self.fs.changedir("/")
+        self.fs.changedir("/d1/d2/d3")
+        self.fs.mkfile("/d1/d2/d3/file")
+        assert self.fs.path_cache.hits == hits + 2
+        assert self.fs.get_current_path() == "/d1/d2/d3"
+
+    # removed dirs must not be served from the cache
+    def test_path_cache_remove_dir(self):
+        self.fs.mkdir("/d1/d2/d3", "-p")
+        assert self.fs.changedir("/d1/d2/d3") == True
+        self.fs.changedir("/")
+        self.fs.remove_dir("/d1/d2")
+        assert self.fs.changedir("/d1/d2/d3") == False
+        # recreate it, the new dir is the one returned
+        self.fs.mkdir("/d1/d2/d3", "-p")
+        self.fs.changedir("/d1/d2/d3")
+        self.fs.mkfile("file")
+        assert self.fs.find_with_regex("file", "/", "-r") == (["/d1/d2/d3/file"], [])
+
+    # missing paths are cached until a directory is created
+    def test_path_cache_negative(self):
+        assert self.fs.mkfile("/d1/d2/file") is None
+        misses = self.fs.path_cache.misses
+        assert self.fs.mkfile("/d1/d2/file") is None
+        assert self.fs.path_cache.misses == misses
+        # -p must still create through a cached miss
+        assert self.fs.mkfile("/d1/d2/file", "-p") is not None
+        self.fs.remove_dir("/d1/d2")
+        assert self.fs.changedir("/d1/d2") == False
+        self.fs.mkdir("/d1/d2")
+        assert self.fs.changedir("/d1/d2") == True
+
+    # relative paths with ".." still fail on a missing dir
+    def test_path_cache_parent_of_missing(self):
+        self.fs.mkdir("d1")
+        assert self.fs.changedir("missing/../d1") == False
+        assert self.fs.changedir("d1/../d1") == True
+        assert self.fs.get_current_path() == "/d1"
+
+    def test_path_cache_bounded(self):
+        self.fs.path_cache.capacity = 8
+        for i in range(20):
+            self.fs.mkdir("/d" + str(i) + "/sub", "-p")
+            self.fs.changedir("/d" + str(i) + "/sub")
+        assert self.fs.path_cache.stats()["entries"] <= 8
+
+    # *** Lazy paths ***
+    # Moving a folder relinks it; every descendant sees the new path
+    def test_move_dir_paths(self):
+        self.fs.mkfile("/d1/d2/d3/file", "-p")
+        self.fs.changedir("/d1/d2/d3")
+        assert self.fs.get_current_path() == "/d1/d2/d3"
+        d2 = self.fs.root.get_subfolder("d1").get_subfolder("d2")
+        self.fs._move_dir_with_override(d2, self.fs.root, "moved", False)
+        # cwd moved along with its folder
+        assert self.fs.get_current_path() == "/moved/d3"
+        assert self.fs.find_with_regex("file", "/", "-r") == (["/moved/d3/file"], [])
+        assert [p for p, _ in self.fs.root.walk()] == \
+            ["/d1", "/moved", "/moved/d3", "/moved/d3/file"]
+        assert self.fs.changedir("/d1/d2") == False
+        assert self.fs.changedir("/moved/d3") == True
+
+    # memos are optional, paths are the same without them
+    def test_paths_without_memo(self):
+        Directory.memoize_paths = False
+        try:
+            self.fs.mkdir("/a/b/c", "-p")
+            self.fs.changedir("/a/b/c")
+            assert self.fs.get_current_path() == "/a/b/c"
+            assert self.fs.current_dir._path_memo is None
+        finally:
+            Directory.memoize_paths = True
+
+    # *** Move / Copy directories ***
+    def test_mvdir_simple(self):
+        self.fs.mkfile("/d1/d2/file", "-p")
+        assert self.fs.move_dir("/d1/d2", "/") == True
+        assert self.fs.list_folders() == ["d1", "d2"]
+        assert self.fs.find_with_regex("file", "/", "-r") == (["/d2/file"], [])
+
+    def test_mvdir_rename(self):
+        self.fs.mkdir("d1")
+        self.fs.mkfile("d1/file")
+        self.fs.move_dir("d1", "d2")
+        assert self.fs.list_folders() == ["d2"]
+        self.fs.changedir("d2")
+        assert self.fs.list_files() == ["file"]
+
+    def test_mvdir_into_itself(self):
+        self.fs.mkdir("/d1/d2", "-p")
+        assert self.fs.move_dir("/d1", "/d1/d2/") == False
+        assert self.fs.move_dir("/d1", "/d1/") == False
+        assert self.fs.list_folders() == ["d1"]
+
+    def test_mvdir_fail(self):
+        self.fs.mkdir("d1")
+        # no source name, missing source, missing dest
+        assert self.fs.move_dir("d1/", "/x") == False
+        assert self.fs.move_dir("missing", "/x") == False
+        assert self.fs.move_dir("d1", "/a/b/") == False
+        # -p creates the dest parents
+        assert self.fs.move_dir("d1", "/a/b/", "-p") == True
+        assert self.fs.changedir("/a/b/d1") == True
+
+    def test_mvdir_override_backup_no_override(self):
+        self.fs.mkfile("/src/d/new", "-p")
+        self.fs.mkfile("/d/old", "-p")
+        # -n keeps the existing dir
+        assert self.fs.move_dir("/src/d", "/", "-n") == False
+        # -b keeps a backup of the existing dir
+        assert self.fs.move_dir("/src/d", "/", "-b") == True
+        assert sorted(self.fs.list_folders()) == ["d", "src", "~d"]
+        assert self.fs.find_with_regex("old|new", "/", "-r") == \
+            (["/d/new", "/~d/old"], [])
+        # default overrides
+        self.fs.mkdir("/src/d")
+        assert self.fs.move_dir("/src/d", "/") == True
+        assert self.fs.find_with_regex("new", "/", "-r") == ([], [])
+
+    def test_cpdir_simple(self):
+        self.fs.mkfile("/d1/d2/file", "-p")
+        self.fs.write_file("/d1/d2/file", "contents")
+        assert self.fs.copy_dir("/d1", "/copy") == True
+        assert self.fs.read_file("/copy/d2/file") == "contents"
+        assert sorted(self.fs.find_with_regex("file", "/", "-r")[0]) == \
+            ["/copy/d2/file", "/d1/d2/file"]
+
+    # Copies share the tree until one side changes
+    def test_cpdir_is_copy_on_write(self):
+        self.fs.mkfile("/src/a/b/file", "-p")
+        self.fs.write_file("/src/a/b/file", "v1")
+        self.fs.copy_dir("/src", "/dst")
+        dst = self.fs.root.get_subfolder("dst")
+        assert dst.is_lazy
+        # change the source deep down, the copy keeps the old tree
+        self.fs.write_file("/src/a/b/file", "v2")
+        self.fs.mkfile("/src/a/b/new")
+        self.fs.remove_dir("/src/a/b")
+        assert self.fs.read_file("/dst/a/b/file") == "v1"
+        self.fs.changedir("/dst/a/b")
+        assert self.fs.list_files() == ["file"]
+        # change the copy, the source doesn't see it
+        self.fs.write_file("/dst/a/b/file", "v3", "-c")
+        self.fs.mkfile("/dst/a/only_in_copy")
+        assert self.fs.read_file("/dst/a/b/file") == "v1v3"
+        self.fs.changedir("/src/a")
+        assert self.fs.list_files() == []
+        assert self.fs.list_folders() == []
+
+    # A write handler opened before the copy must not leak into the copy
+    def test_cpdir_open_handler(self):
+        self.fs.mkfile("/src/file", "-p")
+        wh = self.fs.getFileHandlerFromPath("/src/file", is_write=True)
+        wh.open()
+        wh.write("before")
+        self.fs.copy_dir("/src", "/dst")
+        wh.insert(" after")
+        wh.close()
+        assert self.fs.read_file("/src/file") == "before after"
+        assert self.fs.read_file("/dst/file") == "before"
+
+    def test_cpdir_into_itself_and_chained(self):
+        self.fs.mkfile("/a/b/file", "-p")
+        assert self.fs.copy_dir("/a", "/a/b/") == True
+        assert sorted(self.fs.find_with_regex("file", "/", "-r")[0]) == \
+            ["/a/b/a/b/file", "/a/b/file"]
+        # copy of a copy, then change the middle one
+        self.fs.copy_dir("/a", "/c1")
+        self.fs.copy_dir("/c1", "/c2")
+        self.fs.write_file("/c1/b/file", "changed")
+        assert self.fs.read_file("/c2/b/file") == ""
+        assert self.fs.read_file("/a/b/file") == ""
+        assert self.fs.read_file("/c1/b/file") == "changed"
+
+    def test_cpdir_backup(self):
+        self.fs.mkfile("/src/d/file", "-p")
+        self.fs.write_file("/src/d/file", "new")
+        self.fs.mkfile("/d/file", "-p")
+        self.fs.write_file("/d/file", "old")
+        self.fs.copy_dir("/src/d", "/", "-b")
+        assert self.fs.read_file("/d/file") == "new"
+        assert self.fs.read_file("/~d/file") == "old"
+        assert self.fs.read_file("/src/d/file") == "new"
+
+    # A removed copy can still back another copy; materializing it later
+    # must not put its (unlinked) children back in the name index
+    def test_cpdir_removed_backing(self):
+        self.fs.mkfile("/a/file_x", "-p")
+        self.fs.copy_dir("/a", "/b")
+        self.fs.copy_dir("/b", "/c")
+        self.fs.remove_dir("/b")
+        self.fs.write_file("/c/file_x", "c")
+        assert self.fs.find_with_regex("file_x", "/", "-r") == \
+            (["/a/file_x", "/c/file_x"], [])
+
 if __name__ == '__main__':
     unittest.main()
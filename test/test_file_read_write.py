@@ -50,6 +50,42 @@ class TestFileReadWrite(unittest.TestCase):
         assert (rh.read_line() == "")
         rh.close()
     
+    def test_seek_line(self):
+        self.fs.mkfile("f")
+        self.fs.write_file("f", "line1\nline2\nline3")
+        rh = self.fs.getFileHandlerFromPath("f", is_write=False)
+        rh.open()
+        assert (rh.line_count() == 3)
+        assert (rh.seek_line(2) == True)
+        assert (rh.read_line() == "line3")
+        assert (rh.seek_line(1) == True)
+        assert (rh.read_to_end() == "line2\nline3")
+        # out of bounds
+        assert (rh.seek_line(3) == False)
+        assert (rh.seek_line(-1) == False)
+        rh.close()
+
+    # line index stays correct across writes through a handler
+    def test_seek_line_after_insert(self):
+        self.fs.mkfile("f")
+        wh = self.fs.getFileHandlerFromPath("f", is_write=True)
+        wh.open()
+        rh = self.fs.getFileHandlerFromPath("f", is_write=False)
+        rh.open()
+        wh.write("a\nc\n")
+        assert (rh.line_count() == 2)
+        wh.seek_line(1)
+        wh.insert("b\n")
+        assert (rh.line_count() == 3)
+        rh.seek_line(1)
+        assert (rh.read_line() == "b\n")
+        wh.concat("d")
+        assert (rh.line_count() == 4)
+        rh.seek_line(3)
+        assert (rh.read_line() == "d")
+        wh.close()
+        rh.close()
+
     def test_read_next(self):
         self.fs.mkfile("f")
         self.fs.write_file("f", "line1\nline2\nline3")
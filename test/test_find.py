@@ -1,5 +1,8 @@
+import random
+import re
 import unittest
 from filesystem import *
+from name_index import required_literals
 
 
 # Tests the find operation
@@ -82,5 +85,139 @@ class TestFind(unittest.TestCase):
         assert sorted(files) == ["/applez"]
         assert sorted(folders) == []
 
+    # *** Tree walk ***
+    def _build_walk_tree(self):
+        # / -> f0, a, b
+        # /a -> f1, c
+        self.fs.mkfile("f0")
+        self.fs.mkdir("a")
+        self.fs.mkdir("b")
+        self.fs.mkfile("a/f1")
+        self.fs.mkdir("a/c")
+
+    def test_walk_pre_order(self):
+        self._build_walk_tree()
+        paths = [p for p, _ in self.fs.root.walk()]
+        assert paths == ["/f0", "/a", "/a/f1", "/a/c", "/b"]
+
+    def test_walk_post_order(self):
+        self._build_walk_tree()
+        paths = [p for p, _ in self.fs.root.walk(order="post")]
+        assert paths == ["/f0", "/a/f1", "/a/c", "/a", "/b"]
+
+    def test_walk_prune(self):
+        self._build_walk_tree()
+        paths = [p for p, _ in self.fs.root.walk(
+            prune=lambda path, d: path == "/a")]
+        assert paths == ["/f0", "/a", "/b"]
+
+    # walk doesn't recurse, so very deep trees are fine
+    def test_walk_deep_tree(self):
+        self.fs.mkdir("/".join(["d"] * 3000), "-p")
+        self.fs.mkfile("/".join(["d"] * 3000) + "/name")
+        files, folders = self.fs.find_with_regex("name", "/", "-r")
+        assert files == ["/" + "/".join(["d"] * 3000) + "/name"]
+        assert len(folders) == 0
+
+    # find_iter is lazy, callers can stop after the first match
+    def test_find_iter_stop_early(self):
+        self.fs.mkdir("a/b", "-p")
+        self.fs.mkfile("a/name1")
+        self.fs.mkfile("a/b/name2")
+        it = self.fs.find_iter("name", "/", "-r")
+        path, node = next(it)
+        assert path == "/a/name1"
+        assert node.name == "name1"
+
+    # *** Name index ***
+    def test_required_literals(self):
+        assert required_literals(re.compile("name[0-9]+")) == ["name"]
+        assert required_literals(re.compile("a[a-z]*z")) == ["a", "z"]
+        assert required_literals(re.compile("^ab(cd)e.*xyz")) == ["abcde", "xyz"]
+        assert required_literals(re.compile("(?i)abc")) == []
+        assert required_literals(re.compile("a|b")) == []
+        assert required_literals(re.compile(r"ab+c\.txt")) == ["ab", "c.txt"]
+        assert required_literals(re.compile(r"ab*c{0,2}d{2}e")) == ["a", "d", "e"]
+        assert required_literals(re.compile(r"(?:abc)?de(?P<n>fg)h(x|y)z")) == ["defgh", "z"]
+        assert required_literals(re.compile(r"ab(?=cd)ef\x41gh\d[]x]ij")) == ["ab", "ef", "gh", "ij"]
+        assert required_literals(re.compile(r"a{b}\bc(?i:de)")) == ["a{b}c"]
+        assert required_literals(re.compile(r"abc", re.VERBOSE)) == []
+
+    # Every literal found is in every name the pattern matches
+    def test_required_literals_sound(self):
+        rng = random.Random(3)
+        atoms = ["a", "b", "ab", ".", "[ab]", "(ab)", "(?:a|b)", "(?=a)", "\\d", "\\.", "^", "$"]
+        names = ["".join(rng.choice("ab1.") for _ in range(rng.randrange(8))) for _ in range(300)]
+        for _ in range(500):
+            regex = "".join(rng.choice(atoms) + rng.choice(["", "", "*", "+", "?", "{2}", "{0,1}"])
+                            for _ in range(rng.randrange(1, 6)))
+            try:
+                pattern = re.compile(regex)
+            except re.error:
+                continue
+            literals = required_literals(pattern)
+            for name in names:
+                match = pattern.match(name)
+                if match is not None:
+                    for literal in literals:
+                        assert literal in match.group(0), (regex, name, literals)
+
+    # Indexed answers must match a plain walk of the tree
+    def _find_by_walk(self, regex, path):
+        files, folders = [], []
+        dir_list, is_absolute = parse_path(path)
+        start = self.fs._walk_dir_path_absolute_or_relative(dir_list, is_absolute)
+        for match_path, node in self.fs._find_under(re.compile(regex), start, "-r"):
+            (files if isinstance(node, File) else folders).append(match_path)
+        return sorted(files), sorted(folders)
+
+    def test_index_matches_walk(self):
+        rng = random.Random(7)
+        names = ["alpha", "alphabet", "beta", "gamma1", "gamma22", "delta"]
+        dirs = ["/"]
+        for _ in range(300):
+            parent = rng.choice(dirs)
+            path = parent.rstrip("/") + "/" + rng.choice(names)
+            if rng.random() < 0.4:
+                if self.fs.mkdir(path) is not None:
+                    dirs.append(path)
+            else:
+                self.fs.mkfile(path)
+        # remove and move things around so the index has to keep up
+        for d in rng.sample(dirs[1:], 5):
+            self.fs.remove_dir(d)
+        for _, f in list(self.fs.find_iter("alpha", "/", "-r")):
+            if isinstance(f, File):
+                self.fs.move_file(f.get_path(), "/", "-b")
+        for regex in ["alpha", "gamma[0-9]+", "al.*bet", "bet", "ga", "de.*"]:
+            for path in ["/", "/alpha", "/beta"]:
+                if self.fs.find_with_regex(regex, path, "-r") is None:
+                    continue
+                files, folders = self.fs.find_with_regex(regex, path, "-r")
+                assert (sorted(files), sorted(folders)) == \
+                    self._find_by_walk(regex, path)
+
+    # -r results come in the same order whether the index is used or not
+    def test_index_and_walk_same_order(self):
+        for path in ["/z/a/file1", "/b/file2", "/b/a/file3", "/file4", "/a/z/file5"]:
+            self.fs.mkfile(path, "-p")
+        self.fs.mkdir("/c/file6", "-p")
+        indexed = self.fs.find_with_regex("file[0-9]", "/", "-r")
+        assert self.fs._find_indexed(re.compile("file[0-9]"), self.fs.root) is not None
+        # no literal text, walked
+        walked = self.fs.find_with_regex("f.le[0-9]", "/", "-r")
+        assert self.fs._find_indexed(re.compile("f.le[0-9]"), self.fs.root) is None
+        assert indexed == walked
+        assert indexed[0] == ["/a/z/file5", "/b/a/file3", "/b/file2", "/file4", "/z/a/file1"]
+        assert indexed[1] == ["/c/file6"]
+        assert self.fs.find_with_regex("(file|xx)[0-9]", "/", "-r") == walked
+
+    def test_index_forgets_removed(self):
+        self.fs.mkdir("a/b", "-p")
+        self.fs.mkfile("a/b/target")
+        self.fs.remove_dir("a")
+        assert self.fs.find_with_regex("target", "/", "-r") == ([], [])
+        assert len(self.fs.name_index) == 0
+
 if __name__ == '__main__':
     unittest.main()
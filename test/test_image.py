@@ -0,0 +1,116 @@
+import os
+import tempfile
+import unittest
+from filesystem import *
+from image import MappedStore
+
+
+# Tests saving & loading binary images
+class TestImage(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "fs.img")
+        self.fs = Filesystem()
+        self.fs.mkfile("/d1/d2/file", "-p")
+        self.fs.write_file("/d1/d2/file", "line1\nline2")
+        self.fs.mkfile("/d1/ünï")
+        self.fs.write_file("/d1/ünï", "ça va ✓")
+        self.fs.mkfile("/empty")
+        self.fs.mkdir("/d3")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_round_trip(self):
+        assert self.fs.save(self.path) == True
+        fs = Filesystem.load(self.path)
+        assert fs.read_file("/d1/d2/file") == "line1\nline2"
+        assert fs.read_file("/d1/ünï") == "ça va ✓"
+        assert fs.read_file("/empty") == ""
+        assert sorted(fs.list_folders()) == ["d1", "d3"]
+        assert fs.find_with_regex("file", "/", "-r") == (["/d1/d2/file"], [])
+        rh = fs.getFileHandlerFromPath("/d1/d2/file", is_write=False)
+        rh.open()
+        assert rh.line_count() == 2
+        rh.seek_line(1)
+        assert rh.read_line() == "line2"
+        rh.close()
+
+    # Nothing is read until it's touched
+    def test_load_is_lazy(self):
+        self.fs.save(self.path)
+        fs = Filesystem.load(self.path)
+        assert fs.root.is_lazy
+        fs.changedir("/d1")
+        assert not fs.root.is_lazy
+        assert fs.root.get_subfolder("d3").is_lazy
+        store = fs.current_dir.get_file("ünï").store
+        assert isinstance(store, MappedStore) and not store.is_loaded
+        # length is known without decoding
+        assert len(store) == 7
+        assert not store.is_loaded
+        assert fs.read_file("ünï") == "ça va ✓"
+        assert store.is_loaded
+
+    def test_modify_after_load(self):
+        self.fs.save(self.path)
+        fs = Filesystem.load(self.path)
+        fs.write_file("/d1/d2/file", "!", "-c")
+        fs.write_file("/d1/ünï", "new")
+        fs.move_dir("/d1", "/d3/")
+        fs.mkfile("/d3/d1/d2/other")
+        assert fs.read_file("/d3/d1/d2/file") == "line1\nline2!"
+        assert fs.read_file("/d3/d1/ünï") == "new"
+        assert fs.find_with_regex("other", "/", "-r") == (["/d3/d1/d2/other"], [])
+        # save over the image it was loaded from, then load it again
+        assert fs.save(self.path) == True
+        fs2 = Filesystem.load(self.path)
+        assert fs2.read_file("/d3/d1/d2/file") == "line1\nline2!"
+        # the first load still reads the old mapping
+        assert fs.read_file("/empty") == ""
+
+    # Copy-on-write copies are written once
+    def test_shared_contents_written_once(self):
+        self.fs.write_file("/empty", "x" * 10000)
+        for i in range(5):
+            self.fs.copy_file("/empty", "/copy" + str(i))
+        self.fs.copy_dir("/d1", "/d1copy")
+        self.fs.save(self.path)
+        assert os.path.getsize(self.path) < 11000
+        fs = Filesystem.load(self.path)
+        assert fs.read_file("/copy4") == "x" * 10000
+        assert fs.read_file("/d1copy/d2/file") == "line1\nline2"
+
+    def test_load_invalid(self):
+        assert Filesystem.load(os.path.join(self.tmp.name, "missing")) is None
+        with open(self.path, "wb") as f:
+            f.write(b"not an image")
+        assert Filesystem.load(self.path) is None
+        with self.assertRaises(FsError) as raised:
+            Filesystem.load(self.path, raise_errors=True)
+        assert raised.exception.code == ErrorCode.INVALID_IMAGE
+
+    # The options of a new Filesystem apply to a loaded one
+    def test_load_options(self):
+        self.fs.save(self.path)
+        fs = Filesystem.load(self.path, raise_errors=True, dedup=True)
+        assert fs.raise_errors == True
+        with self.assertRaises(FsError):
+            fs.read_file("/missing")
+        fs.copy_file("/d1/d2/file", "/")
+        fs.write_file("/file", "same")
+        fs.write_file("/d1/d2/file", "same")
+        assert fs.dedup_stats()["blobs"] == 1
+
+    def test_load_with_string_store(self):
+        self.fs.save(self.path)
+        fs = Filesystem.load(self.path, content_store=StringStore)
+        fs.write_file("/d1/d2/file", "x", "-c")
+        assert fs.read_file("/d1/d2/file") == "line1\nline2x"
+        assert isinstance(fs.current_dir.get_subfolder("d1").get_subfolder(
+            "d2").get_file("file").store._store, StringStore)
+
+
+if __name__ == '__main__':
+    unittest.main()
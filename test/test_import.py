@@ -0,0 +1,135 @@
+import contextlib
+import io
+import os
+import tarfile
+import tempfile
+import unittest
+from errors import ErrorCode, last_error
+from filesystem import Filesystem
+from simulator import Simulator
+
+
+# Tests bulk import from host directory trees & tar archives
+class TestImport(unittest.TestCase):
+
+    def setUp(self):
+        self.fs = Filesystem()
+        self.host = tempfile.TemporaryDirectory()
+        self.root = self.host.name
+        os.makedirs(os.path.join(self.root, "a", "b"))
+        os.makedirs(os.path.join(self.root, "empty"))
+        self.write("a/b/text.txt", "héllo\nwörld".encode())
+        self.write("a/bin", b"\xff\x00\x01")
+        self.write("top", b"")
+
+    def tearDown(self):
+        self.host.cleanup()
+
+    def write(self, path: str, data: bytes) -> None:
+        with open(os.path.join(self.root, path), "wb") as f:
+            f.write(data)
+
+    def tar(self, mode: str = "w") -> io.BytesIO:
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode=mode) as archive:
+            archive.add(self.root, arcname=".")
+        buffer.seek(0)
+        return buffer
+
+    def check_tree(self, prefix: str) -> None:
+        assert self.fs.read_file(prefix + "/a/b/text.txt") == "héllo\nwörld"
+        assert self.fs.read_file(prefix + "/a/bin") == b"\xff\x00\x01"
+        assert self.fs.read_file(prefix + "/top") == ""
+        assert self.fs.get_directory(prefix + "/empty") is not None
+
+    def test_import_tree(self):
+        # tiny chunks split the UTF-8 sequences
+        stats = self.fs.import_tree(self.root, "/x/y", chunk_size=3)
+        self.check_tree("/x/y")
+        assert stats["files"] == 3
+        assert stats["dirs"] == 3
+        assert stats["bytes"] == 16
+        assert stats["files_per_sec"] > 0 and stats["mb_per_sec"] > 0
+        # indexed like any other file
+        assert self.fs.find_with_regex("text", "/", "-r")[0] == ["/x/y/a/b/text.txt"]
+
+    # Invalid UTF-8 after the first chunks turns the file binary
+    def test_late_binary(self):
+        self.write("late", b"abcdef\xff")
+        self.fs.import_tree(self.root, chunk_size=2)
+        assert self.fs.read_file("/late") == b"abcdef\xff"
+        # cut in the middle of a sequence at the end
+        self.write("cut", "é".encode()[:1])
+        self.fs.import_tree(self.root)
+        assert self.fs.read_file("/cut") == b"\xc3"
+
+    # Folders merge, files are replaced
+    def test_merge(self):
+        self.fs.mkfile("/a/keep", "-p")
+        self.fs.mkfile("/a/bin")
+        self.fs.write_file("/a/bin", "old")
+        stats = self.fs.import_tree(self.root)
+        assert sorted(self.fs.get_directory("/a").files) == ["bin", "keep"]
+        assert self.fs.read_file("/a/bin") == b"\xff\x00\x01"
+        assert stats["dirs"] == 2
+
+    def test_symlinks_skipped(self):
+        os.symlink(os.path.join(self.root, "a"), os.path.join(self.root, "link"))
+        stats = self.fs.import_tree(self.root)
+        assert stats["skipped"] == 1
+        assert self.fs.get_directory("/link") is None
+
+    def test_import_tar(self):
+        for mode in ("w", "w:gz"):
+            fs = self.fs = Filesystem()
+            stats = fs.import_tar(self.tar(mode), "/t")
+            self.check_tree("/t")
+            assert stats["files"] == 3
+
+    # Members are named by path only; missing folders are implied,
+    # and paths leaving the destination are skipped
+    def test_tar_paths(self):
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w") as archive:
+            for name in ("deep/er/f", "../escape", "/abs/g"):
+                info = tarfile.TarInfo(name)
+                info.size = 2
+                archive.addfile(info, io.BytesIO(b"hi"))
+        buffer.seek(0)
+        stats = self.fs.import_tar(buffer, "/t")
+        assert self.fs.read_file("/t/deep/er/f") == "hi"
+        assert self.fs.read_file("/t/abs/g") == "hi"
+        assert stats["skipped"] == 1
+        assert self.fs.get_directory("/escape") is None
+
+    def test_errors(self):
+        assert self.fs.import_tree(os.path.join(self.root, "missing")) is None
+        assert last_error().code == ErrorCode.HOST_PATH_NOT_FOUND
+        assert self.fs.import_tar(io.BytesIO(b"not a tar" * 100)) is None
+        assert last_error().code == ErrorCode.INVALID_ARCHIVE
+        assert self.fs.import_tree(self.root, "../..") is None
+        assert last_error().code == ErrorCode.INVALID_PATH
+        assert self.fs.snapshot("s").import_tree(self.root) is None
+        assert last_error().code == ErrorCode.READ_ONLY
+
+    # With a journal the import is checkpointed
+    def test_journal(self):
+        with tempfile.TemporaryDirectory() as directory:
+            fs = Filesystem.recover(directory)
+            fs.import_tar(self.tar(), "/t")
+            fs.close()
+            self.fs = Filesystem.recover(directory)
+            self.check_tree("/t")
+            self.fs.close()
+
+    def test_simulator(self):
+        simulator = Simulator()
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(io.StringIO()):
+            simulator.run_script(io.StringIO("import " + self.root + " /imp\n"))
+        assert out.getvalue().startswith("Imported 3 files, 3 dirs")
+        assert simulator.filesystem.read_file("/imp/a/bin") == b"\xff\x00\x01"
+
+
+if __name__ == '__main__':
+    unittest.main()
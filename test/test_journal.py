@@ -0,0 +1,155 @@
+import os
+import tempfile
+import threading
+import unittest
+from filesystem import *
+from journal import list_generations, journal_path
+
+
+# Tests the write-ahead journal, replay and checkpoints
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def recover(self, **options) -> Filesystem:
+        options.setdefault("fsync", False)
+        return Filesystem.recover(self.dir, **options)
+
+    # A tree built through every journaled operation
+    def build(self, fs: Filesystem) -> None:
+        fs.mkfile("/a/b/file", "-p")
+        fs.write_file("/a/b/file", "hello")
+        fs.write_file("/a/b/file", "world", "-a")
+        fs.mkdir("/c")
+        fs.copy_dir("/a", "/c/")
+        fs.move_file("/a/b/file", "/c/renamed")
+        fs.copy_file("/c/renamed", "/c/a/b/file", "-b")
+        fs.mkfile("/gone")
+        fs.remove_file("/gone")
+        fs.mkdir("/d")
+        fs.move_dir("/d", "/c/d")
+        fs.remove_dir("/a")
+        wh = fs.getFileHandlerFromPath("/c/renamed", is_write=True)
+        wh.open()
+        wh.move_cursor_abs(5)
+        wh.insert(",")
+        wh.close()
+        fs.changedir("/c/a")
+
+    def check(self, fs: Filesystem) -> None:
+        assert fs.get_current_path() == "/c/a"
+        assert fs.read_file("/c/renamed") == "hello,\nworld"
+        assert fs.read_file("/c/a/b/file") == "hello\nworld"
+        assert fs.read_file("/c/a/b/~file") == "hello\nworld"
+        files, folders = fs.find_with_regex(".*", "/", "-r")
+        assert sorted(files) == ["/c/a/b/file", "/c/a/b/~file", "/c/renamed"]
+        assert sorted(folders) == ["/c", "/c/a", "/c/a/b", "/c/d"]
+
+    def test_replay(self):
+        fs = self.recover()
+        self.build(fs)
+        fs.close()
+        self.check(self.recover())
+
+    # Without close, sync mode records are already on disk
+    def test_replay_without_close(self):
+        fs = self.recover(sync=True)
+        self.build(fs)
+        self.check(self.recover())
+
+    def test_failed_ops_not_logged(self):
+        fs = self.recover()
+        assert fs.mkdir("/x/y") is None
+        assert fs.remove_file("/missing") == False
+        assert fs.changedir("/missing") == False
+        fs.close()
+        assert fs.journal is None
+        assert os.path.getsize(journal_path(self.dir, 0)) == 0
+
+    def test_torn_tail(self):
+        fs = self.recover()
+        fs.mkdir("/kept")
+        fs.close()
+        path = journal_path(self.dir, 0)
+        size = os.path.getsize(path)
+        with open(path, "ab") as f:
+            f.write(b"\x20\x00\x00\x00garbage")
+        fs = self.recover()
+        assert fs.list_folders() == ["kept"]
+        # the torn record was cut off, new records replay fine
+        assert os.path.getsize(path) == size
+        fs.mkdir("/after")
+        fs.close()
+        assert self.recover().list_folders() == ["kept", "after"]
+
+    def test_checkpoint(self):
+        fs = self.recover()
+        self.build(fs)
+        assert fs.checkpoint() == True
+        # logged to the new journal, relative to the current dir
+        fs.remove_dir("../d")
+        fs.mkdir("../d")
+        fs.close()
+        assert list_generations(self.dir) == ([1], [1])
+        self.check(self.recover())
+
+    def test_auto_checkpoint(self):
+        fs = self.recover(checkpoint_every=10)
+        for i in range(35):
+            fs.mkdir("/d" + str(i))
+        fs.close()
+        checkpoints, journals = list_generations(self.dir)
+        assert len(checkpoints) == 1 and checkpoints[0] >= 1
+        assert len(self.recover().list_folders()) == 35
+
+    def test_restore_checkpoints(self):
+        fs = self.recover()
+        fs.mkdir("/before")
+        snap = fs.snapshot()
+        fs.mkdir("/after")
+        assert fs.restore(snap) == True
+        fs.close()
+        assert self.recover().list_folders() == ["before"]
+
+    # One fsync covers many records
+    def test_group_commit_by_count(self):
+        fs = self.recover(sync=False, batch_size=10, batch_delay=60)
+        for i in range(100):
+            fs.mkdir("/d" + str(i))
+        fs.journal.flush()
+        assert fs.journal.records == 100
+        assert fs.journal.batches <= 11
+        fs.close()
+
+    def test_group_commit_threads(self):
+        fs = self.recover(sync=True, batch_delay=0.002)
+
+        def work(t):
+            for i in range(50):
+                fs.mkdir("/t%d_%d" % (t, i))
+        threads = [threading.Thread(target=work, args=(t,)) for t in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert fs.journal.records == 200
+        assert fs.journal.batches < 200
+        fs.close()
+        assert len(self.recover().list_folders()) == 200
+
+    def test_image_checkpoint_is_lazy(self):
+        fs = self.recover()
+        fs.mkfile("/a/file", "-p")
+        fs.checkpoint()
+        fs.close()
+        fs = self.recover()
+        assert fs.root.get_subfolder("a").is_lazy
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,194 @@
+import threading
+import time
+import unittest
+from filesystem import *
+from locks import RWLock
+
+
+# Runs fn(i) on n threads at once and waits for all of them
+def run_threads(n: int, fn) -> list:
+    results = [None] * n
+    barrier = threading.Barrier(n)
+
+    def target(i):
+        barrier.wait()
+        results[i] = fn(i)
+    threads = [threading.Thread(target=target, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+# Tests RW locks on files and thread safety of Filesystem
+class TestLocking(unittest.TestCase):
+
+    def setUp(self):
+        self.fs = Filesystem()
+        self.fs.mkfile("f")
+
+    # *** RWLock ***
+    def test_rwlock_many_readers_one_writer(self):
+        lock = RWLock()
+        assert lock.acquire_read(owner=1)
+        assert lock.acquire_read(owner=2)
+        assert lock.acquire_write(blocking=False, owner=3) == False
+        assert lock.acquire_write(timeout=0.01, owner=3) == False
+        lock.release_read(owner=1)
+        lock.release_read(owner=2)
+        assert lock.acquire_write(blocking=False, owner=3)
+        assert lock.acquire_read(blocking=False, owner=1) == False
+        # a writer can also read
+        assert lock.acquire_read(blocking=False, owner=3)
+        lock.release_read(owner=3)
+        lock.release_write(owner=3)
+        assert lock.acquire_read(blocking=False, owner=1)
+
+    def test_rwlock_upgrade(self):
+        lock = RWLock()
+        lock.acquire_read(owner=1)
+        assert lock.acquire_write(blocking=False, owner=1)
+        lock.release_write(owner=1)
+        lock.release_read(owner=1)
+        # two readers can't both upgrade
+        lock.acquire_read(owner=1)
+        lock.acquire_read(owner=2)
+        assert lock.acquire_write(blocking=False, owner=1) == False
+
+    # A waiting writer holds back new readers
+    def test_rwlock_writer_preferred(self):
+        lock = RWLock()
+        lock.acquire_read(owner=1)
+        got_write = threading.Event()
+
+        def writer():
+            lock.acquire_write(owner=2)
+            got_write.set()
+        t = threading.Thread(target=writer)
+        t.start()
+        while not lock._waiting_writers:
+            time.sleep(0.001)
+        assert lock.acquire_read(blocking=False, owner=3) == False
+        lock.release_read(owner=1)
+        t.join()
+        assert got_write.is_set()
+
+    def test_rwlock_release_unheld(self):
+        lock = RWLock()
+        with self.assertRaises(RuntimeError):
+            lock.release_read()
+        with self.assertRaises(RuntimeError):
+            lock.release_write()
+
+    # *** Handlers ***
+    def test_writer_blocks_other_threads(self):
+        wh = self.fs.getFileHandlerFromPath("f", is_write=True)
+        assert wh.open()
+        wh.write("draft")
+
+        def other(_):
+            rh = self.fs.getFileHandlerFromPath("f", is_write=False)
+            wh2 = self.fs.getFileHandlerFromPath("f", is_write=True)
+            return (rh.open(blocking=False), rh.open(timeout=0.01),
+                    wh2.open(timeout=0.01))
+        assert run_threads(1, other)[0] == (False, False, False)
+        # the same thread can still read while writing
+        assert self.fs.read_file("f") == "draft"
+        # but not open a second writer
+        assert self.fs.write_file("f", "x") == False
+        wh.close()
+        assert run_threads(1, other)[0] == (True, True, True)
+
+    def test_reader_blocks_writer(self):
+        rh = self.fs.getFileHandlerFromPath("f", is_write=False)
+        rh.open()
+
+        def write(_):
+            wh = self.fs.getFileHandlerFromPath("f", is_write=True)
+            return wh.open(blocking=False)
+        assert run_threads(1, write) == [False]
+        rh.close()
+        assert run_threads(1, write) == [True]
+
+    def test_blocked_reader_wakes_up(self):
+        wh = self.fs.getFileHandlerFromPath("f", is_write=True)
+        wh.open()
+        out = []
+        t = threading.Thread(target=lambda: out.append(self.fs.read_file("f")))
+        t.start()
+        wh.write("done")
+        wh.close()
+        t.join()
+        assert out == ["done"]
+
+    def test_close_from_other_thread(self):
+        wh = self.fs.getFileHandlerFromPath("f", is_write=True)
+        wh.open()
+        run_threads(1, lambda _: wh.close())
+        assert self.fs.write_file("f", "x") == True
+        # closing twice is a NOOp
+        wh.close()
+
+    def test_lock_timeout(self):
+        wh = self.fs.getFileHandlerFromPath("f", is_write=True)
+        wh.open()
+        self.fs.lock_timeout = 0.01
+        assert run_threads(1, lambda _: self.fs.read_file("f")) == [""]
+        wh.close()
+
+    # *** Namespace operations ***
+    def test_concurrent_writers_are_serialized(self):
+        def append(i):
+            for _ in range(50):
+                self.fs.write_file("f", "x", "-c")
+        run_threads(8, append)
+        assert self.fs.read_file("f") == "x" * 400
+
+    def test_concurrent_mkdir_same_name(self):
+        results = run_threads(8, lambda i: self.fs.mkdir("/d"))
+        assert len([d for d in results if d is not None]) == 1
+
+    def test_concurrent_mkdir_p(self):
+        run_threads(8, lambda i: self.fs.mkfile("/a/b/c/file" + str(i), "-p"))
+        self.fs.changedir("/a/b/c")
+        assert sorted(self.fs.list_files()) == ["file" + str(i) for i in range(8)]
+        assert len(self.fs.find_with_regex("file", "/", "-r")[0]) == 8
+
+    def test_concurrent_subtrees(self):
+        def work(i):
+            root = "/t" + str(i)
+            for j in range(30):
+                self.fs.mkfile(root + "/d" + str(j) + "/file", "-p")
+                self.fs.write_file(root + "/d" + str(j) + "/file", str(j))
+            for j in range(0, 30, 2):
+                self.fs.remove_dir(root + "/d" + str(j))
+            self.fs.move_dir(root + "/d1", root + "/moved")
+            self.fs.copy_dir(root, "/copy" + str(i))
+        run_threads(8, work)
+        files = self.fs.find_with_regex("file", "/", "-r")[0]
+        # 15 files left per tree, plus the copies
+        assert len(files) == 8 * 15 * 2
+        for i in range(8):
+            assert self.fs.read_file("/t%d/moved/file" % i) == "1"
+            assert self.fs.read_file("/copy%d/d3/file" % i) == "3"
+
+    # Two threads moving folders into each other can't create a cycle
+    def test_concurrent_moves_no_cycle(self):
+        self.fs.mkdir("/a")
+        self.fs.mkdir("/b")
+        results = run_threads(2, lambda i: self.fs.move_dir(
+            ["/a", "/b"][i], ["/b/", "/a/"][i]))
+        assert sorted(results) == [False, True]
+        assert len(self.fs.find_with_regex("[ab]", "/", "-r")[1]) == 2
+
+    def test_concurrent_file_moves(self):
+        self.fs.mkdir("/dst")
+        results = run_threads(8, lambda i: self.fs.move_file("/f", "/dst/", "-n"))
+        assert results.count(True) == 1
+        self.fs.changedir("/dst")
+        assert self.fs.list_files() == ["f"]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import sys
+import unittest
+from benchmarks.memory_bench import CASES, bytes_per_node
+from filesystem import *
+
+
+# Tests the compact node representation
+class TestMemory(unittest.TestCase):
+
+    def setUp(self):
+        self.fs = Filesystem()
+
+    def test_no_dict(self):
+        self.fs.mkfile("/d/f", "-p")
+        d = self.fs.get_directory("/d")
+        f = d.get_file("f")
+        for obj in (d, f, f.store, self.fs.getFileHandlerFromPath("/d/f", True),
+                    self.fs.getFileHandlerFromPath("/d/f", False)):
+            assert not hasattr(obj, "__dict__"), type(obj)
+
+    # Child maps are only allocated once a child is added
+    def test_lazy_children(self):
+        d = self.fs.mkdir("/d")
+        assert d._subfolders is None and d._files is None
+        assert d.subfolders == {} and d.files == {}
+        assert d.remove_file("missing") is None
+        self.fs.mkfile("/d/f")
+        assert d._subfolders is None
+        assert list(d.files) == ["f"]
+
+    def test_interned_names(self):
+        self.fs.mkfile("/a/" + "".join(["na", "me"]), "-p")
+        self.fs.mkfile("/b/" + "".join(["nam", "e"]), "-p")
+        a = self.fs.get_directory("/a").get_file("name")
+        b = self.fs.get_directory("/b").get_file("name")
+        assert a.name is b.name
+        self.fs.move_file("/a/name", "/a/" + "".join(["ren", "amed"]))
+        assert next(iter(self.fs.get_directory("/a").files)) is sys.intern("renamed")
+
+    # The lock & read handler set are only allocated when a handler opens
+    def test_lazy_handler_bookkeeping(self):
+        f = self.fs.mkfile("/f")
+        assert f._lock is None and f.read_handlers is None
+        rh = self.fs.getFileHandlerFromPath("/f", False)
+        rh.open()
+        assert f.read_handlers == {rh}
+        rh.close()
+        assert f.read_handlers == set()
+
+    # The name index holds a single node directly, a set for repeats
+    def test_name_index_entries(self):
+        for path in ("/a/x", "/b/x", "/c/x"):
+            self.fs.mkfile(path, "-p")
+        assert len(self.fs.find_with_regex("x", "/", "-r")[0]) == 3
+        self.fs.remove_dir("/a")
+        self.fs.remove_dir("/b")
+        assert self.fs.find_with_regex("x", "/", "-r")[0] == ["/c/x"]
+        self.fs.remove_file("/c/x")
+        assert self.fs.find_with_regex("x", "/", "-r")[0] == []
+
+    def test_memory_bench_runs(self):
+        for name, build in CASES:
+            assert bytes_per_node(build, 200) > 0, name
+
+
+if __name__ == '__main__':
+    unittest.main()
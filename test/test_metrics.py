@@ -0,0 +1,126 @@
+import contextlib
+import io
+import tempfile
+import unittest
+from filesystem import Filesystem
+from metrics import Histogram
+from simulator import Simulator
+
+
+# Tests for the opt-in per-operation metrics
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.fs = Filesystem()
+
+    def test_disabled(self):
+        assert self.fs.metrics() is None
+        self.fs.mkdir("/a")
+        # nothing shadows the class methods
+        assert "mkdir" not in vars(self.fs)
+        self.fs.enable_metrics()
+        assert "mkdir" in vars(self.fs)
+        self.fs.disable_metrics()
+        assert "mkdir" not in vars(self.fs)
+        assert "getFileHandlerFromPath" not in vars(self.fs)
+        assert self.fs.metrics() is None
+
+    def test_counts_and_errors(self):
+        self.fs.enable_metrics()
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.fs.mkdir("/a")
+            self.fs.mkdir("/a")
+            self.fs.changedir("/missing")
+        stats = self.fs.metrics()
+        assert stats["mkdir"]["calls"] == 2
+        assert stats["mkdir"]["errors"] == 1
+        assert stats["changedir"]["errors"] == 1
+        latency = stats["mkdir"]["latency_us"]
+        assert 0 < latency["min"] <= latency["p50"] <= latency["p99"] <= latency["max"]
+
+    def test_bytes(self):
+        self.fs.enable_metrics()
+        self.fs.mkfile("/f")
+        self.fs.write_file("/f", "hello")
+        self.fs.write_file("/f", "world", "-a")
+        assert self.fs.read_file("/f") == "hello\nworld"
+        stats = self.fs.metrics()
+        assert stats["write_file"]["bytes_in"] == 10
+        assert stats["read_file"]["bytes_out"] == 11
+
+    def test_handlers(self):
+        self.fs.enable_metrics()
+        self.fs.mkfile("/f")
+        wh = self.fs.getFileHandlerFromPath("/f", is_write=True)
+        wh.open()
+        wh.write("one\ntwo")
+        wh.move_cursor_abs(0)
+        wh.insert("zero\n")
+        wh.close()
+        rh = self.fs.getFileHandlerFromPath("/f", is_write=False)
+        rh.open()
+        assert rh.read_line() == "zero\n"
+        assert rh.read_to_end() == "one\ntwo"
+        rh.close()
+        stats = self.fs.metrics()
+        assert stats["WriteHandler.write"]["bytes_in"] == 7
+        assert stats["WriteHandler.insert"]["bytes_in"] == 5
+        assert stats["ReadHandler.read_line"]["bytes_out"] == 5
+        assert stats["ReadHandler.read_to_end"]["bytes_out"] == 7
+
+    def test_exceptions_count(self):
+        self.fs.enable_metrics()
+        self.fs.mkfile("/f")
+        rh = self.fs.getFileHandlerFromPath("/f", is_write=False)
+        rh.open()
+        with self.assertRaises(TypeError):
+            rh.read_view()
+        rh.close()
+        assert self.fs.metrics()["ReadHandler.read_view"]["errors"] == 1
+
+    def test_reset(self):
+        metrics = self.fs.enable_metrics()
+        self.fs.mkdir("/a")
+        metrics.reset()
+        assert self.fs.metrics() == {}
+        assert self.fs.enable_metrics() is metrics
+
+    # Batches & journal replay still reach the unjournaled methods
+    def test_batch_with_journal(self):
+        with tempfile.TemporaryDirectory() as directory:
+            fs = Filesystem.recover(directory)
+            fs.enable_metrics()
+            results = fs.batch([("mkdir", "/a"), ("mkfile", "/a/f"), ("write_file", "/a/f", "x")])
+            assert all(results)
+            assert fs.metrics()["batch"]["calls"] == 1
+            fs.close()
+            fs = Filesystem.recover(directory)
+            assert fs.read_file("/a/f") == "x"
+            fs.close()
+
+    def test_histogram(self):
+        histogram = Histogram()
+        for value in range(1, 10001):
+            histogram.record(value)
+        # within a bucket's width (1/16) of the exact value
+        assert abs(histogram.percentile(50) - 5000) <= 5000 / 16
+        assert abs(histogram.percentile(99) - 9900) <= 9900 / 16
+        assert histogram.percentile(100) == 10000
+        assert histogram.mean() == 5000.5
+        small = Histogram()
+        for value in (3, 3, 7):
+            small.record(value)
+        assert small.percentile(50) == 3
+        assert small.percentile(100) == 7
+
+    def test_simulator_stats(self):
+        simulator = Simulator(metrics=True)
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(io.StringIO()):
+            simulator.run_script(io.StringIO("mkdir /a\nmkdir /a\nstats\n"))
+        row = [line for line in out.getvalue().splitlines() if line.startswith("mkdir")][0]
+        assert row.split()[1:3] == ["2", "1"]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import contextlib
+import io
+import unittest
+from simulator import Simulator, percentile
+
+
+# Tests running the cmdline simulator on a script
+class TestSimulator(unittest.TestCase):
+
+    def run_script(self, script: str) -> tuple[Simulator, str, str]:
+        simulator = Simulator()
+        out = io.StringIO()
+        err = io.StringIO()
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            simulator.run_script(io.StringIO(script))
+        return simulator, out.getvalue(), err.getvalue()
+
+    def test_script(self):
+        simulator, out, err = self.run_script(
+            "mkdir -p /a/b\n"
+            "# a comment\n"
+            "\n"
+            "mkfile /a/b/f\n"
+            "write /a/b/f hello world\n"
+            "write -a /a/b/f again\n"
+            "editmode /a/b/f\n"
+            "seek_line r 1\n"
+            "read_to_end\n"
+            "exit\n"
+            "cd /a\n"
+            "pwd\n"
+            "bogus\n"
+            "exit\n"
+            "pwd\n")
+        # no prompts or echo, only the commands' output
+        assert out == "again\n/a\nInvalid Command\n"
+        assert simulator.filesystem.read_file("/a/b/f") == "hello world\nagain"
+        assert sorted(simulator.latencies) == [
+            "bogus", "cd", "mkdir", "mkfile", "pwd", "read_to_end", "seek_line", "write"]
+        assert len(simulator.latencies["write"]) == 2
+        assert err.startswith("*** 9 commands in ")
+        assert "p99 us" in err
+
+    # A failing command doesn't stop the script
+    def test_errors_continue(self):
+        simulator, out, err = self.run_script("write\nmkdir /d\n")
+        assert simulator.filesystem.list_folders() == ["d"]
+        assert "list index out of range" in out
+
+    # Metrics are off until the first stats command
+    def test_stats(self):
+        simulator, out, err = self.run_script("mkdir /a\nstats\nmkdir /b\nstats\n")
+        lines = out.splitlines()
+        assert lines[0] == "Metrics on, operations are recorded from now on"
+        assert lines[1].startswith("operation")
+        assert lines[2].split()[:3] == ["mkdir", "1", "0"]
+        assert Simulator().filesystem.metrics() is None
+        assert Simulator(metrics=True).filesystem.metrics() is not None
+
+    def test_percentile(self):
+        values = [float(i) for i in range(1, 101)]
+        assert percentile(values, 50) == 50
+        assert percentile(values, 99) == 99
+        assert percentile(values, 100) == 100
+        assert percentile([7.0], 0) == 7
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+from filesystem import *
+
+
+# Tests point-in-time snapshots and restore
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.fs = Filesystem()
+        self.fs.mkfile("/d1/d2/file", "-p")
+        self.fs.write_file("/d1/d2/file", "v1")
+        self.fs.mkfile("/top")
+
+    def test_snapshot_keeps_old_tree(self):
+        snap = self.fs.snapshot("s")
+        self.fs.write_file("/d1/d2/file", "v2")
+        self.fs.mkdir("/d1/new")
+        self.fs.remove_file("/top")
+        self.fs.move_dir("/d1/d2", "/moved")
+        # snapshot sees the tree as it was
+        assert snap.read_file("/d1/d2/file") == "v1"
+        assert snap.list_files() == ["top"]
+        snap.changedir("/d1")
+        assert snap.list_folders() == ["d2"]
+        assert snap.find_with_regex("file", "/", "-r") == (["/d1/d2/file"], [])
+        # live tree has the changes
+        assert self.fs.read_file("/moved/file") == "v2"
+        assert self.fs.list_files() == []
+
+    def test_snapshot_is_lazy(self):
+        snap = self.fs.snapshot()
+        assert snap.root.is_lazy
+        # a change only copies the folders along its path
+        self.fs.write_file("/top", "changed")
+        assert not snap.root.is_lazy
+        assert snap.root.get_subfolder("d1").is_lazy
+
+    def test_snapshot_read_only(self):
+        snap = self.fs.snapshot()
+        assert snap.mkdir("/x") is None
+        assert snap.mkfile("/x") is None
+        assert snap.write_file("/top", "x") == False
+        assert snap.remove_file("/top") == False
+        assert snap.remove_dir("/d1") == False
+        assert snap.move_file("/top", "/d1/") == False
+        assert snap.copy_dir("/d1", "/d3") == False
+        assert snap.getFileHandlerFromPath("/top", is_write=True) is None
+        rh = snap.getFileHandlerFromPath("/d1/d2/file", is_write=False)
+        rh.open()
+        assert rh.read() == "v1"
+        rh.close()
+
+    def test_restore(self):
+        self.fs.snapshot("s")
+        self.fs.changedir("/d1/d2")
+        self.fs.write_file("/d1/d2/file", "v2")
+        self.fs.remove_dir("/d1")
+        self.fs.mkfile("/after")
+        assert self.fs.restore("s") == True
+        assert self.fs.read_file("/d1/d2/file") == "v1"
+        assert self.fs.list_files() == ["file"]
+        assert self.fs.get_current_path() == "/d1/d2"
+        self.fs.changedir("/")
+        assert self.fs.list_files() == ["top"]
+        assert self.fs.find_with_regex("file", "/", "-r") == (["/d1/d2/file"], [])
+
+    # changes after a restore don't leak back into the snapshot
+    def test_restore_twice(self):
+        snap = self.fs.snapshot("s")
+        self.fs.restore(snap)
+        self.fs.write_file("/d1/d2/file", "v2")
+        self.fs.mkfile("/d1/other")
+        assert snap.read_file("/d1/d2/file") == "v1"
+        self.fs.restore(snap)
+        assert self.fs.read_file("/d1/d2/file") == "v1"
+        assert self.fs.find_with_regex("other", "/", "-r") == ([], [])
+
+    def test_list_and_drop(self):
+        self.fs.snapshot("a")
+        self.fs.snapshot()
+        assert self.fs.snapshot("a") is None
+        assert self.fs.list_snapshots() == ["a", "snapshot1"]
+        assert self.fs.drop_snapshot("a") == True
+        assert self.fs.drop_snapshot("a") == False
+        assert self.fs.restore("a") == False
+        assert self.fs.list_snapshots() == ["snapshot1"]
+
+
+if __name__ == '__main__':
+    unittest.main()
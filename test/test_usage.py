@@ -0,0 +1,320 @@
+import contextlib
+import io
+import os
+import random
+import tarfile
+import tempfile
+import threading
+import unittest
+from errors import ErrorCode, last_error
+from filesystem import Filesystem
+from objects import Directory, File
+from simulator import Simulator
+
+
+# Tests the per-folder usage totals (du, stat) and quotas
+class TestUsage(unittest.TestCase):
+
+    def setUp(self):
+        self.fs = Filesystem()
+
+    def write(self, path: str, contents) -> None:
+        self.fs.mkfile(path, "-p", isinstance(contents, bytes))
+        self.fs.write_file(path, contents)
+
+    def du(self, path: str = "/") -> tuple:
+        usage = self.fs.du(path)
+        return (usage["bytes"], usage["files"], usage["dirs"])
+
+    # Every folder's totals match walking it
+    def assert_consistent(self, fs: Filesystem) -> None:
+        dirs = [fs.root] + [node for _, node in fs.root.walk() if isinstance(node, Directory)]
+        for dir in dirs:
+            bytes = files = subfolders = 0
+            for _, node in dir.walk():
+                if (isinstance(node, File)):
+                    bytes += len(node.store)
+                    files += 1
+                else:
+                    subfolders += 1
+            assert dir.usage == (bytes, files, subfolders), dir.path
+
+    def test_totals(self):
+        self.write("/a/b/f", "hello")
+        self.write("/a/g", b"\x00\x01", )
+        self.fs.mkdir("/a/b/c/d", "-p")
+        assert self.du() == (7, 2, 4)
+        assert self.du("/a") == (7, 2, 3)
+        assert self.du("/a/b") == (5, 1, 2)
+        self.fs.write_file("/a/b/f", "!", "-a")
+        assert self.du("/a/b") == (7, 1, 2)
+        self.fs.remove_file("/a/g")
+        assert self.du() == (7, 1, 4)
+        self.fs.remove_dir("/a/b")
+        assert self.du() == (0, 0, 1)
+        assert self.fs.du("/missing") is None
+        assert last_error().code == ErrorCode.INVALID_PATH
+
+    def test_handler_edits(self):
+        self.write("/d/f", "abc")
+        wh = self.fs.getFileHandlerFromPath("/d/f", True)
+        wh.open()
+        wh.move_cursor_abs(1)
+        assert wh.insert("xy")
+        assert wh.concat("z")
+        assert self.du("/d") == (6, 1, 0)
+        assert wh.write("")
+        wh.close()
+        assert self.du() == (0, 1, 1)
+
+    # Moves & copies carry the totals along, in O(1) for folders
+    def test_move_copy(self):
+        self.write("/src/a/f", "12345")
+        self.write("/src/g", "67")
+        self.fs.mkdir("/dst")
+        self.fs.copy_dir("/src", "/dst/copy")
+        assert self.du("/dst") == (7, 2, 2)
+        assert self.fs.get_directory("/dst/copy").is_lazy
+        self.fs.move_dir("/src/a", "/dst/a")
+        assert self.du("/src") == (2, 1, 0)
+        assert self.du("/dst") == (12, 3, 3)
+        self.fs.copy_file("/src/g", "/dst/a/f", "-b")
+        assert self.du("/dst/a") == (7, 2, 0)
+        self.fs.move_file("/dst/a/~f", "/src/h")
+        assert self.du("/src") == (7, 2, 0)
+        assert self.du() == (16, 5, 5)
+        # the copy's contents are shared until written
+        self.fs.write_file("/dst/copy/a/f", "1")
+        assert self.du("/dst/copy") == (3, 2, 1)
+        assert self.du("/dst/a") == (2, 1, 0)
+        self.assert_consistent(self.fs)
+
+    # Snapshots keep the totals they were taken with, rollbacks restore them
+    def test_snapshot_batch(self):
+        self.write("/d/f", "abc")
+        snapshot = self.fs.snapshot("s")
+        self.write("/d/g", "defg")
+        assert snapshot.du("/d") == {"bytes": 3, "files": 1, "dirs": 0}
+        assert self.du("/d") == (7, 2, 0)
+        results = self.fs.batch([("mkfile", "/d/h"), ("write_file", "/d/h", "x" * 10),
+                                 ("remove_file", "/missing")], atomic=True)
+        assert results[-1] is False
+        assert self.du() == (7, 2, 1)
+        self.fs.restore("s")
+        assert self.du() == (3, 1, 1)
+        self.assert_consistent(self.fs)
+
+    # Images keep the totals & quotas of folders that aren't read yet
+    def test_image(self):
+        self.write("/a/b/f", "hello")
+        self.write("/a/b/c/g", "wörld")
+        self.fs.set_quota("/a/b", 100, 10)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "image")
+            assert self.fs.save(path)
+            fs = Filesystem.load(path)
+            assert fs.du("/a/b") == {"bytes": 10, "files": 2, "dirs": 1}
+            assert fs.get_directory("/a/b").is_lazy
+            assert fs.stat("/a/b/")["max_bytes"] == 100
+            assert not fs.mkfile("/a/b/h") is None
+            assert not fs.write_file("/a/b/h", "x" * 91)
+            assert last_error().code == ErrorCode.QUOTA_EXCEEDED
+            self.assert_consistent(fs)
+
+    # Growth past a byte quota fails and changes nothing
+    def test_quota_bytes(self):
+        self.write("/q/f", "12345")
+        assert self.fs.set_quota("/q", max_bytes=8)
+        assert not self.fs.write_file("/q/f", "6789", "-c")
+        assert last_error().code == ErrorCode.QUOTA_EXCEEDED
+        assert self.fs.read_file("/q/f") == "12345"
+        assert self.fs.write_file("/q/f", "678", "-c")
+        wh = self.fs.getFileHandlerFromPath("/q/f", True)
+        wh.open()
+        assert wh.insert("x") is False
+        assert last_error().code == ErrorCode.QUOTA_EXCEEDED
+        assert wh.write("short")
+        wh.close()
+        # a quota higher up caps the folders under it too
+        self.write("/q/sub/g", "ab")
+        assert self.fs.set_quota("/q", None, None)
+        assert self.fs.set_quota("/", max_bytes=9)
+        assert not self.fs.write_file("/q/sub/g", "abcde")
+        assert self.fs.write_file("/q/sub/g", "ab", "-c")
+        assert self.du() == (9, 2, 2)
+
+    # Files + folders under a capped folder, checked for every way in
+    def test_quota_inodes(self):
+        self.fs.mkdir("/q")
+        self.fs.set_quota("/q", max_inodes=3)
+        self.write("/q/f", "x")
+        # mkdir -p creates the missing parents all or nothing
+        assert self.fs.mkdir("/q/a/b/c/d", "-p") is None
+        assert self.fs.du("/q") == {"bytes": 1, "files": 1, "dirs": 0}
+        assert self.fs.mkdir("/q/a/b", "-p") is not None
+        assert self.fs.mkdir("/q/a/c") is None
+        assert last_error().code == ErrorCode.QUOTA_EXCEEDED
+        assert self.fs.mkfile("/q/g") is None
+        assert self.fs.copy_file("/q/f", "/q/f2") is False
+        # replacing adds no inode
+        assert self.fs.copy_file("/q/f", "/q/a/b/") is False
+        self.write("/other/h", "y")
+        assert self.fs.move_file("/other/h", "/q/f")
+        self.fs.mkdir("/big/c", "-p")
+        assert self.fs.move_dir("/big", "/q/a/big") is False
+        assert self.fs.get_directory("/big/c") is not None
+        assert self.fs.copy_dir("/big", "/q/a/big") is False
+        # moving within the quota is fine
+        assert self.fs.move_dir("/q/a/b", "/q/b")
+        assert self.fs.stat("/q/")["files"] == 1
+        self.assert_consistent(self.fs)
+
+    # Importing into a capped folder stops at the quota, replaced files stay
+    def test_quota_import(self):
+        self.write("/q/a", "old")
+        self.fs.set_quota("/q", max_bytes=20)
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode="w") as tar:
+            for name, data in (("b", b"0123456789"), ("a", b"x" * 20)):
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+        archive.seek(0)
+        assert self.fs.import_tar(archive, "/q") is None
+        assert last_error().code == ErrorCode.QUOTA_EXCEEDED
+        assert self.fs.read_file("/q/a") == "old"
+        assert self.fs.read_file("/q/b") == "0123456789"
+
+    def test_quota_journal(self):
+        with tempfile.TemporaryDirectory() as directory:
+            fs = Filesystem.recover(directory, fsync=False)
+            fs.mkdir("/q")
+            fs.set_quota("/q", 4)
+            fs.mkfile("/q/f")
+            assert not fs.write_file("/q/f", "12345")
+            fs.write_file("/q/f", "1234")
+            fs.close()
+            fs = Filesystem.recover(directory, fsync=False)
+            assert fs.stat("/q/")["max_bytes"] == 4
+            assert not fs.write_file("/q/f", "5", "-c")
+            fs.checkpoint()
+            fs.close()
+            fs = Filesystem.recover(directory, fsync=False)
+            assert fs.du("/q")["bytes"] == 4
+            assert not fs.write_file("/q/f", "5", "-c")
+            fs.close()
+
+    def test_stat(self):
+        self.write("/d/f", "hi")
+        self.fs.mkdir("/d/f")
+        self.fs.copy_file("/d/f", "/d/g")
+        assert self.fs.stat("/d/f") == {"type": "file", "path": "/d/f", "bytes": 2, "binary": False,
+                                        "shared": True, "resident_bytes": 2}
+        assert self.fs.stat("/d/f/")["type"] == "dir"
+        self.fs.set_quota("/d", 100)
+        assert self.fs.stat("/d") == {"type": "dir", "path": "/d", "bytes": 4, "files": 2, "dirs": 1,
+                                      "max_bytes": 100, "max_inodes": None}
+        self.fs.changedir("/d/f")
+        assert self.fs.stat("..")["path"] == "/d"
+        assert self.fs.stat("/")["dirs"] == 2
+        assert self.fs.stat("/d/missing") is None
+        assert last_error().code == ErrorCode.INVALID_PATH
+
+    def test_quota_errors(self):
+        assert self.fs.set_quota("/missing", 1) is False
+        assert last_error().code == ErrorCode.INVALID_PATH
+        with self.assertRaises(ValueError):
+            self.fs.set_quota("/", -1)
+        assert self.fs.snapshot("s").set_quota("/", 1) is False
+        assert last_error().code == ErrorCode.READ_ONLY
+        fs = Filesystem(raise_errors=True)
+        fs.set_quota("/", max_inodes=0)
+        with self.assertRaises(Exception) as raised:
+            fs.mkdir("/a/b", "-p")
+        assert raised.exception.code == ErrorCode.QUOTA_EXCEEDED
+
+    # Random operations (copies, moves, snapshots, batches...) keep every
+    # folder's totals exact
+    def test_random_ops(self):
+        rng = random.Random(0)
+        fs = Filesystem(dedup=True)
+
+        def path() -> str:
+            return "/" + "/".join(rng.choice("abc") for _ in range(rng.randint(1, 3)))
+        for _ in range(1500):
+            op = rng.randrange(10)
+            option = rng.choice(["", "-b", "-n", "-p"])
+            if (op == 0):
+                fs.mkdir(path(), "-p")
+            elif (op == 1):
+                fs.mkfile(path(), "-p")
+            elif (op == 2):
+                fs.write_file(path(), "x" * rng.randrange(20), rng.choice(["", "-a", "-c"]))
+            elif (op == 3):
+                fs.remove_file(path())
+            elif (op == 4 and rng.random() < 0.3):
+                fs.remove_dir(path())
+            elif (op == 5):
+                fs.move_file(path(), path(), option)
+            elif (op == 6):
+                fs.copy_dir(path(), path(), option)
+            elif (op == 7):
+                fs.move_dir(path(), path(), option)
+            elif (op == 8):
+                fs.snapshot() if rng.random() < 0.5 else fs.restore(rng.choice(fs.list_snapshots() or ["none"]))
+            else:
+                fs.set_quota(path(), rng.choice([None, rng.randrange(60)]), rng.choice([None, rng.randrange(8)]))
+        self.assert_consistent(fs)
+        for name in fs.list_snapshots():
+            self.assert_consistent(fs.snapshots[name])
+
+    # Writers & folder moves racing keep the totals exact
+    def test_threads(self):
+        for t in range(4):
+            self.write("/t%d/x/y/f" % t, "")
+
+        def writer(t: int) -> None:
+            wh = self.fs.getFileHandlerFromPath("/t%d/x/y/f" % t, True)
+            for i in range(300):
+                wh.open()
+                wh.concat("ab")
+                wh.close()
+                self.fs.mkfile("/t%d/x/g%d" % (t, i))
+
+        def mover(seed: int) -> None:
+            rng = random.Random(seed)
+            for _ in range(150):
+                a, b = rng.sample(range(4), 2)
+                self.fs.move_dir("/t%d/x" % a, "/t%d/x" % b, "-n")
+                self.fs.move_dir("/t%d/x" % b, "/t%d/x" % a, "-n")
+                self.fs.move_file("/t%d/x/y/f" % a, "/t%d/x/f" % a)
+                self.fs.move_file("/t%d/x/f" % a, "/t%d/x/y/f" % a)
+        threads = [threading.Thread(target=writer, args=(t,)) for t in range(4)]
+        threads += [threading.Thread(target=mover, args=(seed,)) for seed in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert self.du() == (2400, 1204, 12)
+        self.assert_consistent(self.fs)
+
+    def test_simulator(self):
+        simulator = Simulator()
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            simulator.run_script(io.StringIO(
+                "mkfile -p /d/e/f\nwrite /d/e/f hello\nmkdir /d/g\nquota /d 7 -\n"
+                "write /d/e/f hello world\ndu /d\nstat /d\nstat /d/e/f\nquota /d x\n"))
+        assert out.getvalue().splitlines() == [
+            "Quota exceeded",
+            "           5 bytes        1 files        0 dirs  /d/e",
+            "           0 bytes        0 files        0 dirs  /d/g",
+            "           5 bytes        1 files        2 dirs  /d",
+            "dir /d: 5 bytes, 1 files, 2 dirs; quota 7 bytes",
+            "file /d/e/f: 5 bytes, text",
+            "Quotas are numbers >= 0, or - for no cap",
+        ]
+
+
+if __name__ == '__main__':
+    unittest.main()